@@ -0,0 +1,92 @@
+"""
+Detects a frame offset between a transcode and its reference (e.g. a transcode with a dropped leading frame)
+before the full libvmaf pass, by comparing tiny luma thumbnails of the first few seconds of both videos.
+"""
+
+from fractions import Fraction
+
+import numpy as np
+
+from quick_metrics import get_quick_metrics_resolution, RawLumaReader
+from utils import Logger
+
+log = Logger("alignment")
+
+THUMBNAIL_HEIGHT = 36
+ALIGNMENT_SECONDS = 5
+# The best offset is only used if its score beats the score of no offset by at least this much,
+# so static or near-identical frames never cause a trim.
+MINIMUM_IMPROVEMENT = 0.02
+
+
+def read_thumbnails(video_path, width, height, fps, frame_count, video_filters=None):
+    frames = np.empty((frame_count, height, width), dtype=np.uint8)
+    reader = RawLumaReader(video_path, width, height, fps, video_filters, frame_count)
+    try:
+        frames_read = reader.read_into(frames)
+    finally:
+        reader.close()
+    return frames[:frames_read]
+
+
+def _normalise(vectors):
+    # Zero mean and unit length, so that the dot product of two rows is their correlation coefficient.
+    vectors = vectors - vectors.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-6)
+
+
+def _correlate(distorted, reference, max_offset):
+    """
+    Returns the mean correlation of distorted frame i with reference frame i + offset, for every offset
+    from -max_offset to max_offset. Offsets that leave fewer than half of the frames overlapping score -inf.
+    """
+    # Every distorted frame against every reference frame in a single matrix product.
+    correlation = _normalise(distorted) @ _normalise(reference).T
+    minimum_overlap = max(1, min(correlation.shape) // 2)
+
+    scores = np.full(2 * max_offset + 1, -np.inf)
+    for i, offset in enumerate(range(-max_offset, max_offset + 1)):
+        diagonal = np.diagonal(correlation, offset)
+        if len(diagonal) >= minimum_overlap:
+            scores[i] = diagonal.mean()
+    return scores
+
+
+def find_frame_offset(distorted_path, reference_path, fps, video_filters=None, max_offset=24):
+    """
+    Returns the offset that aligns the videos: distorted frame i shows reference frame i + offset.
+    A positive offset means that the transcode is missing leading frames, a negative offset means that it has
+    extra leading frames.
+    """
+    width, height = get_quick_metrics_resolution(reference_path, THUMBNAIL_HEIGHT)
+    frame_count = round(ALIGNMENT_SECONDS * float(Fraction(fps))) + max_offset
+
+    log.info(f"Checking the frame alignment of the first {ALIGNMENT_SECONDS} seconds...")
+    distorted = read_thumbnails(distorted_path, width, height, fps, frame_count)
+    reference = read_thumbnails(reference_path, width, height, fps, frame_count, video_filters)
+    if len(distorted) < 3 or len(reference) < 3:
+        log.info("Not enough frames to check the frame alignment.")
+        return 0
+
+    distorted = distorted.reshape(len(distorted), -1).astype(np.float32)
+    reference = reference.reshape(len(reference), -1).astype(np.float32)
+    max_offset = min(max_offset, len(distorted) - 2, len(reference) - 2)
+
+    # The frames themselves, and the differences between consecutive frames. The differences only line up at
+    # the right offset when there is motion, even if consecutive frames look alike.
+    scores = _correlate(distorted, reference, max_offset) + _correlate(
+        np.diff(distorted, axis=0), np.diff(reference, axis=0), max_offset
+    )
+    best_index = int(np.argmax(scores))
+    offset = best_index - max_offset
+
+    if offset == 0 or scores[best_index] - scores[max_offset] < MINIMUM_IMPROVEMENT:
+        log.info("The frames are aligned.")
+        return 0
+
+    if offset > 0:
+        log.info(f"The transcode is missing {offset} leading frame(s) of the original video.")
+    else:
+        log.info(f"The transcode has {-offset} extra leading frame(s).")
+    return offset
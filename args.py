@@ -1,13 +1,18 @@
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
-import os
+
+from encoders import ENCODERS
 
 parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
 
 encoding_args = parser.add_argument_group("Encoding Arguments")
+ladder_args = parser.add_argument_group("Bitrate Ladder Arguments")
 vmaf_args = parser.add_argument_group("VMAF Arguments")
 overview_mode_args = parser.add_argument_group("Overview Mode Arguments")
 general_args = parser.add_argument_group("General Arguments")
 optional_metrics_args = parser.add_argument_group("Optional Metrics")
+prescreen_args = parser.add_argument_group("Prescreen Arguments")
+worst_segments_args = parser.add_argument_group("Worst Segment Arguments")
+bitrate_analysis_args = parser.add_argument_group("Bitrate Analysis Arguments")
 
 # Set AV1 speed/quality ratio
 encoding_args.add_argument(
@@ -33,14 +38,52 @@ overview_mode_args.add_argument(
     "Specify a value for X (in the range 1-60)",
 )
 
+# How the Overview Mode clips are chosen.
+overview_mode_args.add_argument(
+    "--overview-strategy",
+    type=str,
+    default="interval",
+    choices=["interval", "scene"],
+    help='"interval" takes a clip every --interval seconds. "scene" runs a quick, downscaled scene change and '
+    "complexity analysis of the whole video and picks a small set of clips that covers the complexity "
+    "distribution of the video, avoiding clips that contain a scene change",
+)
+
+overview_mode_args.add_argument(
+    "--overview-clips",
+    type=int,
+    default=None,
+    help='The number of clips to use with --overview-strategy scene. '
+    "By default, half as many clips as the interval strategy would use",
+)
+
+# Bitrate/size ceilings.
+encoding_args.add_argument(
+    "--max-bitrate",
+    type=float,
+    default=None,
+    metavar="MBPS",
+    help="Abort an encode once its projected bitrate clearly exceeds this many Mbps. "
+    "The transcode is recorded as rejected and its VMAF is not calculated",
+)
+
+encoding_args.add_argument(
+    "--max-size",
+    type=float,
+    default=None,
+    metavar="MB",
+    help="Abort an encode once its projected size clearly exceeds this many MB. "
+    "The transcode is recorded as rejected and its VMAF is not calculated",
+)
+
 # CRF value(s).
 encoding_args.add_argument(
     "-crf",
     type=int,
-    choices=range(0, 52),
     nargs="+",
-    metavar="<0-51>",
-    help="Specify the CRF value(s) to use",
+    metavar="<CRF>",
+    help="Specify the CRF value(s) to use (0-51 for x264 and x265, 0-63 for libaom-av1, 1-63 for svt-av1). "
+    "For rav1e, this is the quantizer (0-255)",
 )
 
 # Number of decimal places to use for the data.
@@ -58,8 +101,9 @@ encoding_args.add_argument(
     "--video-encoder",
     type=str,
     default="x264",
-    choices=["x264", "x265", "libaom-av1"],
-    help="Specify whether to use the x264 (H.264), x265 (H.265) or libaom-av1 (AV1) encoder",
+    choices=list(ENCODERS),
+    help="Specify the encoder: "
+    + ", ".join(backend.description for backend in ENCODERS.values()),
 )
 
 # The time interval for Overview Mode.
@@ -89,8 +133,37 @@ vmaf_args.add_argument(
 vmaf_args.add_argument(
     "--n-threads",
     type=str,
-    default=str(os.cpu_count()),
-    help="Specify the number of threads to use when calculating VMAF",
+    default=None,
+    help="Specify the number of threads to use when calculating VMAF. "
+    "If not specified, this is worked out from the thread budget (see --concurrent-jobs)",
+)
+
+# Set the number of threads to be used by the encoder.
+encoding_args.add_argument(
+    "--encoder-threads",
+    type=int,
+    default=None,
+    help="Specify the number of threads the encoder may use. "
+    "If not specified, this is worked out from the thread budget (see --concurrent-jobs)",
+)
+
+# The number of jobs (including other instances of VQM) expected to share this host.
+general_args.add_argument(
+    "--concurrent-jobs",
+    type=int,
+    default=1,
+    help="The number of encode/scoring jobs that are expected to run on this host at the same time, "
+    "including other instances of VQM. The available CPUs (respecting the CPU affinity and any cgroup CPU quota) "
+    "are split between them, and the encoder, FFmpeg filter and libvmaf thread counts are set accordingly",
+)
+
+# Pin the FFmpeg processes to a set of CPUs.
+general_args.add_argument(
+    "--cpu-set",
+    type=str,
+    default=None,
+    help="Only use and pin the FFmpeg processes to these CPUs, in the same format as taskset -c. "
+    "Example: --cpu-set 0-3,8",
 )
 
 # -ntm mode
@@ -112,6 +185,16 @@ general_args.add_argument(
     "If you want the name of the output folder to contain a space, the string must be surrounded in double quotes",
 )
 
+# Snap cuts to keyframes.
+general_args.add_argument(
+    "--snap-to-keyframes",
+    action="store_true",
+    help="Use a (cached) keyframe index of the original video so that cuts do not need to be re-encoded. "
+    "In Overview Mode, each clip starts at the keyframe at or before its position and is stream copied "
+    "instead of losslessly re-encoded. With -t/--encode-length, the cut is extended to the next keyframe "
+    "so that it only contains complete GOPs",
+)
+
 # Original Video Path
 general_args.add_argument(
     "-ovp",
@@ -128,26 +211,72 @@ encoding_args.add_argument(
     "-p",
     "--preset",
     type=str,
-    default="medium",
-    choices=[
-        "veryslow",
-        "slower",
-        "slow",
-        "medium",
-        "fast",
-        "faster",
-        "veryfast",
-        "superfast",
-        "ultrafast",
-    ],
+    default=None,
     nargs="+",
     metavar="<preset/s>",
-    help="Specify the preset(s) to use",
+    help="Specify the preset(s) to use. x264 and x265 use ultrafast to veryslow (medium by default), "
+    "svt-av1 uses 0-13 (8 by default) and rav1e uses the speeds 0-10 (6 by default). "
+    "libaom-av1 uses --av1-cpu-used instead",
 )
 
 # Phone Model
 vmaf_args.add_argument("--phone-model", action="store_true", help="Enable VMAF phone model")
 
+# VMAF model(s).
+vmaf_args.add_argument(
+    "--vmaf-models",
+    type=str,
+    nargs="+",
+    default=None,
+    choices=["hd", "4k", "phone"],
+    help="The VMAF model(s) to use. All of the models are calculated in a single libvmaf pass, "
+    "and each model gets its own table column and graph. The first model is used for the comparison graph. "
+    "Example: --vmaf-models hd 4k phone (default: hd, or phone if --phone-model is specified)",
+)
+
+# Input negotiation.
+vmaf_args.add_argument(
+    "--vmaf-scaler",
+    type=str,
+    default="bicubic",
+    choices=["bicubic", "bilinear", "lanczos", "spline", "area", "neighbor"],
+    help="The scaler that is used when the transcode and the original video have different resolutions. "
+    "The input with the lower resolution is scaled to the resolution of the other",
+)
+
+vmaf_args.add_argument(
+    "--implicit-conversions",
+    action="store_true",
+    help="Let FFmpeg choose the pixel format conversions in the libvmaf filter graph instead of probing both "
+    "videos and converting one of them explicitly. The videos must have the same resolution",
+)
+
+# Duplicate frames.
+vmaf_args.add_argument(
+    "--skip-duplicate-frames",
+    action="store_true",
+    help="Only calculate the VMAF of the first two frames of each run of identical frames (in both the transcode "
+    "and the original video), and reuse the scores for the rest of the run. The scores are the same as without "
+    "this option. Useful for animation, slideshows and videos with long static holds",
+)
+
+# Frame alignment.
+vmaf_args.add_argument(
+    "--align",
+    action="store_true",
+    help="Before calculating the VMAF, compare tiny thumbnails of the first few seconds of the transcode "
+    "and the original video to detect dropped or extra leading frames, and trim the input that is ahead "
+    "so that the frames line up",
+)
+
+vmaf_args.add_argument(
+    "--max-frame-offset",
+    type=int,
+    default=24,
+    metavar="<frames>",
+    help="The largest offset (in frames, in either direction) that --align looks for",
+)
+
 # PSNR
 optional_metrics_args.add_argument(
     "-psnr",
@@ -156,6 +285,163 @@ optional_metrics_args.add_argument(
     help="Enable PSNR calculation in addition to VMAF",
 )
 
+# Machine-readable results.
+general_args.add_argument(
+    "--results-format",
+    type=str,
+    nargs="+",
+    default=["jsonl", "csv"],
+    choices=["jsonl", "csv", "parquet"],
+    help="The format(s) of the machine-readable results that are appended after each transcode is scored. "
+    "Results.jsonl is always written. Writing Results.parquet requires pyarrow",
+)
+
+# SQLite results database.
+general_args.add_argument(
+    "--results-db",
+    type=str,
+    default=None,
+    metavar="PATH",
+    help="Also record the results in this SQLite database, which can be shared by multiple runs. "
+    "It can be queried with results_db.py, e.g. python results_db.py results.db best --min-vmaf 95",
+)
+
+general_args.add_argument(
+    "--reuse-results",
+    action="store_true",
+    help="Only applicable if --results-db is specified. If a transcode of the same source with the same settings "
+    "was scored by a previous run (and its files still exist), reuse its results instead of transcoding again",
+)
+
+# Supervision of the FFmpeg processes.
+general_args.add_argument(
+    "--stall-timeout",
+    type=int,
+    default=300,
+    metavar="SECONDS",
+    help="Kill an FFmpeg process if it makes no progress for this many seconds (0 disables the watchdog)",
+)
+
+general_args.add_argument(
+    "--max-retries",
+    type=int,
+    default=2,
+    help="The number of times a failed or stalled encode/VMAF calculation is retried. "
+    "If every attempt fails, only that transcode is marked as failed and the rest of the comparison continues",
+)
+
+general_args.add_argument(
+    "--retry-backoff",
+    type=float,
+    default=5,
+    metavar="SECONDS",
+    help="The delay before the first retry. The delay doubles after each retry",
+)
+
+# Estimate the cost of the comparison without running it.
+general_args.add_argument(
+    "--plan",
+    action="store_true",
+    help="Show the estimated wall time, CPU time and scratch disk space of each transcode, then exit "
+    "without transcoding. The estimates are calibrated by previous runs on this machine",
+)
+
+general_args.add_argument(
+    "--cost-model",
+    type=str,
+    default=None,
+    metavar="PATH",
+    help="The file where the measured encoding/VMAF speed and transcode sizes are saved, "
+    "which calibrates the --plan estimates. Defaults to ~/.cache/video-quality-metrics/cost_model.json",
+)
+
+# Scratch space for the transcodes, cut references and overview clips.
+general_args.add_argument(
+    "--scratch-dir",
+    type=str,
+    default=None,
+    metavar="PATH",
+    help="Write the transcodes, the -t cut and the Overview Mode clips to this folder instead of the output folder. "
+    "Runs that use the same folder share the --scratch-budget",
+)
+
+general_args.add_argument(
+    "--ram-disk",
+    type=str,
+    default=None,
+    metavar="PATH",
+    help="A tmpfs folder (e.g. /dev/shm) where the transcodes, the -t cut and the Overview Mode clips are written "
+    "if their estimated size fits in its free space",
+)
+
+general_args.add_argument(
+    "--scratch-budget",
+    type=float,
+    default=None,
+    metavar="MB",
+    help="The maximum estimated size of the intermediate files of all of the runs that share the scratch space. "
+    "A transcode waits until there is enough space in the budget",
+)
+
+# Run the sweep points on other machines.
+general_args.add_argument(
+    "--distributed-queue",
+    type=str,
+    default=None,
+    metavar="PATH",
+    help="Submit each CRF/preset to a queue in this folder, to be encoded and scored by workers "
+    "(python distributed.py PATH) on this or other machines. The folder, the video and the output folder "
+    "must be available at the same path on every machine",
+)
+
+general_args.add_argument(
+    "--lease-timeout",
+    type=float,
+    default=120,
+    metavar="SECONDS",
+    help="Requeue a CRF/preset if its worker has not been heard from for this many seconds",
+)
+
+general_args.add_argument(
+    "--keep-transcodes",
+    action="store_true",
+    help="Keep the transcodes (and the -t cut) in the output folder. "
+    "By default, each transcode is deleted once its metrics have been saved",
+)
+
+# Cross-encoder comparison mode.
+encoding_args.add_argument(
+    "--compare-encoders",
+    type=str,
+    nargs="+",
+    default=None,
+    metavar="ENCODER:CRFS",
+    help="Compare several encoders. Each value is an encoder and its comma-separated CRF values. "
+    "The encoders run at the same time from a single decode, and the BD-rate/BD-VMAF of each encoder "
+    "compared to the first one is calculated. Example: --compare-encoders x264:18,22,26,30 x265:22,26,30,34",
+)
+
+# Bitrate ladder / convex hull mode.
+ladder_args.add_argument(
+    "--ladder",
+    type=int,
+    nargs="+",
+    default=None,
+    metavar="HEIGHT",
+    help="Activate ladder mode: encode the video at each of these heights with each -crf value, "
+    "score each rung upscaled to the resolution of the original video and save the rate-quality convex hull. "
+    "-vf filters must not change the resolution. Example: --ladder 1080 720 540 360 -crf 20 24 28 32",
+)
+
+ladder_args.add_argument(
+    "--ladder-prune-margin",
+    type=float,
+    default=2,
+    metavar="VMAF",
+    help="In ladder mode, a height is not encoded at higher CRFs once its VMAF is this much lower than "
+    "the convex hull formed by lower resolutions",
+)
+
 # Show the commands being run.
 general_args.add_argument(
     "-sc",
@@ -164,6 +450,15 @@ general_args.add_argument(
     help="Show the FFmpeg commands that are being run.",
 )
 
+general_args.add_argument(
+    "--log-format",
+    type=str,
+    default="text",
+    choices=["text", "json"],
+    help="The format of logs.log. json writes a JSON object per line, tagged with the run ID "
+    "(the --results-db run ID if specified) and the sweep point",
+)
+
 # SSIM
 optional_metrics_args.add_argument(
     "-ssim",
@@ -204,3 +499,75 @@ general_args.add_argument(
     help="Add FFmpeg video filter(s). Each filter must be separated by a comma. "
     "Example: -vf bwdif=mode=0,crop=1920:800:0:140",
 )
+
+# Prescreen the transcodes with a quick PSNR/SSIM before calculating VMAF.
+prescreen_args.add_argument(
+    "--prescreen",
+    action="store_true",
+    help="Before calculating the VMAF of each transcode, calculate a quick PSNR and SSIM of the downscaled luma. "
+    "Transcodes that do not reach --prescreen-min-psnr and/or --prescreen-min-ssim are rejected "
+    "and their VMAF is not calculated",
+)
+
+prescreen_args.add_argument(
+    "--prescreen-min-psnr",
+    type=float,
+    default=None,
+    help="The minimum mean quick PSNR (dB) that a transcode must reach when using --prescreen",
+)
+
+prescreen_args.add_argument(
+    "--prescreen-min-ssim",
+    type=float,
+    default=None,
+    help="The minimum mean quick SSIM (0-1) that a transcode must reach when using --prescreen",
+)
+
+prescreen_args.add_argument(
+    "--prescreen-height",
+    type=int,
+    default=270,
+    help="The height that the videos are downscaled to for the quick PSNR/SSIM calculation",
+)
+
+worst_segments_args.add_argument(
+    "--worst-segments",
+    type=int,
+    default=0,
+    metavar="N",
+    help="Report the N non-overlapping segments with the lowest mean score of each metric, with their timestamps "
+    "(saved to Worst Segments.json). Example: --worst-segments 3 (default: 0, which disables this)",
+)
+
+worst_segments_args.add_argument(
+    "--segment-length",
+    type=float,
+    default=2,
+    metavar="SECONDS",
+    help="The length of the segments that --worst-segments reports",
+)
+
+worst_segments_args.add_argument(
+    "--rescore-worst-segments",
+    action="store_true",
+    help="Extract the worst VMAF segments of each transcode and of the reference, "
+    "and calculate the VMAF of every frame of them (regardless of -subsample)",
+)
+
+# Per-frame bitrate analysis.
+bitrate_analysis_args.add_argument(
+    "--bitrate-analysis",
+    action="store_true",
+    help="Read the size of each frame of each transcode with a single ffprobe packet scan, and report the "
+    "peak bitrate over --bitrate-window seconds, the bits of each frame type and the correlation between the "
+    "frame size and the VMAF. Adds a Peak Bitrate column to the table and a Bitrate and VMAF graph",
+)
+
+bitrate_analysis_args.add_argument(
+    "--bitrate-window",
+    type=float,
+    default=1,
+    metavar="SECONDS",
+    help="The length of the window that the peak bitrate of --bitrate-analysis is measured over "
+    "(e.g. the VBV buffer size divided by the VBV maximum rate of your players)",
+)
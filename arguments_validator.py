@@ -1,5 +1,8 @@
 import os
 
+from encoder_comparison import parse_encoder_crfs
+from encoders import get_encoder
+from thread_budget import format_cpu_set, get_allowed_cpus, parse_cpu_set
 from utils import is_list
 
 
@@ -10,9 +13,87 @@ class ArgumentsValidator:
         result = True
 
         validation_results.append(self.__validate_original_video_exists(args.original_video_path))
+        if args.compare_encoders:
+            validation_results.append(
+                self.__validate_encoder_comparison(
+                    args.no_transcoding_mode,
+                    args.compare_encoders,
+                    args.ladder,
+                    args.preset,
+                    args.skip_duplicate_frames,
+                )
+            )
+        elif args.ladder:
+            validation_results.append(
+                self.__validate_ladder(args.no_transcoding_mode, args.ladder, args.preset)
+            )
+        else:
+            validation_results.append(
+                self.__validate_crf_and_preset_count(args.no_transcoding_mode, args.crf, args.preset)
+            )
+        if not args.compare_encoders and not args.no_transcoding_mode:
+            validation_results.append(
+                self.__validate_encoder_settings(args.video_encoder, args.crf, args.preset)
+            )
+        validation_results.append(self.__validate_thread_budget(args.concurrent_jobs, args.cpu_set))
         validation_results.append(
-            self.__validate_crf_and_preset_count(args.no_transcoding_mode, args.crf, args.preset)
+            self.__validate_prescreen_thresholds(
+                args.prescreen, args.prescreen_min_psnr, args.prescreen_min_ssim
+            )
         )
+        for ceiling_name, ceiling in [("--max-bitrate", args.max_bitrate), ("--max-size", args.max_size)]:
+            if ceiling is not None and ceiling <= 0:
+                validation_results.append((False, f"{ceiling_name} must be greater than 0."))
+
+        if args.overview_clips is not None and args.overview_clips < 1:
+            validation_results.append((False, "--overview-clips must be at least 1."))
+
+        if args.scratch_budget is not None and args.scratch_budget <= 0:
+            validation_results.append((False, "--scratch-budget must be greater than 0."))
+
+        if args.ram_disk and not os.path.isdir(args.ram_disk):
+            validation_results.append((False, f"--ram-disk {args.ram_disk} is not a folder."))
+
+        if args.plan and args.no_transcoding_mode:
+            validation_results.append((False, "--plan cannot be used in -ntm mode."))
+
+        if args.worst_segments < 0:
+            validation_results.append((False, "--worst-segments cannot be negative."))
+
+        if args.segment_length <= 0:
+            validation_results.append((False, "--segment-length must be greater than 0."))
+
+        if args.rescore_worst_segments and args.worst_segments < 1:
+            validation_results.append(
+                (False, "--rescore-worst-segments requires --worst-segments to be at least 1.")
+            )
+
+        if args.bitrate_window <= 0:
+            validation_results.append((False, "--bitrate-window must be greater than 0."))
+
+        if args.skip_duplicate_frames and args.implicit_conversions:
+            validation_results.append(
+                (False, "--skip-duplicate-frames cannot be used with --implicit-conversions.")
+            )
+
+        if args.skip_duplicate_frames and str(args.subsample) != "1":
+            validation_results.append(
+                (False, "--skip-duplicate-frames cannot be used with -subsample.")
+            )
+
+        if args.max_frame_offset < 1:
+            validation_results.append((False, "--max-frame-offset must be at least 1."))
+
+        if args.distributed_queue:
+            validation_results.append(
+                self.__validate_distributed_queue(
+                    args.no_transcoding_mode,
+                    args.ladder,
+                    args.compare_encoders,
+                    args.ram_disk,
+                    args.lease_timeout,
+                )
+            )
 
         for validation_tuple in validation_results:
             if not validation_tuple[0]:
@@ -24,6 +105,43 @@ class ArgumentsValidator:
     def __validate_original_video_exists(self, video_path):
         return (os.path.exists(video_path), f"Unable to find {video_path}")
 
+    def __validate_distributed_queue(
+        self, no_transcoding_mode, ladder, compare_encoders, ram_disk, lease_timeout
+    ):
+        if no_transcoding_mode or ladder or compare_encoders:
+            return (
+                False,
+                "--distributed-queue can only be used in CRF and presets comparison mode.",
+            )
+        # The workers must be able to read the -t cut.
+        if ram_disk:
+            return (False, "--distributed-queue cannot be used with --ram-disk.")
+        if lease_timeout <= 0:
+            return (False, "--lease-timeout must be greater than 0.")
+        return (True, "")
+
+    def __validate_encoder_settings(self, encoder, crf_values, presets):
+        backend = get_encoder(encoder)
+        lowest, highest = backend.crf_range
+        for crf in crf_values if is_list(crf_values) else []:
+            if not lowest <= crf <= highest:
+                return (
+                    False,
+                    f"The CRF values of {encoder} must be between {lowest} and {highest}.",
+                )
+
+        # libaom-av1 ignores the preset.
+        if backend.speed_option is None:
+            for preset in presets if is_list(presets) else [presets]:
+                if preset not in backend.presets:
+                    return (
+                        False,
+                        f'"{preset}" is not a preset of {encoder}. '
+                        f"Choose from: {', '.join(backend.presets)}",
+                    )
+
+        return (True, "")
+
     def __validate_crf_and_preset_count(self, no_transcoding_mode, crf_values, presets):
         if not no_transcoding_mode and isinstance(crf_values, int) and isinstance(presets, str):
             return (
@@ -38,3 +156,68 @@ class ArgumentsValidator:
             )
 
         return (True, "")
+
+    def __validate_encoder_comparison(
+        self, no_transcoding_mode, values, ladder, presets, skip_duplicate_frames
+    ):
+        if no_transcoding_mode or ladder:
+            return (False, "--compare-encoders cannot be used with -ntm or --ladder.")
+
+        # The transcodes are scored by a single libvmaf process that decodes every input itself.
+        if skip_duplicate_frames:
+            return (False, "--compare-encoders cannot be used with --skip-duplicate-frames.")
+
+        try:
+            if len(parse_encoder_crfs(values)) < 2:
+                return (False, "At least two encoders must be specified with --compare-encoders.")
+        except ValueError as error:
+            return (False, str(error))
+
+        if is_list(presets) and len(presets) > 1:
+            return (False, "Only one preset can be specified with --compare-encoders.")
+
+        return (True, "")
+
+    def __validate_ladder(self, no_transcoding_mode, heights, presets):
+        if no_transcoding_mode:
+            return (False, "--ladder cannot be used in -ntm mode.")
+
+        if any(height < 2 or height % 2 for height in heights):
+            return (False, "Each --ladder height must be an even number of pixels.")
+
+        if is_list(presets) and len(presets) > 1:
+            return (False, "Only one preset can be specified in ladder mode.")
+
+        return (True, "")
+
+    def __validate_thread_budget(self, concurrent_jobs, cpu_set):
+        if concurrent_jobs < 1:
+            return (False, "--concurrent-jobs must be at least 1.")
+
+        if cpu_set:
+            try:
+                cpus = parse_cpu_set(cpu_set)
+                if not cpus:
+                    raise ValueError
+            except ValueError:
+                return (False, f"Invalid --cpu-set value: {cpu_set}")
+
+            allowed_cpus = get_allowed_cpus()
+            if not set(cpus) <= allowed_cpus:
+                return (
+                    False,
+                    f"--cpu-set {cpu_set} includes CPUs that this process is not allowed to use "
+                    f"({format_cpu_set(set(cpus) - allowed_cpus)}). "
+                    f"The CPU affinity mask only allows {format_cpu_set(allowed_cpus)}.",
+                )
+
+        return (True, "")
+
+    def __validate_prescreen_thresholds(self, prescreen, min_psnr, min_ssim):
+        if prescreen and min_psnr is None and min_ssim is None:
+            return (
+                False,
+                "--prescreen requires --prescreen-min-psnr and/or --prescreen-min-ssim to be specified.",
+            )
+
+        return (True, "")
@@ -0,0 +1,396 @@
+"""
+A reproducible benchmark of VQM's own pipeline. Deterministic test videos are generated locally with FFmpeg's
+lavfi sources, and each stage of the pipeline is timed end to end.
+
+    python benchmark.py run --output baseline.json
+    python benchmark.py run --output current.json
+    python benchmark.py compare baseline.json current.json --threshold 10
+
+compare exits with a non-zero exit code if any stage is slower than the baseline by more than the threshold.
+"""
+
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from ffmpeg import probe
+from prettytable import PrettyTable
+
+from args import parser as vqm_parser
+from encode_video import encode_video
+from libvmaf import run_libvmaf
+from overview import create_movie_overview
+from streaming_stats import StreamingStats
+from thread_budget import apply_thread_budget
+from utils import cut_video, get_vmaf_models, Logger, plot_graph, VideoInfoProvider
+
+log = Logger("benchmark")
+
+CACHE_FOLDER = os.path.join(os.path.expanduser("~"), ".cache", "video-quality-metrics", "benchmark")
+BENCHMARK_VERSION = 1
+
+SOURCES = {
+    "testsrc2": "testsrc2=size={width}x{height}:rate={fps}",
+    "mandelbrot": "mandelbrot=size={width}x{height}:rate={fps}",
+    # all_seed makes the noise the same every time.
+    "noise": "color=c=gray:size={width}x{height}:rate={fps},noise=alls=40:allf=t+u:all_seed=42",
+}
+
+# (source, width, height, fps, duration in seconds)
+CASES = [
+    ("testsrc2", 640, 360, 24, 10),
+    ("mandelbrot", 1280, 720, 24, 10),
+    ("noise", 1920, 1080, 24, 6),
+]
+QUICK_CASES = [("testsrc2", 640, 360, 24, 6)]
+
+STAGES = [
+    "probe",
+    "cut",
+    "overview",
+    "encode",
+    "libvmaf",
+    "libvmaf_mixed_implicit",
+    "libvmaf_mixed_explicit",
+    "json_parse",
+    "aggregation",
+    "table_write",
+    "plotting",
+]
+
+
+def get_case_name(case):
+    source, width, height, fps, duration = case
+    return f"{source}-{width}x{height}-{fps}fps-{duration}s"
+
+
+def generate_video(case):
+    """
+    Creates (or reuses) a lossless test video. The lavfi sources are deterministic, so the content is always the same.
+    """
+    source, width, height, fps, duration = case
+    os.makedirs(CACHE_FOLDER, exist_ok=True)
+    video_path = os.path.join(CACHE_FOLDER, f"{get_case_name(case)}.mkv")
+    if os.path.exists(video_path):
+        return video_path
+
+    log.info(f"Generating {video_path}...")
+    temporary_path = os.path.join(CACHE_FOLDER, f"{get_case_name(case)}.tmp.mkv")
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-loglevel",
+            "error",
+            "-y",
+            "-f",
+            "lavfi",
+            "-i",
+            SOURCES[source].format(width=width, height=height, fps=fps),
+            "-t",
+            str(duration),
+            "-pix_fmt",
+            "yuv420p",
+            "-c:v",
+            "libx264",
+            "-crf",
+            "0",
+            "-preset",
+            "ultrafast",
+            temporary_path,
+        ],
+        check=True,
+    )
+    os.replace(temporary_path, video_path)
+    return video_path
+
+
+class StageTimer:
+    def __init__(self):
+        self.timings = {}
+
+    def time(self, stage, function):
+        start_time = time.perf_counter()
+        result = function()
+        self.timings[stage] = time.perf_counter() - start_time
+        return result
+
+
+def run_case(case, work_folder, crf, preset):
+    video_path = generate_video(case)
+    _, _, _, _, duration = case
+    case_folder = os.path.join(work_folder, get_case_name(case))
+    os.makedirs(case_folder, exist_ok=True)
+
+    args = vqm_parser.parse_args(
+        ["-ovp", video_path, "-crf", str(crf), "-p", preset, "-t", str(duration / 2)]
+    )
+    apply_thread_budget(args)
+    timer = StageTimer()
+
+    timer.time("probe", lambda: probe(video_path))
+    provider = VideoInfoProvider(video_path)
+    fps = provider.get_framerate_fraction()
+
+    table_path = os.path.join(case_folder, "Table.txt")
+    reference_path = timer.time(
+        "cut",
+        lambda: cut_video(os.path.basename(video_path), args, ".mkv", case_folder, table_path),
+    )
+    cut_duration = VideoInfoProvider(reference_path).get_duration()
+
+    timer.time(
+        "overview",
+        lambda: create_movie_overview(video_path, os.path.join(case_folder, "overview"), 2, "1"),
+    )
+
+    transcode_path = os.path.join(case_folder, f"CRF {crf}.mkv")
+    factory, _, _ = timer.time(
+        "encode",
+        lambda: encode_video(
+            reference_path, args, crf, preset, transcode_path, f"CRF {crf}", cut_duration
+        ),
+    )
+
+    json_file_path = os.path.join(case_folder, "Metrics of each frame.json")
+    timer.time(
+        "libvmaf",
+        lambda: run_libvmaf(
+            transcode_path,
+            args,
+            json_file_path,
+            fps,
+            reference_path,
+            factory,
+            cut_duration,
+            crf,
+        ),
+    )
+
+    # A 10-bit copy of the transcode, to compare the explicit pixel format conversion in the libvmaf
+    # filter graph with the conversion that FFmpeg chooses itself.
+    mixed_path = os.path.join(case_folder, f"CRF {crf} (10-bit).mkv")
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-loglevel",
+            "error",
+            "-y",
+            "-i",
+            transcode_path,
+            "-pix_fmt",
+            "yuv420p10le",
+            "-c:v",
+            "ffv1",
+            mixed_path,
+        ],
+        check=True,
+    )
+    mixed_json_file_path = os.path.join(case_folder, "Metrics of each frame (10-bit).json")
+    for stage, implicit_conversions in [
+        ("libvmaf_mixed_implicit", True),
+        ("libvmaf_mixed_explicit", False),
+    ]:
+        args.implicit_conversions = implicit_conversions
+        timer.time(
+            stage,
+            lambda: run_libvmaf(
+                mixed_path,
+                args,
+                mixed_json_file_path,
+                fps,
+                reference_path,
+                factory,
+                cut_duration,
+                crf,
+            ),
+        )
+
+    def parse_json():
+        with open(json_file_path, "r") as f:
+            return json.load(f)["frames"]
+
+    frames = timer.time("json_parse", parse_json)
+    model_name = get_vmaf_models(args)[0][1]
+    frame_numbers = [frame["frameNum"] for frame in frames]
+    vmaf_scores = [frame["metrics"][model_name] for frame in frames]
+
+    def aggregate():
+        stats = StreamingStats()
+        stats.update_batch(vmaf_scores, frame_numbers)
+        return stats.summary()
+
+    summary = timer.time("aggregation", aggregate)
+
+    def write_table():
+        table = PrettyTable()
+        table.field_names = ["CRF", "VMAF"]
+        table.add_row([crf, f"{summary['min']:.2f} | {summary['std']:.2f} | {summary['mean']:.2f}"])
+        with open(table_path, "w") as f:
+            f.write(table.get_string())
+
+    timer.time("table_write", write_table)
+    timer.time(
+        "plotting",
+        lambda: plot_graph(
+            "VMAF",
+            "Frame Number",
+            "VMAF",
+            frame_numbers,
+            vmaf_scores,
+            f"{summary['mean']:.2f}",
+            os.path.join(case_folder, "VMAF"),
+        ),
+    )
+    return timer.timings
+
+
+def get_environment():
+    ffmpeg_version = (
+        subprocess.run(["ffmpeg", "-version"], stdout=subprocess.PIPE, check=True)
+        .stdout.decode("utf-8")
+        .splitlines()[0]
+    )
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "ffmpeg": ffmpeg_version,
+    }
+
+
+def run_benchmark(cases, repeat, crf, preset):
+    """
+    Runs each case repeat times and returns the median time of each stage.
+    """
+    results = {}
+    work_folder = tempfile.mkdtemp(prefix="vqm-benchmark-")
+    try:
+        for case in cases:
+            case_name = get_case_name(case)
+            runs = []
+            for i in range(repeat):
+                log.info(f"Benchmarking {case_name} (run {i + 1}/{repeat})...")
+                runs.append(run_case(case, os.path.join(work_folder, str(i)), crf, preset))
+            results[case_name] = {
+                stage: statistics.median(run[stage] for run in runs) for stage in STAGES
+            }
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+    return results
+
+
+def compare(baseline, current, threshold_percent, min_seconds):
+    """
+    Returns a row for each stage of each case in both benchmarks, and whether any stage regressed.
+    A stage regressed if it is slower by more than threshold_percent and by more than min_seconds.
+    """
+    rows = []
+    regressed = False
+    for case_name, baseline_timings in baseline["cases"].items():
+        current_timings = current["cases"].get(case_name)
+        if current_timings is None:
+            continue
+        for stage in STAGES:
+            if stage not in baseline_timings or stage not in current_timings:
+                continue
+            before, after = baseline_timings[stage], current_timings[stage]
+            change = (after - before) / before * 100 if before else 0
+            is_regression = change > threshold_percent and after - before > min_seconds
+            regressed = regressed or is_regression
+            rows.append(
+                [
+                    case_name,
+                    stage,
+                    f"{before:.3f}",
+                    f"{after:.3f}",
+                    f"{change:+.1f}%",
+                    "REGRESSION" if is_regression else "",
+                ]
+            )
+    return rows, regressed
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark the VQM pipeline.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmark and save the timings")
+    run_parser.add_argument("--output", type=str, required=True, help="The JSON file to save")
+    run_parser.add_argument(
+        "--repeat", type=int, default=3, help="Run each case this many times and use the median"
+    )
+    run_parser.add_argument("--quick", action="store_true", help="Only run a single small case")
+    run_parser.add_argument("--crf", type=int, default=23)
+    run_parser.add_argument("--preset", type=str, default="veryfast")
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="Compare a benchmark with a baseline and flag regressions"
+    )
+    compare_parser.add_argument("baseline", type=str)
+    compare_parser.add_argument("current", type=str)
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=10,
+        help="Flag stages that are more than this many percent slower than the baseline",
+    )
+    compare_parser.add_argument(
+        "--min-seconds",
+        type=float,
+        default=0.05,
+        help="Ignore differences smaller than this, as very short stages are noisy",
+    )
+    benchmark_args = parser.parse_args()
+
+    if benchmark_args.command == "run":
+        cases = QUICK_CASES if benchmark_args.quick else CASES
+        results = {
+            "version": BENCHMARK_VERSION,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "environment": get_environment(),
+            "crf": benchmark_args.crf,
+            "preset": benchmark_args.preset,
+            "cases": run_benchmark(
+                cases, benchmark_args.repeat, benchmark_args.crf, benchmark_args.preset
+            ),
+        }
+        with open(benchmark_args.output, "w") as f:
+            json.dump(results, f, indent=4)
+        log.info(f"The timings have been saved to {benchmark_args.output}")
+        return
+
+    with open(benchmark_args.baseline, "r") as f:
+        baseline = json.load(f)
+    with open(benchmark_args.current, "r") as f:
+        current = json.load(f)
+
+    if baseline["environment"] != current["environment"]:
+        log.warning(
+            "The benchmarks were run in different environments, so they may not be comparable."
+        )
+
+    rows, regressed = compare(
+        baseline, current, benchmark_args.threshold, benchmark_args.min_seconds
+    )
+    table = PrettyTable()
+    table.field_names = ["Case", "Stage", "Baseline (s)", "Current (s)", "Change", ""]
+    for row in rows:
+        table.add_row(row)
+    log.info(table.get_string())
+
+    if regressed:
+        log.info(f"Some stages are more than {benchmark_args.threshold}% slower than the baseline.")
+        sys.exit(1)
+    log.info("No regressions found.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,457 @@
+"""
+Runs sweep points (an encode and its VMAF calculation) on other machines. The broker is a folder on shared
+storage (e.g. NFS or SMB), so no other service is needed. main.py submits each sweep point to the queue
+with --distributed-queue and the workers claim them:
+
+    python distributed.py /mnt/shared/vqm-queue --concurrent-jobs 2
+
+Any number of workers can use the same queue, on any number of machines (or on the same machine).
+The source video, the output folder and the queue must be available at the same path on every machine.
+
+A worker holds a lease on each sweep point that it claims, which it renews while it works on it.
+If a worker stops renewing a lease (e.g. because its machine crashed), the sweep point goes back to the queue.
+A worker that finds that its lease has gone stops working on the sweep point and drops its result.
+"""
+
+from argparse import ArgumentParser, Namespace
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+from encode_video import encode_video, EncodeAborted
+from ffmpeg_process_factory import FfmpegCancelled, FfmpegError
+from libvmaf import run_libvmaf
+from quick_metrics import passes_prescreen, run_quick_metrics
+from supervisor import run_with_retries
+from thread_budget import apply_thread_budget, format_cpu_set, get_allowed_cpus, parse_cpu_set
+from utils import line, Logger, set_log_context
+
+log = Logger("distributed")
+
+POLL_INTERVAL = 1
+DEFAULT_LEASE_TIMEOUT = 120
+# A sweep point fails if no worker has held a lease on the queue for this many lease timeouts.
+IDLE_LEASE_TIMEOUTS = 5
+
+
+def _write_json_atomically(path, data):
+    temporary_path = os.path.join(
+        os.path.dirname(path), f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp"
+    )
+    with open(temporary_path, "w") as f:
+        json.dump(data, f)
+    os.replace(temporary_path, path)
+
+
+def _write_json_exclusively(path, data):
+    """
+    Writes the file only if it doesn't exist yet (os.link fails if the destination exists, unlike os.rename).
+    Returns False if it already exists.
+    """
+    temporary_path = os.path.join(
+        os.path.dirname(path), f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp"
+    )
+    with open(temporary_path, "w") as f:
+        json.dump(data, f)
+    try:
+        os.link(temporary_path, path)
+        return True
+    except FileExistsError:
+        return False
+    finally:
+        os.remove(temporary_path)
+
+
+class TaskQueue:
+    """
+    A queue of tasks in a folder. Each task is a JSON file that moves from queue/ to leases/ when it is claimed
+    (os.rename is atomic, so only one worker can claim a task), and its result is saved to done/.
+    Tasks are claimed in the order of their rank. Each claim gives the lease a new name, so a worker whose lease
+    expired can't renew or release the lease of the worker that claimed the task after it.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._queue_folder = os.path.join(folder, "queue")
+        self._leases_folder = os.path.join(folder, "leases")
+        self._done_folder = os.path.join(folder, "done")
+        for subfolder in [self._queue_folder, self._leases_folder, self._done_folder]:
+            os.makedirs(subfolder, exist_ok=True)
+
+    def submit(self, task_id, task, rank=0):
+        _write_json_atomically(
+            os.path.join(self._queue_folder, f"{rank:05d}-{task_id}.json"),
+            {"task_id": task_id, **task},
+        )
+
+    def claim(self):
+        """
+        Returns the lease path and the task with the lowest rank, or None if the queue is empty.
+        """
+        for name in sorted(os.listdir(self._queue_folder)):
+            if not name.endswith(".json"):
+                continue
+            lease_name = f"{os.path.splitext(name)[0]}.{uuid.uuid4().hex[:8]}.json"
+            lease_path = os.path.join(self._leases_folder, lease_name)
+            try:
+                os.rename(os.path.join(self._queue_folder, name), lease_path)
+                # The modification time of the lease is its heartbeat.
+                os.utime(lease_path)
+                with open(lease_path, "r") as f:
+                    return lease_path, json.load(f)
+            except (OSError, ValueError):
+                # Another worker claimed it first.
+                continue
+        return None
+
+    def renew(self, lease_path):
+        """
+        Returns False if the lease has been lost, e.g. because it expired and the task was requeued.
+        """
+        try:
+            os.utime(lease_path)
+            return True
+        except OSError:
+            return False
+
+    def complete(self, lease_path, task_id, result):
+        """
+        Saves the result of a task and releases its lease. Returns False, and drops the result, if the lease
+        has been lost or another worker has already saved a result for the task.
+        """
+        if not os.path.exists(lease_path):
+            return False
+        saved = _write_json_exclusively(os.path.join(self._done_folder, f"{task_id}.json"), result)
+        try:
+            os.remove(lease_path)
+        except OSError:
+            pass
+        return saved
+
+    def has_leases(self):
+        return any(name.endswith(".json") for name in os.listdir(self._leases_folder))
+
+    def cancel(self, task_id):
+        """
+        Removes a task that has not been claimed from the queue. Returns False if it is not in the queue.
+        """
+        for name in os.listdir(self._queue_folder):
+            if name.endswith(".json") and name.split("-", 1)[1] == f"{task_id}.json":
+                try:
+                    os.remove(os.path.join(self._queue_folder, name))
+                    return True
+                except OSError:
+                    # A worker claimed it first.
+                    return False
+        return False
+
+    def requeue_expired(self, lease_timeout):
+        """
+        Moves the tasks whose lease has not been renewed within lease_timeout seconds back to the queue.
+        """
+        for name in os.listdir(self._leases_folder):
+            if not name.endswith(".json"):
+                continue
+            lease_path = os.path.join(self._leases_folder, name)
+            # The claim token is removed, so that the task gets a new one when it is claimed again.
+            task_name = f"{name.rsplit('.', 2)[0]}.json"
+            try:
+                if time.time() - os.path.getmtime(lease_path) > lease_timeout:
+                    os.rename(lease_path, os.path.join(self._queue_folder, task_name))
+                    log.info(f"The lease of {task_name} has expired, so it has been requeued.")
+            except OSError:
+                continue
+
+    def get_result(self, task_id):
+        """
+        Returns the result of a task once. The result is replaced with a marker rather than removed,
+        so that a late result from another worker can't be saved in its place.
+        """
+        result_path = os.path.join(self._done_folder, f"{task_id}.json")
+        if not os.path.exists(result_path):
+            return None
+        with open(result_path, "r") as f:
+            result = json.load(f)
+        if result.get("consumed"):
+            return None
+        _write_json_atomically(result_path, {"consumed": True})
+        return result
+
+
+class DistributedSweep:
+    """
+    The side of main.py: submits sweep points to the queue and waits for their results.
+    """
+
+    def __init__(self, queue_folder, lease_timeout):
+        self._queue = TaskQueue(queue_folder)
+        self._lease_timeout = lease_timeout
+        self._run_token = uuid.uuid4().hex[:8]
+        self._task_ids = {}
+        # The last time that a worker was seen holding a lease, shared by the waits of every sweep point.
+        self._last_lease_time = None
+
+    def submit(self, key, task, rank=0):
+        task_id = f"{self._run_token}-{len(self._task_ids)}"
+        self._task_ids[key] = task_id
+        self._queue.submit(task_id, {**task, "lease_timeout": self._lease_timeout}, rank)
+        if self._last_lease_time is None:
+            self._last_lease_time = time.time()
+
+    def wait(self, key):
+        """
+        Returns the result of a sweep point. If no worker has held a lease for IDLE_LEASE_TIMEOUTS lease timeouts
+        (e.g. because no worker was started or they have all died), the sweep point is removed from the queue
+        and a failed_no_worker result is returned.
+        """
+        task_id = self._task_ids[key]
+        log.info("Waiting for a worker...")
+        while True:
+            result = self._queue.get_result(task_id)
+            if result is not None:
+                log.info(f"Done by {result['worker']}.")
+                return result
+            self._queue.requeue_expired(self._lease_timeout)
+
+            if self._queue.has_leases():
+                self._last_lease_time = time.time()
+            elif time.time() - self._last_lease_time > IDLE_LEASE_TIMEOUTS * self._lease_timeout:
+                if self._queue.cancel(task_id):
+                    log.warning(
+                        f"No worker has claimed a sweep point for "
+                        f"{IDLE_LEASE_TIMEOUTS * self._lease_timeout:g} seconds."
+                    )
+                    return {
+                        "status": "failed_no_worker",
+                        "fields": {"error": "No worker claimed the sweep point"},
+                        "worker": None,
+                    }
+            time.sleep(POLL_INTERVAL)
+
+
+def get_task_args(args):
+    """
+    The arguments of the run, as a JSON-serialisable dictionary. The thread counts are left out,
+    as each worker works them out from its own thread budget.
+    """
+    task_args = json.loads(json.dumps(vars(args), default=str))
+    for thread_argument in ["n_threads", "encoder_threads", "filter_threads", "cpu_set"]:
+        task_args[thread_argument] = None
+    return task_args
+
+
+def _remove_file(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def execute_task(task, concurrent_jobs, cpu_set, cancel_event=None):
+    """
+    Encodes and scores a single sweep point. Returns the result of the task.
+    The FFmpeg processes are killed, and FfmpegCancelled is raised, once cancel_event is set.
+    """
+    args = Namespace(**task["args"])
+    args.concurrent_jobs = concurrent_jobs
+    args.cpu_set = cpu_set
+    args.cancel_event = cancel_event
+    apply_thread_budget(args)
+
+    crf, preset, message = task["crf"], task["preset"], task["message"]
+    transcode_output_path = task["transcode_output_path"]
+    reference_video_path = task["reference_video_path"]
+    os.makedirs(task["output_folder"], exist_ok=True)
+
+    try:
+        factory, time_taken, encode_usage = run_with_retries(
+            lambda: encode_video(
+                reference_video_path,
+                args,
+                crf,
+                preset,
+                transcode_output_path,
+                message,
+                task["duration"],
+            ),
+            f"encode with {message}",
+            args.max_retries,
+            args.retry_backoff,
+        )
+    except FfmpegError as error:
+        # The partial transcode is of no use.
+        _remove_file(transcode_output_path)
+        return {"status": "failed_encode", "fields": {"error": str(error)}}
+    except EncodeAborted as error:
+        _remove_file(transcode_output_path)
+        log.info(f"The transcode with {message} was aborted because {error.reason}.")
+        return {
+            "status": "rejected_ceiling",
+            "fields": {
+                "projected_bitrate_bps": error.projected_bitrate_bps,
+                "projected_size_bytes": error.projected_size_bytes,
+                "encode_wall_time_s": error.resource_usage.wall_time,
+            },
+        }
+
+    if args.prescreen:
+        quick_summaries = run_quick_metrics(
+            transcode_output_path,
+            args,
+            f"{task['output_folder']}/Quick metrics of each frame.json",
+            task["fps"],
+            reference_video_path,
+        )
+        if not passes_prescreen(args, quick_summaries):
+            log.info(f"The transcode with {message} was rejected by the prescreen.")
+            return {
+                "status": "rejected_prescreen",
+                "fields": {
+                    "quick_psnr_mean": quick_summaries["PSNR"]["mean"],
+                    "quick_ssim_mean": quick_summaries["SSIM"]["mean"],
+                    "encode_wall_time_s": encode_usage.wall_time,
+                },
+            }
+
+    try:
+        scoring_usage = run_with_retries(
+            lambda: run_libvmaf(
+                transcode_output_path,
+                args,
+                task["json_file_path"],
+                task["fps"],
+                reference_video_path,
+                factory,
+                task["duration"],
+                task["crf_or_preset"],
+            ),
+            f"VMAF calculation of {message}",
+            args.max_retries,
+            args.retry_backoff,
+        )
+    except FfmpegError as error:
+        return {"status": "failed_scoring", "fields": {"error": str(error)}}
+
+    return {
+        "status": "scored",
+        "time_taken": time_taken,
+        "encode_usage": encode_usage.to_dict(),
+        "scoring_usage": scoring_usage.to_dict(),
+    }
+
+
+class Heartbeat:
+    """
+    Renews a lease in the background until it is stopped. If the lease has been lost, lease_lost is set.
+    """
+
+    def __init__(self, queue, lease_path, interval):
+        self._queue = queue
+        self._lease_path = lease_path
+        self._interval = interval
+        self._stopped = threading.Event()
+        self.lease_lost = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            if not self._queue.renew(self._lease_path):
+                log.warning("The lease has been lost, so the sweep point will be stopped.")
+                self.lease_lost.set()
+                return
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+
+def run_worker(queue_folder, concurrent_jobs=1, cpu_set=None, exit_when_idle=False):
+    queue = TaskQueue(queue_folder)
+    worker_name = f"{socket.gethostname()}:{os.getpid()}"
+    log.info(f"Worker {worker_name} is waiting for sweep points in {queue_folder}...")
+
+    while True:
+        claimed = queue.claim()
+        if claimed is None:
+            if exit_when_idle:
+                return
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        lease_path, task = claimed
+        set_log_context(run_id=task["args"].get("run_id"), point=task["message"])
+        line()
+        log.info(f"| {task['message']} |")
+        line()
+
+        heartbeat = Heartbeat(
+            queue, lease_path, task.get("lease_timeout", DEFAULT_LEASE_TIMEOUT) / 4
+        )
+        heartbeat.start()
+        try:
+            result = execute_task(task, concurrent_jobs, cpu_set, heartbeat.lease_lost)
+        except FfmpegCancelled:
+            result = None
+        except Exception as error:
+            log.info(f"Unable to complete {task['message']}: {error}")
+            result = {"status": "failed_encode", "fields": {"error": str(error)}}
+        finally:
+            heartbeat.stop()
+
+        if result is None or heartbeat.lease_lost.is_set():
+            log.info(f"{task['message']} was stopped, as another worker may have claimed it.")
+            continue
+        result["worker"] = worker_name
+        if not queue.complete(lease_path, task["task_id"], result):
+            log.info(f"The result of {task['message']} was dropped, as its lease had been lost.")
+
+
+def main():
+    parser = ArgumentParser(description="Run VQM sweep points from a distributed queue.")
+    parser.add_argument(
+        "queue_folder", help="The folder that was specified with --distributed-queue"
+    )
+    parser.add_argument(
+        "--concurrent-jobs",
+        type=int,
+        default=1,
+        help="The number of workers that will run on this machine, to split its CPUs between them",
+    )
+    parser.add_argument(
+        "--cpu-set", type=str, default=None, help="Restrict this worker to these CPUs, e.g. 0-3,8"
+    )
+    parser.add_argument(
+        "--exit-when-idle",
+        action="store_true",
+        help="Exit once the queue is empty instead of waiting for more sweep points",
+    )
+    worker_args = parser.parse_args()
+    if worker_args.cpu_set:
+        try:
+            cpus = set(parse_cpu_set(worker_args.cpu_set))
+        except ValueError:
+            parser.error(f"Invalid --cpu-set value: {worker_args.cpu_set}")
+        allowed_cpus = get_allowed_cpus()
+        if not cpus or not cpus <= allowed_cpus:
+            parser.error(
+                f"--cpu-set must only include CPUs in the CPU affinity mask "
+                f"({format_cpu_set(allowed_cpus)})."
+            )
+    queue_folder = os.path.abspath(worker_args.queue_folder)
+
+    # The paths of the VMAF models are relative to the VQM folder.
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    run_worker(
+        queue_folder,
+        worker_args.concurrent_jobs,
+        worker_args.cpu_set,
+        worker_args.exit_when_idle,
+    )
+
+
+if __name__ == "__main__":
+    main()
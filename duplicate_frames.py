@@ -0,0 +1,211 @@
+"""
+Scores runs of identical frame pairs (e.g. the held drawings of animation, slideshows and static holds) once.
+
+Both videos are decoded in separate FFmpeg processes and each frame pair is compared with the previous pair.
+The first two pairs of a run of identical pairs are written to the libvmaf process, and every later pair of
+the run reuses the scores of the second pair. The second pair is scored so that libvmaf's motion features
+(which compare each reference frame with the previous and next frames) are the same as if every pair had been
+scored, so the reused scores and the aggregates are exact.
+"""
+
+import json
+import subprocess
+
+import numpy as np
+
+# The (chroma width divisor, chroma height divisor, bytes per sample) of each pixel format that libvmaf accepts.
+PIXEL_FORMAT_LAYOUTS = {
+    "yuv420p": (2, 2, 1),
+    "yuv422p": (2, 1, 1),
+    "yuv444p": (1, 1, 1),
+    "yuv420p10le": (2, 2, 2),
+    "yuv422p10le": (2, 1, 2),
+    "yuv444p10le": (1, 1, 2),
+}
+
+
+def get_plane_sizes(width, height, pixel_format):
+    chroma_width_divisor, chroma_height_divisor, sample_bytes = PIXEL_FORMAT_LAYOUTS[pixel_format]
+    luma_size = width * height * sample_bytes
+    chroma_size = (
+        -(-width // chroma_width_divisor) * -(-height // chroma_height_divisor) * sample_bytes
+    )
+    return [luma_size, chroma_size, chroma_size]
+
+
+def can_stack_frames(height, pixel_format):
+    # The frames are stacked vertically, so the chroma planes must have exactly half as many rows
+    # as those of the stacked frame.
+    return height % PIXEL_FORMAT_LAYOUTS[pixel_format][1] == 0
+
+
+class RawFrameReader:
+    """
+    Decodes a video with FFmpeg and reads its frames from a rawvideo pipe.
+    """
+
+    def __init__(self, video_path, fps, filters, pixel_format):
+        self._process = subprocess.Popen(
+            [
+                "ffmpeg",
+                "-loglevel",
+                "error",
+                "-r",
+                fps,
+                "-i",
+                video_path,
+                "-map",
+                "0:V:0",
+                "-vf",
+                filters,
+                "-f",
+                "rawvideo",
+                "-pix_fmt",
+                pixel_format,
+                "-",
+            ],
+            stdout=subprocess.PIPE,
+        )
+
+    def read_into(self, buffer):
+        """
+        Fills the buffer with the next frame. Returns False if there are no more complete frames.
+        """
+        view = memoryview(buffer)
+        total_bytes_read = 0
+        while total_bytes_read < len(view):
+            bytes_read = self._process.stdout.readinto(view[total_bytes_read:])
+            if not bytes_read:
+                return False
+            total_bytes_read += bytes_read
+        return True
+
+    def close(self):
+        self._process.stdout.close()
+        return self._process.wait()
+
+
+class DuplicateFrameFeeder:
+    def __init__(
+        self,
+        distorted_video,
+        reference_video,
+        fps,
+        distorted_filters,
+        reference_filters,
+        width,
+        height,
+        pixel_format,
+    ):
+        self._distorted_video = distorted_video
+        self._reference_video = reference_video
+        self._fps = fps
+        self._distorted_filters = distorted_filters
+        self._reference_filters = reference_filters
+        self.width = width
+        self.height = height
+        self.pixel_format = pixel_format
+        self._plane_sizes = get_plane_sizes(width, height, pixel_format)
+        # The index of the scored pair (the frame number in libvmaf's log) that each frame uses.
+        self.scored_frame_indexes = []
+
+    def feed(self, stdin, on_progress):
+        """
+        Writes the frame pairs that need to be scored to stdin, with each distorted frame on top of
+        its reference frame (plane by plane).
+        """
+        frame_size = sum(self._plane_sizes)
+        distorted, reference = bytearray(frame_size), bytearray(frame_size)
+        previous_distorted, previous_reference = bytearray(frame_size), bytearray(frame_size)
+        stacked_frame = bytearray(frame_size * 2)
+        stacked_view = memoryview(stacked_frame)
+
+        distorted_reader = RawFrameReader(
+            self._distorted_video, self._fps, self._distorted_filters, self.pixel_format
+        )
+        reference_reader = RawFrameReader(
+            self._reference_video, self._fps, self._reference_filters, self.pixel_format
+        )
+        scored_count = 0
+        repeats = 0
+        try:
+            while distorted_reader.read_into(distorted) and reference_reader.read_into(reference):
+                # bytearray comparisons are a memcmp, which is cheaper than hashing the frames.
+                is_repeat = (
+                    len(self.scored_frame_indexes) > 0
+                    and distorted == previous_distorted
+                    and reference == previous_reference
+                )
+                repeats = repeats + 1 if is_repeat else 0
+
+                if repeats < 2:
+                    distorted_view, reference_view = memoryview(distorted), memoryview(reference)
+                    offset = 0
+                    for plane_size in self._plane_sizes:
+                        stacked_offset = offset * 2
+                        stacked_view[stacked_offset : stacked_offset + plane_size] = distorted_view[
+                            offset : offset + plane_size
+                        ]
+                        stacked_view[
+                            stacked_offset + plane_size : stacked_offset + plane_size * 2
+                        ] = reference_view[offset : offset + plane_size]
+                        offset += plane_size
+                    stdin.write(stacked_frame)
+                    scored_count += 1
+
+                self.scored_frame_indexes.append(scored_count - 1)
+                distorted, previous_distorted = previous_distorted, distorted
+                reference, previous_reference = previous_reference, reference
+                on_progress()
+        finally:
+            distorted_reader.close()
+            reference_reader.close()
+
+
+def _pool(scores):
+    # The same pooled metrics as libvmaf's JSON log.
+    return {
+        "min": float(scores.min()),
+        "max": float(scores.max()),
+        "mean": float(scores.mean()),
+        "harmonic_mean": float(1 / np.mean(1 / (scores + 1)) - 1),
+    }
+
+
+def expand_frame_metrics(json_file_path, scored_frame_indexes):
+    """
+    Rewrites the libvmaf log of the scored pairs so that it has an entry for every frame, and recalculates
+    the pooled metrics from every frame. Frames that reused the scores of an earlier frame have a
+    "reused_from" key with its frame number. Returns the number of frames and the number of reused frames.
+    """
+    with open(json_file_path, "r") as f:
+        log_contents = json.load(f)
+
+    scored_frames = log_contents["frames"]
+    # The frame number of each scored pair.
+    source_frame_numbers = {}
+    frames = []
+    for frame_number, scored_index in enumerate(scored_frame_indexes):
+        # libvmaf stops at the end of the shorter input.
+        if scored_index >= len(scored_frames):
+            break
+        frame = {"frameNum": frame_number, "metrics": scored_frames[scored_index]["metrics"]}
+        if scored_index in source_frame_numbers:
+            frame["reused_from"] = source_frame_numbers[scored_index]
+        else:
+            source_frame_numbers[scored_index] = frame_number
+        frames.append(frame)
+
+    reused_count = len(frames) - len(source_frame_numbers)
+    log_contents["frames"] = frames
+    if frames:
+        log_contents["pooled_metrics"] = {
+            metric_key: _pool(np.array([frame["metrics"][metric_key] for frame in frames]))
+            for metric_key in frames[0]["metrics"]
+        }
+    log_contents["reused_frames"] = reused_count
+
+    with open(json_file_path, "w") as f:
+        json.dump(log_contents, f)
+
+    return len(frames), reused_count
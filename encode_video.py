@@ -1,15 +1,76 @@
+from encoders import get_encoder
 from ffmpeg_process_factory import EncodingArguments, FfmpegProcessFactory
-from utils import Logger, Timer
+from utils import Logger, Timer, VideoInfoProvider
 
 log = Logger("encode_video.py")
 
 
-def encode_video(video_path, args, crf, preset, output_path, message, duration):
-    arguments = EncodingArguments(video_path, args.video_encoder, output_path)
+class EncodeAborted(Exception):
+    def __init__(self, reason, guard, resource_usage):
+        super().__init__(reason)
+        self.reason = reason
+        self.projected_bitrate_bps = guard.projected_bitrate_bps
+        self.projected_size_bytes = guard.projected_size_bytes
+        self.resource_usage = resource_usage
+
+
+class EncodeCeilingGuard:
+    """
+    Watches the -progress output of an encode and returns a reason to abort it once the projected
+    bitrate or size of the transcode clearly exceeds --max-bitrate or --max-size.
+    """
+
+    # Don't trust the projection until this much of the video has been encoded.
+    MINIMUM_SECONDS = 2
+    MINIMUM_FRACTION = 0.1
+    # The projection must exceed the ceiling by this factor.
+    MARGIN = 1.1
+
+    def __init__(self, input_duration, max_bitrate_bps=None, max_size_bytes=None):
+        self._input_duration = input_duration
+        self._max_bitrate_bps = max_bitrate_bps
+        self._max_size_bytes = max_size_bytes
+        self.projected_bitrate_bps = None
+        self.projected_size_bytes = None
+
+    def __call__(self, progress):
+        try:
+            total_size = int(progress["total_size"])
+            # out_time_ms is actually in microseconds, like out_time_us in newer builds of FFmpeg.
+            out_time = int(progress.get("out_time_us", progress.get("out_time_ms"))) / 1_000_000
+        except (KeyError, TypeError, ValueError):
+            return None
+
+        if self._max_size_bytes and total_size > self._max_size_bytes:
+            self.projected_size_bytes = total_size
+            return f"the transcode is already larger than {self._max_size_bytes / 1_000_000} MB"
+
+        if out_time < max(self.MINIMUM_SECONDS, self.MINIMUM_FRACTION * self._input_duration):
+            return None
 
-    if args.video_encoder == "libaom-av1":
-        arguments.av1_cpu_used(str(args.av1_cpu_used))
+        self.projected_bitrate_bps = total_size * 8 / out_time
+        self.projected_size_bytes = self.projected_bitrate_bps / 8 * self._input_duration
 
+        if self._max_bitrate_bps and self.projected_bitrate_bps > self._max_bitrate_bps * self.MARGIN:
+            return (
+                f"the projected bitrate ({self.projected_bitrate_bps / 1_000_000:.2f} Mbps) "
+                f"exceeds {self._max_bitrate_bps / 1_000_000} Mbps"
+            )
+
+        if self._max_size_bytes and self.projected_size_bytes > self._max_size_bytes * self.MARGIN:
+            return (
+                f"the projected size ({self.projected_size_bytes / 1_000_000:.2f} MB) "
+                f"exceeds {self._max_size_bytes / 1_000_000} MB"
+            )
+
+        return None
+
+
+def encode_video(video_path, args, crf, preset, output_path, message, duration):
+    arguments = EncodingArguments(video_path, args.video_encoder, output_path)
+    arguments.speed(get_encoder(args.video_encoder).get_speed(args))
+    arguments.threads(args.encoder_threads)
+    arguments.filter_threads(args.filter_threads)
     arguments.crf(str(crf))
     arguments.preset(preset)
     video_filters = args.video_filters if args.video_filters else None
@@ -18,11 +79,25 @@ def encode_video(video_path, args, crf, preset, output_path, message, duration):
     factory = FfmpegProcessFactory()
     process = factory.create_process(arguments, args)
 
+    guard = None
+    if args.max_bitrate or args.max_size:
+        # The input may be a cut or overview video, so its own duration is used for the projection.
+        guard = EncodeCeilingGuard(
+            VideoInfoProvider(video_path).get_duration(),
+            args.max_bitrate * 1_000_000 if args.max_bitrate else None,
+            args.max_size * 1_000_000 if args.max_size else None,
+        )
+        process.set_progress_guard(guard)
+
     log.info(f"Converting the video using {message}...")
     timer = Timer()
     timer.start()
-    process.run(video_path, duration)
+    resource_usage = process.run(video_path, duration)
     time_taken = timer.stop(args.decimal_places)
+
+    if process.abort_reason:
+        raise EncodeAborted(process.abort_reason, guard, resource_usage)
+
     log.info("Done!")
 
-    return factory, time_taken
+    return factory, time_taken, resource_usage
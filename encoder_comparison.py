@@ -0,0 +1,411 @@
+from argparse import Namespace
+import json
+import os
+
+import matplotlib.pyplot as plt
+import numpy as np
+from prettytable import PrettyTable
+
+from encoders import ENCODERS, get_encoder
+from ffmpeg_process_factory import (
+    EncodingArguments,
+    FfmpegError,
+    FfmpegProcessFactory,
+    MultipleEncodingArguments,
+)
+from libvmaf import run_libvmaf_multiple
+from metrics import get_metrics_save_table
+from planner import CostModel
+from results_db import get_settings_key
+from results_writer import create_results_record, ResultsWriter
+from supervisor import run_with_retries
+from utils import force_decimal_places, line, Logger, set_log_context, Timer, VideoInfoProvider
+
+log = Logger("encoder_comparison")
+
+
+def parse_encoder_crfs(values):
+    """
+    Parses --compare-encoders values such as "x264:18,22,26" into a list of (encoder, [crf, ...]) tuples.
+    """
+    encoder_crfs = []
+    for value in values:
+        encoder, separator, crfs = value.partition(":")
+        if encoder not in ENCODERS or not separator:
+            raise ValueError(f'Invalid --compare-encoders value "{value}".')
+        crf_values = [int(crf) for crf in crfs.split(",") if crf.strip()]
+        if len(crf_values) < 2:
+            raise ValueError(f'At least two CRF values are required for each encoder ("{value}").')
+        lowest, highest = get_encoder(encoder).crf_range
+        if not all(lowest <= crf <= highest for crf in crf_values):
+            raise ValueError(f"The CRF values of {encoder} must be between {lowest} and {highest}.")
+        encoder_crfs.append((encoder, crf_values))
+
+    if len({encoder for encoder, _ in encoder_crfs}) != len(encoder_crfs):
+        raise ValueError("Each encoder can only be specified once with --compare-encoders.")
+    return encoder_crfs
+
+
+def _average_difference(x_a, y_a, x_b, y_b):
+    """
+    Fits a polynomial to each curve and returns the average difference of y_b - y_a over the x range
+    that both curves cover, or None if they don't overlap.
+    """
+    low = max(x_a.min(), x_b.min())
+    high = min(x_a.max(), x_b.max())
+    if high <= low:
+        return None
+
+    # A cubic fit, as in the Bjøntegaard model, or a lower degree if there are fewer than four points.
+    integrals = []
+    for x, y in [(x_a, y_a), (x_b, y_b)]:
+        integral = np.polyint(np.polyfit(x, y, min(3, len(x) - 1)))
+        integrals.append(np.polyval(integral, high) - np.polyval(integral, low))
+    return (integrals[1] - integrals[0]) / (high - low)
+
+
+def calculate_bd_rate(anchor_bitrates, anchor_vmaf, test_bitrates, test_vmaf):
+    """
+    The average bitrate difference (%) of the test curve compared to the anchor at the same VMAF.
+    Negative values mean that the test encoder needs a lower bitrate.
+    """
+    difference = _average_difference(
+        np.asarray(anchor_vmaf, dtype=np.float64),
+        np.log(np.asarray(anchor_bitrates, dtype=np.float64)),
+        np.asarray(test_vmaf, dtype=np.float64),
+        np.log(np.asarray(test_bitrates, dtype=np.float64)),
+    )
+    return None if difference is None else float((np.exp(difference) - 1) * 100)
+
+
+def calculate_bd_vmaf(anchor_bitrates, anchor_vmaf, test_bitrates, test_vmaf):
+    """
+    The average VMAF difference of the test curve compared to the anchor at the same bitrate.
+    """
+    difference = _average_difference(
+        np.log(np.asarray(anchor_bitrates, dtype=np.float64)),
+        np.asarray(anchor_vmaf, dtype=np.float64),
+        np.log(np.asarray(test_bitrates, dtype=np.float64)),
+        np.asarray(test_vmaf, dtype=np.float64),
+    )
+    return None if difference is None else float(difference)
+
+
+class EncodedPoint:
+    def __init__(
+        self,
+        encoder,
+        crf,
+        name,
+        staged,
+        encoder_args,
+        json_file_path,
+        time_taken,
+        encode_usage,
+        encode_shared_by,
+    ):
+        self.encoder = encoder
+        self.crf = crf
+        self.name = name
+        self.staged = staged
+        self.encoder_args = encoder_args
+        self.json_file_path = json_file_path
+        self.time_taken = time_taken
+        self.encode_usage = encode_usage
+        # The number of points that were encoded from the same decode.
+        self.encode_shared_by = encode_shared_by
+
+
+def _get_encoder_args(args, encoder, crf_values, preset):
+    encoder_args = Namespace(**vars(args))
+    encoder_args.video_encoder = encoder
+    encoder_args.crf = crf_values
+    encoder_args.preset = preset
+    return encoder_args
+
+
+def _record_failed_point(encoder_args, comparison_table, video_path, crf, preset, status, error):
+    line()
+    results_record = create_results_record(encoder_args, video_path, crf, preset)
+    results_record["status"] = status
+    results_record["error"] = str(error)
+    ResultsWriter(os.path.dirname(comparison_table), encoder_args.results_format).append(
+        results_record
+    )
+
+
+def run_encoder_comparison(
+    args,
+    encoder_crfs,
+    preset,
+    reference_video_path,
+    output_folder,
+    comparison_table,
+    table,
+    fps,
+    duration,
+    scratch_space,
+    results_db,
+):
+    """
+    Encodes the video with every encoder at the same time, from a single decode of the reference per round
+    (round i encodes the i-th CRF of each encoder), and then scores every transcode with a single decode
+    of the reference. Returns the (bitrate, VMAF) curve of each encoder.
+    """
+    reference_provider = VideoInfoProvider(reference_video_path)
+    width, height = reference_provider.get_resolution()
+    pixels = (
+        width
+        * height
+        * reference_provider.get_duration()
+        * reference_provider.get_framerate_float()
+    )
+    cost_model = CostModel(args.cost_model)
+
+    curves = {encoder: {"crf": [], "bitrate_bps": [], "vmaf": []} for encoder, _ in encoder_crfs}
+    round_count = max(len(crf_values) for _, crf_values in encoder_crfs)
+    # The transcodes are kept until every round has been encoded, so that they can all be scored together.
+    encoded_points = []
+
+    for round_index in range(round_count):
+        points = []
+        for encoder, crf_values in encoder_crfs:
+            if round_index >= len(crf_values):
+                continue
+            crf = crf_values[round_index]
+            point_name = f"{encoder} CRF {crf}"
+            staged = scratch_space.stage(
+                # Matroska supports every encoder.
+                os.path.join(output_folder, point_name, f"{point_name}.mkv"),
+                cost_model.estimate_size(encoder, crf, pixels),
+            )
+            # Each encoder uses the preset if it supports it, otherwise its own default preset.
+            encoder_args = _get_encoder_args(
+                args, encoder, crf_values, get_encoder(encoder).resolve_preset(preset)
+            )
+            points.append((encoder, crf, point_name, staged, encoder_args))
+
+        point_names = ", ".join(point_name for _, _, point_name, _, _ in points)
+        set_log_context(point=point_names)
+        log.info(f"| {point_names} |")
+        line()
+
+        def encode_points():
+            encodings = []
+            for encoder, crf, _, staged, encoder_args in points:
+                encoding = EncodingArguments(reference_video_path, encoder, staged.path)
+                encoding.speed(get_encoder(encoder).get_speed(args))
+                # The encoders run at the same time, so the threads are split between them.
+                if args.encoder_threads:
+                    encoding.threads(max(1, int(args.encoder_threads) // len(points)))
+                encoding.crf(str(crf))
+                encoding.preset(encoder_args.preset)
+                encodings.append(encoding)
+
+            arguments = MultipleEncodingArguments(reference_video_path, encodings)
+            arguments.video_filters(args.video_filters)
+            arguments.filter_threads(args.filter_threads)
+
+            log.info(f"Encoding {point_names} at the same time...")
+            timer = Timer()
+            timer.start()
+            resource_usage = (
+                FfmpegProcessFactory()
+                .create_process(arguments, args)
+                .run(reference_video_path, duration)
+            )
+            log.info("Done!")
+            return timer.stop(args.decimal_places), resource_usage
+
+        try:
+            time_taken, encode_usage = run_with_retries(
+                encode_points, f"encode of {point_names}", args.max_retries, args.retry_backoff
+            )
+        except FfmpegError as error:
+            for _, crf, _, staged, encoder_args in points:
+                scratch_space.finish(staged, keep=False)
+                _record_failed_point(
+                    encoder_args,
+                    comparison_table,
+                    staged.path,
+                    crf,
+                    encoder_args.preset,
+                    "failed_encode",
+                    error,
+                )
+            continue
+
+        for encoder, crf, point_name, staged, encoder_args in points:
+            point_folder = os.path.join(output_folder, point_name)
+            os.makedirs(point_folder, exist_ok=True)
+            encoded_points.append(
+                EncodedPoint(
+                    encoder,
+                    crf,
+                    point_name,
+                    staged,
+                    encoder_args,
+                    f"{point_folder}/Metrics of each frame.json",
+                    time_taken,
+                    encode_usage,
+                    len(points),
+                )
+            )
+
+    if not encoded_points:
+        save_encoder_comparison(curves, output_folder, args.decimal_places)
+        return curves
+
+    # Every transcode is scored with a single decode of the reference.
+    set_log_context(point=None)
+    try:
+        scoring_usage = run_with_retries(
+            lambda: run_libvmaf_multiple(
+                [point.staged.path for point in encoded_points],
+                args,
+                [point.json_file_path for point in encoded_points],
+                fps,
+                reference_video_path,
+                FfmpegProcessFactory(),
+                duration,
+            ),
+            f"VMAF calculation of {len(encoded_points)} transcodes",
+            args.max_retries,
+            args.retry_backoff,
+        )
+    except FfmpegError as error:
+        for point in encoded_points:
+            _record_failed_point(
+                point.encoder_args,
+                comparison_table,
+                point.staged.path,
+                point.crf,
+                point.encoder_args.preset,
+                "failed_scoring",
+                error,
+            )
+            scratch_space.finish(point.staged, keep=args.keep_transcodes)
+        save_encoder_comparison(curves, output_folder, args.decimal_places)
+        return curves
+
+    for point in encoded_points:
+        set_log_context(point=point.name)
+        encoder_args = point.encoder_args
+        transcode_path = point.staged.path
+        if args.keep_transcodes:
+            transcode_path = scratch_space.finish(point.staged, keep=True)
+
+        results_record = create_results_record(
+            encoder_args, transcode_path, point.crf, encoder_args.preset
+        )
+        results_record["settings_key"] = get_settings_key(
+            encoder_args, point.crf, encoder_args.preset
+        )
+        # The encode was shared by every point of the round, and the VMAF calculation by every point.
+        results_record["encode_shared_by"] = point.encode_shared_by
+        results_record["scoring_shared_by"] = len(encoded_points)
+
+        size_rounded = force_decimal_places(
+            results_record["size_bytes"] / 1_000_000, args.decimal_places
+        )
+        bitrate = force_decimal_places(
+            results_record["bitrate_bps"] / 1_000_000, args.decimal_places
+        )
+        vmaf = get_metrics_save_table(
+            comparison_table,
+            point.json_file_path,
+            encoder_args,
+            args.decimal_places,
+            [f"{size_rounded} MB", f"{bitrate} Mbps"],
+            table,
+            os.path.dirname(point.json_file_path),
+            point.time_taken,
+            point.name,
+            point.encode_usage,
+            scoring_usage,
+            results_record,
+            results_db,
+        )
+        if not args.keep_transcodes:
+            scratch_space.finish(point.staged, keep=False)
+
+        curves[point.encoder]["crf"].append(point.crf)
+        curves[point.encoder]["bitrate_bps"].append(results_record["bitrate_bps"])
+        curves[point.encoder]["vmaf"].append(vmaf)
+
+    save_encoder_comparison(curves, output_folder, args.decimal_places)
+    return curves
+
+
+def save_encoder_comparison(curves, output_folder, decimal_places):
+    """
+    Saves the BD-rate and BD-VMAF of each encoder compared to the first one, and a chart of every curve.
+    """
+    encoders = [encoder for encoder, curve in curves.items() if len(curve["vmaf"]) >= 2]
+    bd_results = []
+    if encoders:
+        anchor = curves[encoders[0]]
+        for encoder in encoders[1:]:
+            curve = curves[encoder]
+            bd_results.append(
+                {
+                    "anchor": encoders[0],
+                    "encoder": encoder,
+                    "bd_rate_percent": calculate_bd_rate(
+                        anchor["bitrate_bps"], anchor["vmaf"], curve["bitrate_bps"], curve["vmaf"]
+                    ),
+                    "bd_vmaf": calculate_bd_vmaf(
+                        anchor["bitrate_bps"], anchor["vmaf"], curve["bitrate_bps"], curve["vmaf"]
+                    ),
+                }
+            )
+
+    with open(os.path.join(output_folder, "BD-Rate.json"), "w") as f:
+        json.dump({"curves": curves, "bd": bd_results}, f, indent=4)
+
+    table = PrettyTable()
+    table.field_names = ["Encoder", "Anchor", "BD-Rate", "BD-VMAF"]
+    for result in bd_results:
+        table.add_row(
+            [
+                result["encoder"],
+                result["anchor"],
+                (
+                    "N/A"
+                    if result["bd_rate_percent"] is None
+                    else f"{force_decimal_places(result['bd_rate_percent'], decimal_places)}%"
+                ),
+                (
+                    "N/A"
+                    if result["bd_vmaf"] is None
+                    else force_decimal_places(result["bd_vmaf"], decimal_places)
+                ),
+            ]
+        )
+    with open(os.path.join(output_folder, "BD-Rate.txt"), "w") as f:
+        f.write(
+            "Negative BD-Rate values mean that the encoder needs a lower bitrate than the anchor "
+            "for the same VMAF. N/A means that the curves do not overlap.\n"
+        )
+        f.write(table.get_string())
+    log.info(
+        f"BD-Rate compared to {encoders[0] if encoders else 'the anchor'}:\n{table.get_string()}"
+    )
+
+    plt.suptitle("Bitrate vs VMAF")
+    plt.xlabel("Bitrate (Mbps)")
+    plt.ylabel("VMAF")
+    plt.xscale("log")
+    for encoder, curve in curves.items():
+        if not curve["vmaf"]:
+            continue
+        order = np.argsort(curve["bitrate_bps"])
+        plt.plot(
+            np.asarray(curve["bitrate_bps"])[order] / 1_000_000,
+            np.asarray(curve["vmaf"])[order],
+            marker="o",
+            label=encoder,
+        )
+    plt.legend(loc="lower right")
+    plt.savefig(os.path.join(output_folder, "Bitrate vs VMAF"))
+    plt.clf()
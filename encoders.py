@@ -0,0 +1,200 @@
+"""
+The encoders that VQM can use. Each backend declares its FFmpeg library, its quality and speed options,
+its defaults, the containers it can't be muxed into and how its threads are set.
+To add an encoder, add an EncoderBackend to ENCODERS.
+"""
+
+X264_PRESETS = [
+    "ultrafast",
+    "superfast",
+    "veryfast",
+    "faster",
+    "fast",
+    "medium",
+    "slow",
+    "slower",
+    "veryslow",
+]
+# The relative CPU time of each x264/x265 preset compared to medium.
+X264_PRESET_COSTS = {
+    "ultrafast": 0.1,
+    "superfast": 0.15,
+    "veryfast": 0.25,
+    "faster": 0.4,
+    "fast": 0.65,
+    "medium": 1,
+    "slow": 1.6,
+    "slower": 3.5,
+    "veryslow": 7,
+}
+
+# AV1 can't be muxed into these containers.
+AV1_CONTAINER_FALLBACKS = {".m4v": ".mp4", ".avi": ".mkv", ".flv": ".mkv"}
+
+
+class EncoderBackend:
+    def __init__(
+        self,
+        name,
+        library,
+        description,
+        default_crf,
+        crf_range,
+        presets=None,
+        default_preset=None,
+        preset_costs=None,
+        quality_option="-crf",
+        preset_option="-preset",
+        speed_option=None,
+        extra_arguments=(),
+        thread_arguments=lambda threads: ["-threads", str(threads)],
+        container_fallbacks=None,
+        default_cpu_per_megapixel=0.1,
+        size_model=(23, 6),
+    ):
+        self.name = name
+        self.library = library
+        self.description = description
+        self.default_crf = default_crf
+        # The (lowest, highest) value of the quality option.
+        self.crf_range = crf_range
+        self.presets = presets or []
+        self.default_preset = default_preset
+        # The relative CPU time of each preset compared to the default preset.
+        self.preset_costs = preset_costs or {}
+        self.quality_option = quality_option
+        self.preset_option = preset_option
+        # An (FFmpeg option, argument name) tuple, if the speed is set by an argument instead of the preset.
+        self.speed_option = speed_option
+        self.extra_arguments = list(extra_arguments)
+        self.thread_arguments = thread_arguments
+        # Maps each container that the encoder can't be muxed into to the container that is used instead.
+        self.container_fallbacks = container_fallbacks or {}
+        # A rough default for the cost model, at the default preset.
+        self.default_cpu_per_megapixel = default_cpu_per_megapixel
+        # The cost model assumes a rough default bits per pixel at size_model[0],
+        # halving every size_model[1] steps of the quality option.
+        self.size_model = size_model
+
+    def get_speed(self, args):
+        if self.speed_option is None:
+            return None
+        return getattr(args, self.speed_option[1])
+
+    def resolve_preset(self, preset):
+        """
+        Returns the preset if this encoder supports it, otherwise the default preset of this encoder.
+        """
+        return preset if preset in self.presets else self.default_preset
+
+    def get_preset_cost(self, preset):
+        # The speed argument is used instead of the preset, so the preset makes no difference.
+        if self.speed_option is not None:
+            return 1
+        return self.preset_costs.get(str(preset), 1)
+
+    def get_output_extension(self, extension):
+        return self.container_fallbacks.get(extension.lower(), extension)
+
+    def get_codec_arguments(self, crf, preset, speed=None, threads=None):
+        codec_arguments = ["-c:v", self.library, self.quality_option, str(crf)]
+        codec_arguments += self.extra_arguments
+
+        if self.speed_option is not None:
+            codec_arguments += [self.speed_option[0], str(speed)]
+        elif self.preset_option is not None:
+            codec_arguments += [self.preset_option, str(preset)]
+
+        if threads:
+            codec_arguments += self.thread_arguments(threads)
+        return codec_arguments
+
+
+def _numbered_costs(values, default, halving):
+    # Each step towards the slowest value doubles the CPU time every halving steps.
+    return {str(value): 2 ** ((default - value) / halving) for value in values}
+
+
+ENCODERS = {
+    backend.name: backend
+    for backend in [
+        EncoderBackend(
+            "x264",
+            "libx264",
+            "x264 (H.264)",
+            default_crf="23",
+            crf_range=(0, 51),
+            presets=X264_PRESETS,
+            default_preset="medium",
+            preset_costs=X264_PRESET_COSTS,
+            default_cpu_per_megapixel=0.03,
+        ),
+        EncoderBackend(
+            "x265",
+            "libx265",
+            "x265 (H.265)",
+            default_crf="28",
+            crf_range=(0, 51),
+            presets=X264_PRESETS,
+            default_preset="medium",
+            preset_costs=X264_PRESET_COSTS,
+            # x265 has its own thread pool which is not limited by -threads.
+            thread_arguments=lambda threads: [
+                "-threads",
+                str(threads),
+                "-x265-params",
+                f"pools={threads}",
+            ],
+            # The M4V container does not support the H.265 codec.
+            container_fallbacks={".m4v": ".mp4"},
+            default_cpu_per_megapixel=0.15,
+        ),
+        EncoderBackend(
+            "libaom-av1",
+            "libaom-av1",
+            "libaom-av1 (AV1)",
+            default_crf="32",
+            crf_range=(0, 63),
+            # The quality/speed tradeoff is set with --av1-cpu-used.
+            speed_option=("-cpu-used", "av1_cpu_used"),
+            # Constant quality mode.
+            extra_arguments=["-b:v", "0"],
+            container_fallbacks=AV1_CONTAINER_FALLBACKS,
+            default_cpu_per_megapixel=0.5,
+        ),
+        EncoderBackend(
+            "svt-av1",
+            "libsvtav1",
+            "SVT-AV1 (AV1)",
+            default_crf="35",
+            crf_range=(1, 63),
+            presets=[str(preset) for preset in range(0, 14)],
+            default_preset="8",
+            preset_costs=_numbered_costs(range(0, 14), 8, 1.5),
+            # SVT-AV1 ignores -threads. lp is the number of logical processors that it uses.
+            thread_arguments=lambda threads: ["-svtav1-params", f"lp={threads}"],
+            container_fallbacks=AV1_CONTAINER_FALLBACKS,
+            default_cpu_per_megapixel=0.06,
+        ),
+        EncoderBackend(
+            "rav1e",
+            "librav1e",
+            "rav1e (AV1)",
+            # rav1e has no CRF, so the constant quantizer (0-255) is used instead.
+            default_crf="100",
+            crf_range=(0, 255),
+            quality_option="-qp",
+            presets=[str(speed) for speed in range(0, 11)],
+            default_preset="6",
+            preset_costs=_numbered_costs(range(0, 11), 6, 1.5),
+            preset_option="-speed",
+            container_fallbacks=AV1_CONTAINER_FALLBACKS,
+            default_cpu_per_megapixel=0.3,
+            size_model=(92, 24),
+        ),
+    ]
+}
+
+
+def get_encoder(name):
+    return ENCODERS[name]
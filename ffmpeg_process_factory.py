@@ -1,5 +1,12 @@
+import os
+import shutil
 import subprocess
+import threading
+from time import time
 
+from encoders import get_encoder
+from resource_usage import read_proc_io, wait_and_collect_usage
+from thread_budget import format_cpu_set
 from utils import line, Logger, show_progress_bar, VideoInfoProvider
 
 log = Logger("factory")
@@ -11,10 +18,13 @@ class EncodingArguments:
         self._encoder = encoder
         self._outfile = outfile
         self._base_ffmpeg_arguments = ["-i", self._infile]
+        self._threads = None
+        self._filter_threads = None
+        self._speed = None
 
-    # libaom-av1 "cpu-used" option.
-    def av1_cpu_used(self, value):
-        self._av1_cpu_used = value
+    # The speed argument of encoders that don't use presets, e.g. libaom-av1's cpu-used.
+    def speed(self, value):
+        self._speed = value
 
     def preset(self, value):
         self._preset = value
@@ -31,34 +41,131 @@ class EncodingArguments:
     def outfile(self, value):
         self._outfile = value
 
+    def threads(self, value):
+        self._threads = value
+
+    def filter_threads(self, value):
+        self._filter_threads = value
+
+    def get_outfile(self):
+        return self._outfile
+
+    def get_codec_arguments(self):
+        return get_encoder(self._encoder).get_codec_arguments(
+            self._crf, self._preset, self._speed, self._threads
+        )
+
+    def _get_global_arguments(self):
+        return ["-filter_threads", str(self._filter_threads)] if self._filter_threads else []
+
     def get_arguments(self):
-        base_encoding_arguments = [
+        encoding_arguments = [
             "-map",
             "0:V",
-            "-c:v",
-            "libaom-av1" if self._encoder == "libaom-av1" else f"lib{self._encoder}",
-            "-crf",
-            self._crf,
+            *self.get_codec_arguments(),
+            *self._video_filters,
+            self._outfile,
         ]
 
-        if self._encoder == "libaom-av1":
-            encoding_arguments = base_encoding_arguments + [
-                "-b:v",
-                "0",
-                "-cpu-used",
-                self._av1_cpu_used,
-                *self._video_filters,
-                self._outfile,
-            ]
-        else:
-            encoding_arguments = base_encoding_arguments + [
-                "-preset",
-                self._preset,
-                *self._video_filters,
-                self._outfile,
+        return self._get_global_arguments() + self._base_ffmpeg_arguments + encoding_arguments
+
+
+class LadderEncodingArguments(EncodingArguments):
+    """
+    Encodes several rungs of a bitrate ladder from a single decode of the input. The decoded frames are split
+    and scaled to each rung's height, and each rung is written to its own output file.
+    """
+
+    def __init__(self, infile, encoder, rungs):
+        # rungs is a list of (height, output path) tuples.
+        super().__init__(infile, encoder, None)
+        self._rungs = rungs
+
+    def get_arguments(self):
+        video_filters = f"{self._video_filters[1]}," if self._video_filters else ""
+        split_outputs = "".join(f"[in{i}]" for i in range(len(self._rungs)))
+        filter_graph = [f"[0:V:0]{video_filters}split={len(self._rungs)}{split_outputs}"]
+        output_arguments = []
+        for i, (height, output_path) in enumerate(self._rungs):
+            filter_graph.append(f"[in{i}]scale=-2:{height}:flags=bicubic[out{i}]")
+            output_arguments += ["-map", f"[out{i}]", *self.get_codec_arguments(), output_path]
+
+        return (
+            self._get_global_arguments()
+            + self._base_ffmpeg_arguments
+            + ["-filter_complex", ";".join(filter_graph)]
+            + output_arguments
+        )
+
+
+class MultipleEncodingArguments:
+    """
+    Encodes the input with several encoders/settings from a single decode. Each of the encodings is an
+    EncodingArguments object, which provides the codec arguments and the output path of that encoding.
+    """
+
+    def __init__(self, infile, encodings):
+        self._infile = infile
+        self._encodings = encodings
+        self._filter_threads = None
+        self._video_filters = ""
+
+    def video_filters(self, filters):
+        self._video_filters = filters
+
+    def filter_threads(self, value):
+        self._filter_threads = value
+
+    def get_arguments(self):
+        global_arguments = (
+            ["-filter_threads", str(self._filter_threads)] if self._filter_threads else []
+        )
+        split_outputs = "".join(f"[in{i}]" for i in range(len(self._encodings)))
+        video_filters = f"{self._video_filters}," if self._video_filters else ""
+        filter_graph = f"[0:V:0]{video_filters}split={len(self._encodings)}{split_outputs}"
+
+        output_arguments = []
+        for i, encoding in enumerate(self._encodings):
+            output_arguments += [
+                "-map",
+                f"[in{i}]",
+                *encoding.get_codec_arguments(),
+                encoding.get_outfile(),
             ]
 
-        return self._base_ffmpeg_arguments + encoding_arguments
+        return (
+            global_arguments
+            + ["-i", self._infile, "-filter_complex", filter_graph]
+            + output_arguments
+        )
+
+
+class SegmentArguments:
+    """
+    Extracts a segment of the video stream losslessly. Seeking before the input is frame-accurate
+    because the segment is re-encoded.
+    """
+
+    def __init__(self, infile, outfile, start_time, duration):
+        self._infile = infile
+        self._outfile = outfile
+        self._start_time = start_time
+        self._duration = duration
+
+    def get_arguments(self):
+        return [
+            "-ss",
+            f"{self._start_time:.3f}",
+            "-i",
+            self._infile,
+            "-t",
+            f"{self._duration:.3f}",
+            "-map",
+            "0:V:0",
+            "-c:v",
+            "ffv1",
+            self._outfile,
+        ]
 
 
 class LibVmafArguments:
@@ -67,6 +174,14 @@ class LibVmafArguments:
         self._distorted_video = distorted_video
         self._original_video = original_video
         self._vmaf_options = vmaf_options
+        self._filter_threads = None
+        self._video_filters = ""
+        self._distorted_scale = ""
+        self._reference_scale = ""
+        self._distorted_format = ""
+        self._reference_format = ""
+        self._distorted_trim = ""
+        self._reference_trim = ""
 
     def video_filters(self, filters):
         if filters is not None:
@@ -74,8 +189,34 @@ class LibVmafArguments:
         else:
             self._video_filters = ""
 
+    def filter_threads(self, value):
+        self._filter_threads = value
+
+    def scale_distorted(self, width, height, scaler="bicubic"):
+        # Upscales a lower resolution transcode (e.g. a bitrate ladder rung) to the resolution of the reference.
+        self._distorted_scale = f"scale={width}:{height}:flags={scaler},"
+
+    def scale_reference(self, width, height, scaler="bicubic"):
+        self._reference_scale = f",scale={width}:{height}:flags={scaler}"
+
+    def pixel_formats(self, distorted=None, reference=None):
+        # Converts the pixel format of either input, so that FFmpeg doesn't choose the conversions itself.
+        self._distorted_format = f"format={distorted}," if distorted else ""
+        self._reference_format = f",format={reference}" if reference else ""
+
+    def trim_start(self, distorted_frames, reference_frames):
+        # Drops the leading frames of either input so that their frames line up (see alignment.py).
+        self._distorted_trim = f"trim=start_frame={distorted_frames}," if distorted_frames else ""
+        self._reference_trim = f"trim=start_frame={reference_frames}," if reference_frames else ""
+
     def get_arguments(self):
-        return [
+        global_arguments = (
+            ["-filter_complex_threads", str(self._filter_threads)] if self._filter_threads else []
+        )
+
+        vmaf_options = self.get_vmaf_options()
+        distorted_filters, reference_filters = self.get_filters()
+        return global_arguments + [
             "-r",
             self._fps,
             "-i",
@@ -89,8 +230,83 @@ class LibVmafArguments:
             "-map",
             "1:V",
             "-lavfi",
-            f"[0:v]setpts=PTS-STARTPTS[dist];"
-            f"[1:v]setpts=PTS-STARTPTS{self._video_filters}[ref];"
+            f"[0:v]{distorted_filters}[dist];"
+            f"[1:v]{reference_filters}[ref];"
+            f"[dist][ref]libvmaf={vmaf_options}",
+            "-f",
+            "null",
+            "-",
+        ]
+
+    def get_distorted_video(self):
+        return self._distorted_video
+
+    def get_vmaf_options(self):
+        if self._distorted_trim or self._reference_trim:
+            # The untrimmed input has extra frames at the end, which must not be compared with
+            # a repeat of the last frame of the trimmed input.
+            return f"{self._vmaf_options.strip()}:shortest=1"
+        return self._vmaf_options
+
+    def get_reference_branch_filters(self):
+        # The reference filters after the video filters, which differ between the branches of
+        # MultipleLibVmafArguments.
+        return (
+            f"{self._reference_trim}setpts=PTS-STARTPTS"
+            f"{self._reference_scale}{self._reference_format}"
+        )
+
+    def get_filters(self):
+        """
+        Returns the filter chains of the distorted and reference inputs of libvmaf.
+        """
+        return (
+            f"{self._distorted_trim}{self._distorted_scale}{self._distorted_format}"
+            "setpts=PTS-STARTPTS",
+            f"{self._reference_trim}setpts=PTS-STARTPTS{self._video_filters}"
+            f"{self._reference_scale}{self._reference_format}",
+        )
+
+
+class PipedLibVmafArguments:
+    """
+    Calculates the VMAF of distorted/reference frame pairs that are written to stdin as raw frames,
+    with each distorted frame stacked on top of its reference frame.
+    """
+
+    def __init__(self, fps, width, height, pixel_format, vmaf_options):
+        self._fps = fps
+        self._width = width
+        self._height = height
+        self._pixel_format = pixel_format
+        self._vmaf_options = vmaf_options
+        self._filter_threads = None
+
+    def filter_threads(self, value):
+        self._filter_threads = value
+
+    def get_arguments(self):
+        global_arguments = (
+            ["-filter_complex_threads", str(self._filter_threads)] if self._filter_threads else []
+        )
+        width, height = self._width, self._height
+
+        return global_arguments + [
+            # stdin is used for the frames.
+            "-nostdin",
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            self._pixel_format,
+            "-s",
+            f"{width}x{height * 2}",
+            "-r",
+            self._fps,
+            "-i",
+            "-",
+            "-lavfi",
+            f"[0:v]split[top][bottom];[top]crop={width}:{height}:0:0[dist];"
+            f"[bottom]crop={width}:{height}:0:{height}[ref];"
             f"[dist][ref]libvmaf={self._vmaf_options}",
             "-f",
             "null",
@@ -98,6 +314,60 @@ class LibVmafArguments:
         ]
 
 
+class MultipleLibVmafArguments:
+    """
+    Calculates the VMAF of several distorted videos with a single decode of the reference,
+    which is split between one libvmaf filter per distorted video. Each branch is a LibVmafArguments object
+    of one of the distorted videos, which provides its libvmaf options (including the log path) and
+    the scale, format and trim filters of both of its inputs.
+    """
+
+    def __init__(self, fps, branches, original_video):
+        self._fps = fps
+        self._branches = branches
+        self._original_video = original_video
+        self._filter_threads = None
+        self._video_filters = ""
+
+    def video_filters(self, filters):
+        self._video_filters = f",{filters}" if filters is not None else ""
+
+    def filter_threads(self, value):
+        self._filter_threads = value
+
+    def get_arguments(self):
+        global_arguments = (
+            ["-filter_complex_threads", str(self._filter_threads)] if self._filter_threads else []
+        )
+        count = len(self._branches)
+
+        input_arguments = []
+        for branch in self._branches:
+            input_arguments += ["-r", self._fps, "-i", branch.get_distorted_video()]
+        input_arguments += ["-r", self._fps, "-i", self._original_video]
+
+        references = "".join(f"[ref{i}]" for i in range(count))
+        filter_graph = [
+            f"[{count}:V:0]setpts=PTS-STARTPTS{self._video_filters},split={count}{references}"
+        ]
+        output_arguments = []
+        for i, branch in enumerate(self._branches):
+            distorted_filters, _ = branch.get_filters()
+            filter_graph.append(
+                f"[{i}:V:0]{distorted_filters}[dist{i}];"
+                f"[ref{i}]{branch.get_reference_branch_filters()}[branchref{i}];"
+                f"[dist{i}][branchref{i}]libvmaf={branch.get_vmaf_options().strip()}[vmaf{i}]"
+            )
+            output_arguments += ["-map", f"[vmaf{i}]", "-f", "null", "-"]
+
+        return (
+            global_arguments
+            + input_arguments
+            + ["-lavfi", ";".join(filter_graph)]
+            + output_arguments
+        )
+
+
 class FfmpegProcessFactory:
     def create_process(self, arguments, args):
         _process_base_arguments = [
@@ -113,22 +383,169 @@ class FfmpegProcessFactory:
         return process
 
 
+class FfmpegError(Exception):
+    pass
+
+
+class FfmpegCancelled(Exception):
+    """
+    Raised when an FFmpeg process is killed because its cancel_event was set. It is not an FfmpegError,
+    so it is not retried.
+    """
+
+
 class FfmpegProcess:
     def __init__(self, arguments, args):
         self._arguments = arguments
+        self._cpu_set = getattr(args, "cpu_set", None)
+        self._stall_timeout = getattr(args, "stall_timeout", 0)
+        # A threading.Event that is set (from another thread) to kill the process.
+        self._cancel_event = getattr(args, "cancel_event", None)
+        self._progress_guard = None
+        self._stdin_feeder = None
+        self._stdin_feeder_error = None
+        self.abort_reason = None
+        self.stalled = False
+        self.cancelled = False
         if args.show_commands:
             line()
             log.debug(f'Running the following command:\n{" ".join(self._arguments)}')
             line()
 
+    def set_progress_guard(self, progress_guard):
+        """
+        progress_guard is called with each block of -progress output. If it returns a reason,
+        the process is killed and the reason is stored in abort_reason.
+        """
+        self._progress_guard = progress_guard
+
+    def set_stdin_feeder(self, stdin_feeder):
+        """
+        stdin_feeder is called in a separate thread with the stdin of the process and a function to call
+        whenever it makes progress. stdin is closed once it returns.
+        """
+        self._stdin_feeder = stdin_feeder
+
     def run(self, video_path, duration):
         self._video_path = video_path
         self._duration = duration
 
         video_info = VideoInfoProvider(self._video_path)
         self._total_frames = int((video_info.get_framerate_float() * self._duration) + 1)
+        if self._cancel_event and self._cancel_event.is_set():
+            raise FfmpegCancelled("FFmpeg was cancelled before it started")
 
         # Start the FFmpeg process.
-        self._process = subprocess.Popen(self._arguments, stdout=subprocess.PIPE)
+        start_time = time()
+        self._process = subprocess.Popen(
+            self._get_command(),
+            stdin=subprocess.PIPE if self._stdin_feeder else None,
+            stdout=subprocess.PIPE,
+        )
+        self._pin_after_start()
+        self._io_counters = None
+        self._last_progress = None
+        self._last_progress_time = start_time
+
+        stdin_thread = None
+        if self._stdin_feeder:
+            stdin_thread = threading.Thread(target=self._feed_stdin, daemon=True)
+            stdin_thread.start()
+
+        stop_watchdog = threading.Event()
+        if self._stall_timeout or self._cancel_event:
+            threading.Thread(target=self._watch, args=(stop_watchdog,), daemon=True).start()
+
         # Use tqdm to show a progress bar.
-        show_progress_bar(self._process, self._total_frames)
+        try:
+            show_progress_bar(self._process, self._total_frames, self._on_progress)
+        finally:
+            stop_watchdog.set()
+            if stdin_thread:
+                stdin_thread.join()
+        # /proc/<pid>/io can still be read while the process is a zombie.
+        self._sample_io()
+        self.resource_usage = wait_and_collect_usage(self._process, self._io_counters)
+        self.resource_usage.wall_time = time() - start_time
+
+        if self.cancelled:
+            raise FfmpegCancelled("FFmpeg was cancelled")
+        if self.stalled:
+            raise FfmpegError(f"FFmpeg made no progress for {self._stall_timeout} seconds")
+        if self._stdin_feeder_error:
+            raise FfmpegError(f"Unable to write the frames to FFmpeg: {self._stdin_feeder_error}")
+        # A non-zero exit code is expected if the process was killed by the progress guard.
+        if self._process.returncode != 0 and self.abort_reason is None:
+            raise FfmpegError(f"FFmpeg exited with code {self._process.returncode}")
+
+        return self.resource_usage
+
+    def _feed_stdin(self):
+        try:
+            self._stdin_feeder(self._process.stdin, self._on_stdin_progress)
+        except BrokenPipeError:
+            # FFmpeg has exited, and its exit code is checked by run().
+            pass
+        except Exception as error:
+            self._stdin_feeder_error = error
+            self._process.kill()
+        finally:
+            try:
+                self._process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    def _on_stdin_progress(self):
+        # The frames that are written to stdin count as progress, even if FFmpeg has nothing new to report.
+        self._last_progress_time = time()
+
+    def _watch(self, stop_watchdog):
+        while not stop_watchdog.wait(1):
+            if self._cancel_event and self._cancel_event.is_set():
+                self.cancelled = True
+                self._process.kill()
+                return
+            if self._stall_timeout and time() - self._last_progress_time > self._stall_timeout:
+                self.stalled = True
+                self._process.kill()
+                return
+
+    def _get_command(self):
+        # Pin the FFmpeg process to the CPUs specified with --cpu-set. taskset sets the affinity before it
+        # execs FFmpeg, so every FFmpeg thread inherits it.
+        if self._cpu_set and shutil.which("taskset"):
+            return ["taskset", "-c", format_cpu_set(self._cpu_set), *self._arguments]
+        return self._arguments
+
+    def _pin_after_start(self):
+        # Without taskset, the affinity is set once FFmpeg has started. Only the threads that FFmpeg
+        # starts afterwards inherit it.
+        if not self._cpu_set or shutil.which("taskset") or not hasattr(os, "sched_setaffinity"):
+            return
+        try:
+            os.sched_setaffinity(self._process.pid, self._cpu_set)
+        except ProcessLookupError:
+            # FFmpeg has already exited.
+            pass
+
+    def _on_progress(self, progress):
+        self._sample_io()
+        # FFmpeg keeps writing -progress blocks while it is stuck,
+        # so only the blocks where the position has changed count as progress.
+        current_progress = (
+            progress.get("frame"),
+            progress.get("out_time_us", progress.get("out_time_ms")),
+        )
+        if current_progress != self._last_progress:
+            self._last_progress = current_progress
+            self._last_progress_time = time()
+        if self._progress_guard and self.abort_reason is None:
+            abort_reason = self._progress_guard(progress)
+            if abort_reason:
+                self.abort_reason = abort_reason
+                self._process.kill()
+
+    def _sample_io(self):
+        io_counters = read_proc_io(self._process.pid)
+        if io_counters:
+            self._io_counters = io_counters
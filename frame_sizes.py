@@ -0,0 +1,220 @@
+import io
+import json
+import os
+import re
+import subprocess
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from utils import force_decimal_places, Logger
+
+log = Logger("frame_sizes")
+
+FRAME_TYPES = ["I", "P", "B"]
+
+
+class FrameSizes:
+    """
+    The size and type of each frame of a video's first video stream, in display order, from a single
+    ffprobe packet scan (no decoding). Keyframes are I-frames, and frames that are displayed before a frame
+    that was decoded earlier are B-frames.
+    """
+
+    def __init__(self, pts_times, sizes, frame_types):
+        self.pts_times = np.asarray(pts_times, dtype=np.float64)
+        self.sizes = np.asarray(sizes, dtype=np.int64)
+        self.frame_types = np.asarray(frame_types)
+
+    @classmethod
+    def for_video(cls, video_path):
+        output = subprocess.run(
+            [
+                "ffprobe",
+                "-v",
+                "error",
+                "-select_streams",
+                "v:0",
+                "-show_entries",
+                "packet=pts_time,size,flags",
+                "-of",
+                "csv=p=0",
+                video_path,
+            ],
+            stdout=subprocess.PIPE,
+            check=True,
+        ).stdout.decode("utf-8")
+
+        # The flags (e.g. "K__" or "___") are replaced with 1 for keyframes and 0 otherwise,
+        # so that NumPy's CSV reader can parse the whole output in one go.
+        output = re.sub(r",K[^,\n]*$", ",1", output, flags=re.MULTILINE)
+        output = re.sub(r",_[^,\n]*$", ",0", output, flags=re.MULTILINE)
+        output = output.replace("N/A", "nan")
+        if not output.strip():
+            return cls([], [], [])
+
+        packets = np.loadtxt(io.StringIO(output), delimiter=",", ndmin=2)
+        packets = packets[~np.isnan(packets[:, 0])]
+        pts_times, sizes, keyframes = packets[:, 0], packets[:, 1], packets[:, 2]
+
+        # The packets are in decode order, so a frame with an earlier timestamp than a frame
+        # that was decoded before it is a B-frame.
+        latest_pts = np.maximum.accumulate(np.concatenate([[-np.inf], pts_times[:-1]]))
+        frame_types = np.where(keyframes == 1, "I", np.where(pts_times < latest_pts, "B", "P"))
+
+        display_order = np.argsort(pts_times, kind="stable")
+        return cls(pts_times[display_order], sizes[display_order], frame_types[display_order])
+
+    def get_windowed_bitrates(self, window):
+        """
+        The bitrate (bits per second) of the window seconds that start at each frame, using the timestamps
+        so that variable frame rate videos are handled correctly.
+        """
+        cumulative_bits = np.concatenate([[0], np.cumsum(self.sizes * 8)])
+        window_ends = np.searchsorted(self.pts_times, self.pts_times + window, side="left")
+        return (cumulative_bits[window_ends] - cumulative_bits[: len(self.sizes)]) / window
+
+    def get_peak_bitrate(self, window):
+        """
+        Returns the highest bitrate of any window seconds of the video (like the maxrate of a VBV buffer of
+        window seconds), and the time at which that window starts.
+        """
+        windowed_bitrates = self.get_windowed_bitrates(window)
+        # Windows that would run past the end of the video are shorter than window seconds.
+        complete = self.pts_times + window <= self.pts_times[-1] + 1e-6
+        if complete.any():
+            windowed_bitrates = np.where(complete, windowed_bitrates, 0)
+        peak = int(np.argmax(windowed_bitrates))
+        return float(windowed_bitrates[peak]), float(self.pts_times[peak] - self.pts_times[0])
+
+    def get_frame_type_stats(self):
+        stats = {}
+        for frame_type in FRAME_TYPES:
+            sizes = self.sizes[self.frame_types == frame_type]
+            stats[frame_type] = {
+                "count": int(len(sizes)),
+                "mean_bits": float(sizes.mean() * 8) if len(sizes) else None,
+                "share_of_bits": float(sizes.sum() / self.sizes.sum()) if len(sizes) else 0.0,
+            }
+        return stats
+
+
+def get_size_vmaf_correlation(frame_sizes, frame_numbers, vmaf_scores, reused=None):
+    """
+    The Pearson correlation between the size of each scored frame and its VMAF, or None if it is undefined.
+    The frame numbers are those of libvmaf's log, which are the indexes of the frames of the transcode
+    (with -subsample too) unless its leading frames were trimmed. Frames whose scores were reused from an earlier
+    frame (see duplicate_frames.py) are left out, as their scores weren't measured.
+    """
+    frame_numbers = np.asarray(frame_numbers)
+    scored = frame_numbers < len(frame_sizes.sizes)
+    if reused is not None:
+        scored &= ~np.asarray(reused, dtype=bool)
+    sizes = frame_sizes.sizes[frame_numbers[scored]]
+    scores = np.asarray(vmaf_scores, dtype=np.float64)[scored]
+    if len(sizes) < 2 or sizes.std() == 0 or scores.std() == 0:
+        return None
+    return float(np.corrcoef(sizes, scores)[0, 1])
+
+
+def analyse_frame_sizes(
+    args, video_path, output_folder, frame_numbers, vmaf_scores, results_record, reused=None
+):
+    """
+    Saves the per-frame sizes of the transcode and a graph of its bitrate over the VMAF, and adds the
+    peak bitrate, the bits of each frame type and the correlation with the VMAF to the results record.
+    reused flags the frames whose scores were reused from an earlier frame.
+    Returns the peak bitrate in bits per second, or None if the transcode doesn't exist.
+    """
+    if not os.path.exists(video_path):
+        return None
+
+    frame_sizes = FrameSizes.for_video(video_path)
+    if len(frame_sizes.sizes) == 0:
+        return None
+
+    peak_bitrate, peak_time = frame_sizes.get_peak_bitrate(args.bitrate_window)
+    frame_type_stats = frame_sizes.get_frame_type_stats()
+    correlation = None
+    if args.align:
+        # The transcode may have been trimmed, so its frames don't match libvmaf's frame numbers.
+        log.info("The correlation between the frame size and the VMAF is not calculated with --align.")
+    else:
+        correlation = get_size_vmaf_correlation(frame_sizes, frame_numbers, vmaf_scores, reused)
+
+    log.info(
+        f"Peak {args.bitrate_window:g}-second bitrate: "
+        f"{force_decimal_places(peak_bitrate / 1_000_000, args.decimal_places)} Mbps "
+        f"(at {force_decimal_places(peak_time, args.decimal_places)} seconds)"
+    )
+    for frame_type, stats in frame_type_stats.items():
+        if stats["count"]:
+            log.info(
+                f"{frame_type}-frames: {stats['count']}, "
+                f"mean size {force_decimal_places(stats['mean_bits'] / 1000, args.decimal_places)} kbit, "
+                f"{force_decimal_places(stats['share_of_bits'] * 100, args.decimal_places)}% of the bits"
+            )
+    if correlation is not None:
+        log.info(
+            f"Correlation between the frame size and the VMAF: "
+            f"{force_decimal_places(correlation, args.decimal_places)}"
+        )
+
+    if results_record is not None:
+        results_record["peak_bitrate_bps"] = peak_bitrate
+        results_record["peak_bitrate_time_s"] = peak_time
+        results_record["frame_size_vmaf_correlation"] = correlation
+        for frame_type, stats in frame_type_stats.items():
+            results_record[f"{frame_type.lower()}_frame_count"] = stats["count"]
+            results_record[f"{frame_type.lower()}_frame_mean_bits"] = stats["mean_bits"]
+
+    with open(os.path.join(output_folder, "Frame Sizes.json"), "w") as f:
+        json.dump(
+            {
+                "bitrate_window": args.bitrate_window,
+                "peak_bitrate_bps": peak_bitrate,
+                "peak_bitrate_time_s": peak_time,
+                "frame_types": frame_type_stats,
+                "frame_size_vmaf_correlation": correlation,
+                "pts_time": frame_sizes.pts_times.tolist(),
+                "size_bytes": frame_sizes.sizes.tolist(),
+                "frame_type": "".join(frame_sizes.frame_types.tolist()),
+            },
+            f,
+        )
+
+    plot_bitrate_and_vmaf(
+        frame_sizes,
+        args.bitrate_window,
+        peak_bitrate,
+        frame_numbers,
+        vmaf_scores,
+        os.path.join(output_folder, "Bitrate and VMAF"),
+    )
+    return peak_bitrate
+
+
+def plot_bitrate_and_vmaf(frame_sizes, window, peak_bitrate, frame_numbers, vmaf_scores, save_path):
+    figure, bitrate_axis = plt.subplots()
+    figure.suptitle(f"{window:g}-second Bitrate and VMAF")
+    bitrate_axis.set_xlabel("Frame Number")
+    bitrate_axis.set_ylabel("Bitrate (Mbps)")
+    bitrate_axis.plot(
+        np.arange(len(frame_sizes.sizes)),
+        frame_sizes.get_windowed_bitrates(window) / 1_000_000,
+        color="tab:orange",
+        linewidth=0.8,
+        label="Bitrate",
+    )
+    bitrate_axis.axhline(
+        peak_bitrate / 1_000_000, color="tab:red", linestyle="--", linewidth=0.8, label="Peak"
+    )
+
+    vmaf_axis = bitrate_axis.twinx()
+    vmaf_axis.set_ylabel("VMAF")
+    vmaf_axis.plot(frame_numbers, vmaf_scores, color="tab:blue", linewidth=0.8, label="VMAF")
+
+    lines = bitrate_axis.get_lines() + vmaf_axis.get_lines()
+    bitrate_axis.legend(lines, [line.get_label() for line in lines], loc="lower right")
+    figure.savefig(save_path)
+    plt.close(figure)
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import subprocess
+
+import numpy as np
+
+from utils import Logger
+
+log = Logger("keyframe_index")
+
+CACHE_FOLDER = os.path.join(os.path.expanduser("~"), ".cache", "video-quality-metrics", "keyframes")
+
+
+class KeyframeIndex:
+    """
+    The timestamps of the keyframes of a video's first video stream, from a single ffprobe packet scan
+    (no decoding). The index is cached, so it is only built once per source file.
+    """
+
+    def __init__(self, keyframe_times, packet_count):
+        self.keyframe_times = np.asarray(keyframe_times, dtype=np.float64)
+        self.packet_count = packet_count
+
+    @classmethod
+    def for_video(cls, video_path):
+        cache_path = _get_cache_path(video_path)
+        if os.path.exists(cache_path):
+            with open(cache_path, "r") as f:
+                cached = json.load(f)
+            return cls(cached["keyframe_times"], cached["packet_count"])
+
+        log.info(f"Building the keyframe index of {video_path}...")
+        index = cls._build(video_path)
+        os.makedirs(CACHE_FOLDER, exist_ok=True)
+        temporary_path = f"{cache_path}.tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(
+                {
+                    "keyframe_times": index.keyframe_times.tolist(),
+                    "packet_count": index.packet_count,
+                },
+                f,
+            )
+        os.replace(temporary_path, cache_path)
+        log.info(f"Done! Found {len(index.keyframe_times)} keyframes.")
+        return index
+
+    @classmethod
+    def _build(cls, video_path):
+        output = subprocess.run(
+            [
+                "ffprobe",
+                "-v",
+                "error",
+                "-select_streams",
+                "v:0",
+                "-show_entries",
+                "packet=pts_time,flags",
+                "-of",
+                "csv=p=0",
+                video_path,
+            ],
+            stdout=subprocess.PIPE,
+            check=True,
+        ).stdout.decode("utf-8")
+
+        keyframe_times = []
+        packet_count = 0
+        for row in output.splitlines():
+            pts_time, _, flags = row.partition(",")
+            if not pts_time or pts_time == "N/A":
+                continue
+            packet_count += 1
+            if "K" in flags:
+                keyframe_times.append(float(pts_time))
+
+        return cls(np.sort(np.asarray(keyframe_times)), packet_count)
+
+    def previous_keyframe(self, time):
+        """
+        The time of the last keyframe at or before the specified time.
+        """
+        if len(self.keyframe_times) == 0:
+            return 0.0
+        i = np.searchsorted(self.keyframe_times, time, side="right") - 1
+        return float(self.keyframe_times[max(i, 0)])
+
+    def next_keyframe(self, time):
+        """
+        The time of the first keyframe at or after the specified time, or None if there isn't one.
+        """
+        i = np.searchsorted(self.keyframe_times, time, side="left")
+        if i >= len(self.keyframe_times):
+            return None
+        return float(self.keyframe_times[i])
+
+
+def _get_cache_path(video_path):
+    stat = os.stat(video_path)
+    key = f"{os.path.abspath(video_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return os.path.join(CACHE_FOLDER, f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}.json")
+
+
+def snap_cut_length(video_path, length):
+    """
+    Extends a cut that starts at 0 to the next keyframe, so that the stream-copied cut contains only complete GOPs.
+    """
+    index = KeyframeIndex.for_video(video_path)
+    next_keyframe = index.next_keyframe(float(length))
+    if next_keyframe is None or next_keyframe <= 0:
+        return float(length)
+    return next_keyframe
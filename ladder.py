@@ -0,0 +1,349 @@
+import json
+import math
+import os
+
+import matplotlib.pyplot as plt
+from prettytable import PrettyTable
+
+from encoders import get_encoder
+from ffmpeg_process_factory import FfmpegError, FfmpegProcessFactory, LadderEncodingArguments
+from libvmaf import run_libvmaf
+from metrics import get_metrics_save_table
+from planner import CostModel
+from results_db import get_settings_key
+from results_writer import create_results_record, ResultsWriter
+from supervisor import run_with_retries
+from utils import force_decimal_places, line, Logger, set_log_context, Timer, VideoInfoProvider
+
+log = Logger("ladder")
+
+
+class LadderPoint:
+    def __init__(self, height, crf, bitrate_bps, vmaf):
+        self.height = height
+        self.crf = crf
+        self.bitrate_bps = bitrate_bps
+        self.vmaf = vmaf
+
+    def to_dict(self):
+        return {
+            "height": self.height,
+            "crf": self.crf,
+            "bitrate_bps": self.bitrate_bps,
+            "vmaf": self.vmaf,
+        }
+
+
+def compute_convex_hull(points):
+    """
+    Returns the points on the upper convex hull of the rate-quality plane (VMAF against log bitrate),
+    sorted by bitrate. Every other point is dominated by an interpolation of its hull neighbours.
+    """
+    hull = []
+    for point in sorted(points, key=lambda p: (p.bitrate_bps, -p.vmaf)):
+        # A point that does not improve the VMAF of a lower bitrate point is never on the hull.
+        if hull and point.vmaf <= hull[-1].vmaf:
+            continue
+        while len(hull) >= 2:
+            a, b = hull[-2], hull[-1]
+            cross = (math.log(b.bitrate_bps) - math.log(a.bitrate_bps)) * (point.vmaf - a.vmaf) - (
+                b.vmaf - a.vmaf
+            ) * (math.log(point.bitrate_bps) - math.log(a.bitrate_bps))
+            # b is on or below the line from a to the new point.
+            if cross >= 0:
+                hull.pop()
+            else:
+                break
+        hull.append(point)
+    return hull
+
+
+def get_hull_neighbours(hull, bitrate_bps):
+    """
+    Returns the hull points on either side of a bitrate, or None if the bitrate is outside the hull.
+    """
+    for lower, upper in zip(hull, hull[1:]):
+        if lower.bitrate_bps <= bitrate_bps <= upper.bitrate_bps:
+            return lower, upper
+    return None
+
+
+def interpolate_hull_vmaf(lower, upper, bitrate_bps):
+    if upper.bitrate_bps == lower.bitrate_bps:
+        return upper.vmaf
+    position = (math.log(bitrate_bps) - math.log(lower.bitrate_bps)) / (
+        math.log(upper.bitrate_bps) - math.log(lower.bitrate_bps)
+    )
+    return lower.vmaf + position * (upper.vmaf - lower.vmaf)
+
+
+def find_dominated_heights(points, hull, margin):
+    """
+    Returns the heights whose point is more than margin VMAF below the hull, where the hull is formed by
+    lower resolutions. As the CRF increases (and the bitrate decreases), lower resolutions become even more
+    efficient than higher ones, so these heights do not need to be encoded at higher CRFs.
+    """
+    dominated_heights = set()
+    for point in points:
+        neighbours = get_hull_neighbours(hull, point.bitrate_bps)
+        if neighbours is None or point in hull:
+            continue
+        lower, upper = neighbours
+        if lower.height >= point.height or upper.height >= point.height:
+            continue
+        if interpolate_hull_vmaf(lower, upper, point.bitrate_bps) - point.vmaf > margin:
+            dominated_heights.add(point.height)
+    return dominated_heights
+
+
+def _record_failed_rung(args, comparison_table, video_path, crf, preset, height, status, error):
+    line()
+    results_record = create_results_record(args, video_path, crf, preset)
+    results_record["settings_key"] = get_settings_key(args, crf, preset, height)
+    results_record["ladder_height"] = height
+    results_record["status"] = status
+    results_record["error"] = str(error)
+    ResultsWriter(os.path.dirname(comparison_table), args.results_format).append(results_record)
+
+
+def run_ladder(
+    args,
+    crf_values,
+    preset,
+    reference_video_path,
+    output_folder,
+    comparison_table,
+    table,
+    output_ext,
+    fps,
+    duration,
+    scratch_space,
+    results_db,
+):
+    """
+    Encodes every height of the ladder at each CRF (from a single decode per CRF), scores each rung upscaled
+    to the resolution of the reference, and saves the rate-quality convex hull.
+    Heights that are clearly dominated by lower resolutions are not encoded at higher CRFs.
+    """
+    reference_provider = VideoInfoProvider(reference_video_path)
+    reference_width, reference_height = reference_provider.get_resolution()
+    frame_count = reference_provider.get_duration() * reference_provider.get_framerate_float()
+
+    heights = sorted({int(height) for height in args.ladder}, reverse=True)
+    too_high = [height for height in heights if height > reference_height]
+    if too_high:
+        log.info(
+            f"Skipping the heights that are higher than the reference ({reference_height}p): "
+            f"{', '.join(str(height) for height in too_high)}"
+        )
+    active_heights = [height for height in heights if height <= reference_height]
+
+    cost_model = CostModel(args.cost_model)
+    points = []
+    # The lowest CRF (the highest bitrates) first, so dominated heights can be pruned from the higher CRFs.
+    for crf in sorted(crf_values, key=int):
+        if not active_heights:
+            break
+
+        label = f"CRF {crf}"
+        set_log_context(point=label)
+        log.info(f"| {label}: {', '.join(f'{height}p' for height in active_heights)} |")
+        line()
+
+        rungs = []
+        for height in active_heights:
+            rung_name = f"{height}p CRF {crf}"
+            rung_width = round(reference_width * height / reference_height / 2) * 2
+            rungs.append(
+                (
+                    height,
+                    rung_name,
+                    scratch_space.stage(
+                        os.path.join(output_folder, rung_name, f"{rung_name}{output_ext}"),
+                        cost_model.estimate_size(
+                            args.video_encoder, crf, rung_width * height * frame_count
+                        ),
+                    ),
+                )
+            )
+
+        def encode_rungs():
+            arguments = LadderEncodingArguments(
+                reference_video_path,
+                args.video_encoder,
+                [(height, staged.path) for height, _, staged in rungs],
+            )
+            arguments.speed(get_encoder(args.video_encoder).get_speed(args))
+            # Each rung has its own encoder, so the threads are split between them.
+            if args.encoder_threads:
+                arguments.threads(max(1, int(args.encoder_threads) // len(rungs)))
+            arguments.filter_threads(args.filter_threads)
+            arguments.crf(str(crf))
+            arguments.preset(preset)
+            arguments.video_filters(args.video_filters if args.video_filters else None)
+
+            factory = FfmpegProcessFactory()
+            log.info(f"Encoding {len(rungs)} rung(s) with {label} from a single decode...")
+            timer = Timer()
+            timer.start()
+            resource_usage = factory.create_process(arguments, args).run(
+                reference_video_path, duration
+            )
+            log.info("Done!")
+            return factory, timer.stop(args.decimal_places), resource_usage
+
+        try:
+            factory, time_taken, encode_usage = run_with_retries(
+                encode_rungs, f"encode with {label}", args.max_retries, args.retry_backoff
+            )
+        except FfmpegError as error:
+            for height, _, staged in rungs:
+                scratch_space.finish(staged, keep=False)
+                _record_failed_rung(
+                    args, comparison_table, staged.path, crf, preset, height, "failed_encode", error
+                )
+            continue
+
+        crf_points = []
+        for height, rung_name, staged in rungs:
+            rung_folder = os.path.join(output_folder, rung_name)
+            os.makedirs(rung_folder, exist_ok=True)
+            json_file_path = f"{rung_folder}/Metrics of each frame.json"
+
+            try:
+                scoring_usage = run_with_retries(
+                    lambda: run_libvmaf(
+                        staged.path,
+                        args,
+                        json_file_path,
+                        fps,
+                        reference_video_path,
+                        factory,
+                        duration,
+                        rung_name,
+                        (reference_width, reference_height),
+                    ),
+                    f"VMAF calculation of {rung_name}",
+                    args.max_retries,
+                    args.retry_backoff,
+                )
+            except FfmpegError as error:
+                _record_failed_rung(
+                    args,
+                    comparison_table,
+                    staged.path,
+                    crf,
+                    preset,
+                    height,
+                    "failed_scoring",
+                    error,
+                )
+                scratch_space.finish(staged, keep=args.keep_transcodes)
+                continue
+
+            transcode_path = staged.path
+            if args.keep_transcodes:
+                transcode_path = scratch_space.finish(staged, keep=True)
+
+            results_record = create_results_record(args, transcode_path, crf, preset)
+            results_record["settings_key"] = get_settings_key(args, crf, preset, height)
+            results_record["ladder_height"] = height
+            # The encode of every rung of this CRF was a single FFmpeg process.
+            results_record["encode_shared_by"] = len(rungs)
+
+            size_rounded = force_decimal_places(
+                results_record["size_bytes"] / 1_000_000, args.decimal_places
+            )
+            bitrate = force_decimal_places(
+                results_record["bitrate_bps"] / 1_000_000, args.decimal_places
+            )
+            vmaf = get_metrics_save_table(
+                comparison_table,
+                json_file_path,
+                args,
+                args.decimal_places,
+                [f"{size_rounded} MB", f"{bitrate} Mbps"],
+                table,
+                rung_folder,
+                time_taken,
+                rung_name,
+                encode_usage,
+                scoring_usage,
+                results_record,
+                results_db,
+            )
+            if not args.keep_transcodes:
+                scratch_space.finish(staged, keep=False)
+
+            crf_points.append(LadderPoint(height, int(crf), results_record["bitrate_bps"], vmaf))
+
+        points += crf_points
+        hull = compute_convex_hull(points)
+        pruned_heights = find_dominated_heights(crf_points, hull, args.ladder_prune_margin)
+        if pruned_heights:
+            log.info(
+                f"{', '.join(f'{height}p' for height in sorted(pruned_heights))} is dominated by "
+                f"lower resolutions and will not be encoded at higher CRFs."
+            )
+            line()
+            active_heights = [height for height in active_heights if height not in pruned_heights]
+
+    hull = compute_convex_hull(points)
+    save_ladder(points, hull, output_folder, args.decimal_places)
+    return points, hull
+
+
+def save_ladder(points, hull, output_folder, decimal_places):
+    with open(os.path.join(output_folder, "Convex Hull.json"), "w") as f:
+        json.dump(
+            {
+                "hull": [point.to_dict() for point in hull],
+                "points": [point.to_dict() for point in points],
+            },
+            f,
+            indent=4,
+        )
+
+    table = PrettyTable()
+    table.field_names = ["Resolution", "CRF", "Bitrate", "VMAF"]
+    for point in hull:
+        table.add_row(
+            [
+                f"{point.height}p",
+                point.crf,
+                f"{force_decimal_places(point.bitrate_bps / 1_000_000, decimal_places)} Mbps",
+                force_decimal_places(point.vmaf, decimal_places),
+            ]
+        )
+    with open(os.path.join(output_folder, "Convex Hull.txt"), "w") as f:
+        f.write("The rungs on the rate-quality convex hull:\n")
+        f.write(table.get_string())
+    log.info(f"The rungs on the rate-quality convex hull:\n{table.get_string()}")
+
+    if not points:
+        return
+
+    plt.suptitle("Bitrate Ladder")
+    plt.xlabel("Bitrate (Mbps)")
+    plt.ylabel("VMAF")
+    plt.xscale("log")
+    for height in sorted({point.height for point in points}, reverse=True):
+        height_points = sorted(
+            (point for point in points if point.height == height), key=lambda p: p.bitrate_bps
+        )
+        plt.plot(
+            [point.bitrate_bps / 1_000_000 for point in height_points],
+            [point.vmaf for point in height_points],
+            marker="o",
+            label=f"{height}p",
+        )
+    plt.plot(
+        [point.bitrate_bps / 1_000_000 for point in hull],
+        [point.vmaf for point in hull],
+        color="black",
+        linestyle="--",
+        label="Convex hull",
+    )
+    plt.legend(loc="lower right")
+    plt.savefig(os.path.join(output_folder, "Bitrate Ladder"))
+    plt.clf()
@@ -1,22 +1,29 @@
-from ffmpeg_process_factory import LibVmafArguments
-from utils import line, Logger, get_metrics_list
+import os
+
+from alignment import find_frame_offset
+from duplicate_frames import can_stack_frames, DuplicateFrameFeeder, expand_frame_metrics
+from ffmpeg_process_factory import (
+    FfmpegError,
+    LibVmafArguments,
+    MultipleLibVmafArguments,
+    PipedLibVmafArguments,
+)
+from utils import line, Logger, get_metrics_list, get_vmaf_models, VideoInfoProvider
 
 log = Logger("libvmaf")
 
-# Change this if you want to use a different VMAF model file.
-model_file_path = "vmaf_models/vmaf_v0.6.1.json"
+# The pixel formats that the libvmaf filter accepts.
+LIBVMAF_PIXEL_FORMATS = [
+    "yuv420p",
+    "yuv422p",
+    "yuv444p",
+    "yuv420p10le",
+    "yuv422p10le",
+    "yuv444p10le",
+]
 
 
-def run_libvmaf(
-    transcode_output_path,
-    args,
-    json_file_path,
-    fps,
-    original_video_path,
-    factory,
-    duration,
-    crf_or_preset=None,
-):
+def get_libvmaf_options(args, json_file_path):
     characters_to_escape = ["'", ":", ",", "[", "]"]
     for character in characters_to_escape:
         if character in json_file_path:
@@ -24,11 +31,17 @@ def run_libvmaf(
 
     n_subsample = "1" if not args.subsample else args.subsample
 
-    model_params = filter(None, [
-        f"path={model_file_path}",
-        "enable_transform=true" if args.phone_model else ""
-    ])
-    model_string = f"model='{'|'.join(model_params)}'"
+    # Multiple models are separated by "|", and each model's parameters by ":".
+    # All of the models are calculated from a single decode of both videos.
+    model_strings = []
+    for _, model_name, model in get_vmaf_models(args):
+        model_params = filter(None, [
+            f"path={model['path']}",
+            f"name={model_name}",
+            "enable_transform=true" if model["enable_transform"] else ""
+        ])
+        model_strings.append(":".join(model_params))
+    model_string = f"model='{'|'.join(model_strings)}'"
 
     features = filter(None, [
         "name=psnr" if args.calculate_psnr else "",
@@ -37,17 +50,187 @@ def run_libvmaf(
     ])
     feature_string = f":feature='{'|'.join(features)}'"
 
-    vmaf_options = f"""
+    return f"""
     {model_string}:log_fmt=json:log_path='{json_file_path}':n_subsample={n_subsample}:n_threads={args.n_threads}{feature_string}
     """
 
+
+def _check_json_file(json_file_path):
+    if not os.path.exists(json_file_path) or os.path.getsize(json_file_path) == 0:
+        raise FfmpegError(f"libvmaf did not create {json_file_path}")
+
+
+def get_common_pixel_format(distorted_format, reference_format):
+    # The reference decides the pixel format, unless libvmaf doesn't accept it.
+    for pixel_format in [reference_format, distorted_format]:
+        if pixel_format in LIBVMAF_PIXEL_FORMATS:
+            return pixel_format
+    high_bit_depth = any(depth in reference_format for depth in ["p10", "p12", "p14", "p16"])
+    return "yuv420p10le" if high_bit_depth else "yuv420p"
+
+
+def negotiate_inputs(
+    libvmaf_arguments, args, transcode_output_path, original_video_path, distorted_scale=None
+):
+    """
+    Adds explicit scale and format conversions to the libvmaf filter graph, instead of letting FFmpeg
+    choose them. Only the smaller input is scaled, and usually only one input is converted to the pixel format
+    of the other. Returns the resolution (or None if it is unknown) and the pixel format of the inputs of libvmaf.
+    """
+    distorted_info = VideoInfoProvider(transcode_output_path)
+    reference_info = VideoInfoProvider(original_video_path)
+    distorted_scaled = reference_scaled = False
+    resolution = None
+
+    if distorted_scale:
+        libvmaf_arguments.scale_distorted(*distorted_scale, args.vmaf_scaler)
+        log.info(f"Scaling the transcode to {distorted_scale[0]}x{distorted_scale[1]}.")
+        distorted_scaled = True
+        resolution = tuple(distorted_scale)
+    elif not args.video_filters:
+        # With -vf, the resolution of the filtered reference is unknown,
+        # but the transcodes are created with the same filters.
+        distorted_width, distorted_height = distorted_info.get_resolution()
+        reference_width, reference_height = reference_info.get_resolution()
+        resolution = (reference_width, reference_height)
+        if distorted_width * distorted_height < reference_width * reference_height:
+            libvmaf_arguments.scale_distorted(reference_width, reference_height, args.vmaf_scaler)
+            log.info(
+                f"Scaling the transcode from {distorted_width}x{distorted_height} to "
+                f"{reference_width}x{reference_height} ({args.vmaf_scaler})."
+            )
+            distorted_scaled = True
+        elif (distorted_width, distorted_height) != (reference_width, reference_height):
+            libvmaf_arguments.scale_reference(distorted_width, distorted_height, args.vmaf_scaler)
+            log.info(
+                f"Scaling the original video from {reference_width}x{reference_height} to "
+                f"{distorted_width}x{distorted_height} ({args.vmaf_scaler})."
+            )
+            reference_scaled = True
+            resolution = (distorted_width, distorted_height)
+
+    distorted_format = distorted_info.get_pixel_format()
+    reference_format = reference_info.get_pixel_format()
+    pixel_format = get_common_pixel_format(distorted_format, reference_format)
+    # A scaled input is also given the pixel format, so that the scaler does both in one conversion.
+    distorted_conversion = distorted_format != pixel_format or distorted_scaled
+    reference_conversion = reference_format != pixel_format or reference_scaled
+    libvmaf_arguments.pixel_formats(
+        pixel_format if distorted_conversion else None,
+        pixel_format if reference_conversion else None,
+    )
+
+    for name, input_format in [
+        ("transcode", distorted_format),
+        ("original video", reference_format),
+    ]:
+        if input_format != pixel_format:
+            log.info(f"Converting the {name} from {input_format} to {pixel_format}.")
+
+    return resolution, pixel_format
+
+
+def prepare_inputs(
+    libvmaf_arguments, args, transcode_output_path, original_video_path, fps, distorted_scale=None
+):
+    """
+    Adds the scale, format and alignment filters of the inputs of libvmaf. Returns the resolution and
+    the pixel format of the inputs of libvmaf (both None with --implicit-conversions).
+    """
+    resolution = pixel_format = None
+    if args.implicit_conversions:
+        if distorted_scale:
+            libvmaf_arguments.scale_distorted(*distorted_scale, args.vmaf_scaler)
+    else:
+        resolution, pixel_format = negotiate_inputs(
+            libvmaf_arguments, args, transcode_output_path, original_video_path, distorted_scale
+        )
+    if args.align:
+        offset = find_frame_offset(
+            transcode_output_path,
+            original_video_path,
+            fps,
+            args.video_filters if args.video_filters else None,
+            args.max_frame_offset,
+        )
+        libvmaf_arguments.trim_start(max(0, -offset), max(0, offset))
+    return resolution, pixel_format
+
+
+def create_duplicate_frame_feeder(
+    libvmaf_arguments, args, transcode_output_path, original_video_path, fps, resolution, pixel_format
+):
+    """
+    Returns a DuplicateFrameFeeder for the inputs of libvmaf, or None if their frames can't be stacked.
+    """
+    if resolution is None:
+        # The size of the raw frames must be known, so the filtered reference is scaled to the resolution
+        # of the transcode (which it normally already has).
+        resolution = VideoInfoProvider(transcode_output_path).get_resolution()
+        libvmaf_arguments.scale_reference(*resolution, args.vmaf_scaler)
+
+    width, height = resolution
+    if not can_stack_frames(height, pixel_format):
+        log.info(f"Duplicate frames can't be skipped at a height of {height} with {pixel_format}.")
+        return None
+
+    distorted_filters, reference_filters = libvmaf_arguments.get_filters()
+    return DuplicateFrameFeeder(
+        transcode_output_path,
+        original_video_path,
+        fps,
+        distorted_filters,
+        reference_filters,
+        width,
+        height,
+        pixel_format,
+    )
+
+
+def run_libvmaf(
+    transcode_output_path,
+    args,
+    json_file_path,
+    fps,
+    original_video_path,
+    factory,
+    duration,
+    crf_or_preset=None,
+    distorted_scale=None,
+):
+    vmaf_options = get_libvmaf_options(args, json_file_path)
+
     libvmaf_arguments = LibVmafArguments(
         fps, transcode_output_path, original_video_path, vmaf_options
     )
-    video_filters = args.video_filters if args.video_filters else None
-    libvmaf_arguments.video_filters(video_filters)
+    libvmaf_arguments.video_filters(args.video_filters if args.video_filters else None)
+    libvmaf_arguments.filter_threads(args.filter_threads)
+    resolution, pixel_format = prepare_inputs(
+        libvmaf_arguments, args, transcode_output_path, original_video_path, fps, distorted_scale
+    )
 
-    process = factory.create_process(libvmaf_arguments, args)
+    # The validator makes sure that --skip-duplicate-frames is not used with --implicit-conversions.
+    feeder = None
+    if args.skip_duplicate_frames:
+        feeder = create_duplicate_frame_feeder(
+            libvmaf_arguments,
+            args,
+            transcode_output_path,
+            original_video_path,
+            fps,
+            resolution,
+            pixel_format,
+        )
+
+    if feeder:
+        piped_arguments = PipedLibVmafArguments(
+            fps, feeder.width, feeder.height, feeder.pixel_format, vmaf_options
+        )
+        piped_arguments.filter_threads(args.filter_threads)
+        process = factory.create_process(piped_arguments, args)
+        process.set_stdin_feeder(feeder.feed)
+    else:
+        process = factory.create_process(libvmaf_arguments, args)
 
     metrics_list = get_metrics_list(args)
 
@@ -57,7 +240,9 @@ def run_libvmaf(
 
     message_transcoding_mode = ""
     if not args.no_transcoding_mode:
-        if isinstance(args.crf, list) and len(args.crf) > 1:
+        if args.ladder:
+            message_transcoding_mode += f" achieved with {crf_or_preset}"
+        elif isinstance(args.crf, list) and len(args.crf) > 1:
             message_transcoding_mode += f" achieved with CRF {crf_or_preset}"
         else:
             message_transcoding_mode += f" achieved with preset {crf_or_preset}"
@@ -65,5 +250,59 @@ def run_libvmaf(
     line()
     log.info(f"Calculating the {metric_types}{message_transcoding_mode}...")
 
-    process.run(original_video_path, duration)
+    resource_usage = process.run(original_video_path, duration)
+
+    _check_json_file(json_file_path)
+
+    if feeder:
+        frame_count, reused_count = expand_frame_metrics(
+            json_file_path, feeder.scored_frame_indexes
+        )
+        log.info(
+            f"{reused_count} of {frame_count} frames repeated the previous frames, "
+            "so their scores were reused."
+        )
+
+    log.info("Done!")
+
+    return resource_usage
+
+
+def run_libvmaf_multiple(
+    transcode_output_paths, args, json_file_paths, fps, original_video_path, factory, duration
+):
+    """
+    Scores several transcodes of the same video with a single decode of the reference. The inputs of each
+    transcode are negotiated and aligned separately.
+    """
+    branches = []
+    for transcode_output_path, json_file_path in zip(transcode_output_paths, json_file_paths):
+        branch = LibVmafArguments(
+            fps,
+            transcode_output_path,
+            original_video_path,
+            get_libvmaf_options(args, json_file_path),
+        )
+        log.info(f"Preparing the inputs of {os.path.basename(transcode_output_path)}...")
+        prepare_inputs(branch, args, transcode_output_path, original_video_path, fps)
+        branches.append(branch)
+
+    libvmaf_arguments = MultipleLibVmafArguments(fps, branches, original_video_path)
+    libvmaf_arguments.video_filters(args.video_filters if args.video_filters else None)
+    libvmaf_arguments.filter_threads(args.filter_threads)
+
+    process = factory.create_process(libvmaf_arguments, args)
+
+    line()
+    log.info(
+        f"Calculating the {'/'.join(get_metrics_list(args))} of {len(transcode_output_paths)} transcodes "
+        "with a single decode of the reference..."
+    )
+    resource_usage = process.run(original_video_path, duration)
+
+    for json_file_path in json_file_paths:
+        _check_json_file(json_file_path)
+
     log.info("Done!")
+
+    return resource_usage
@@ -7,32 +7,64 @@ from prettytable import PrettyTable
 
 from args import parser
 from arguments_validator import ArgumentsValidator
-from encode_video import encode_video
-from ffmpeg_process_factory import FfmpegProcessFactory
+from distributed import DistributedSweep, get_task_args
+from encode_video import encode_video, EncodeAborted
+from encoder_comparison import parse_encoder_crfs, run_encoder_comparison
+from encoders import get_encoder
+from ffmpeg_process_factory import FfmpegError, FfmpegProcessFactory
+from keyframe_index import snap_cut_length
+from ladder import run_ladder
 from libvmaf import run_libvmaf
 from metrics import get_metrics_save_table
 from overview import create_movie_overview
+from quick_metrics import passes_prescreen, run_quick_metrics
+from planner import (
+    CostModel,
+    estimate_points,
+    get_encode_key,
+    get_scoring_key,
+    order_longest_first,
+    show_plan,
+)
+from resource_usage import ResourceUsage
+from results_db import compute_source_hash, get_settings_key, ResultsDatabase
+from results_writer import create_results_record, ResultsWriter
+from scratch_space import ScratchSpace
+from supervisor import run_with_retries
+from thread_budget import apply_thread_budget
 from utils import (
+    configure_logging,
     cut_video,
     exit_program,
+    get_cut_video_path,
     force_decimal_places,
     is_list,
     line,
     Logger,
     plot_graph,
     VideoInfoProvider,
+    set_log_context,
     write_table_info,
     get_metrics_list,
+    get_vmaf_models,
 )
+from worst_segments import rescore_worst_segments
 
 log = Logger("main.py")
 
+# The approximate size of lossless x264 (half of the size of uncompressed 4:2:0).
+LOSSLESS_BYTES_PER_PIXEL = 0.75
+
 if len(sys.argv) == 1:
     line()
     log.info('For more details about the available arguments, enter "python main.py -h"')
     line()
 
 args = parser.parse_args()
+configure_logging(args.log_format == "json")
+# The presets of each encoder are different, so the default preset depends on the encoder.
+if args.preset is None:
+    args.preset = get_encoder(args.video_encoder).default_preset
 original_video_path = args.original_video_path
 filename = Path(original_video_path).name
 video_encoder = args.video_encoder
@@ -45,6 +77,95 @@ if not validation_result:
         log.info(f"Error: {error}")
     exit_program("Argument validation failed.")
 
+apply_thread_budget(args)
+
+results_db = None
+args.run_id, args.source_hash = None, None
+if args.results_db:
+    results_db = ResultsDatabase(args.results_db)
+    args.source_hash = compute_source_hash(args.original_video_path)
+    args.run_id = results_db.start_run(args, args.source_hash)
+    set_log_context(run_id=args.run_id)
+
+distributed_sweep = None
+if args.distributed_queue:
+    distributed_sweep = DistributedSweep(args.distributed_queue, args.lease_timeout)
+
+
+def get_sweep_points():
+    """
+    The (crf, preset) combinations that will be transcoded.
+    """
+    if is_list(args.crf) and len(args.crf) > 1:
+        preset = args.preset[0] if is_list(args.preset) else args.preset
+        return [(crf, preset) for crf in args.crf]
+    elif is_list(args.preset):
+        crf = args.crf[0] if is_list(args.crf) else get_encoder(video_encoder).default_crf
+        return [(crf, preset) for preset in args.preset]
+    return []
+
+
+def get_planned_duration():
+    """
+    The duration of the video that will be transcoded, taking -t and Overview Mode into account.
+    """
+    if args.encode_length:
+        return min(float(args.encode_length), float(duration))
+
+    if args.interval is not None:
+        number_steps = int(float(duration) // args.interval)
+        if args.overview_strategy == "scene":
+            clip_count = args.overview_clips or max(1, (number_steps - 1) // 2)
+        else:
+            clip_count = max(1, number_steps - 1)
+        return min(clip_count * args.clip_length, float(duration))
+
+    return float(duration)
+
+
+def record_costs(
+    crf, preset, reference_video_path, transcode_output_path, encode_usage, scoring_usage
+):
+    """
+    Calibrates the cost model that --plan uses with the measurements of this transcode.
+    """
+    reference_provider = VideoInfoProvider(reference_video_path)
+    width, height = reference_provider.get_resolution()
+    frame_count = (
+        float(reference_provider.get_duration()) * reference_provider.get_framerate_float()
+    )
+    pixels = width * height * frame_count
+    model_count = len(get_vmaf_models(args))
+
+    cost_model = CostModel(args.cost_model)
+    cost_model.record_encode(
+        get_encode_key(video_encoder, preset, get_encoder(video_encoder).get_speed(args)),
+        pixels / 1_000_000,
+        encode_usage,
+        int(args.encoder_threads or 1),
+    )
+    cost_model.record_scoring(
+        get_scoring_key(model_count, args.subsample),
+        pixels / 1_000_000 / int(args.subsample),
+        scoring_usage,
+        int(args.n_threads or 1),
+    )
+    cost_model.record_size(video_encoder, crf, pixels, os.path.getsize(transcode_output_path))
+    cost_model.save()
+
+
+def cut_reference_video(output_ext, output_folder, comparison_table):
+    """
+    Cuts the original video to -t seconds in the scratch space. The cut is kept until the end of the run.
+    """
+    cut_length = min(float(args.encode_length), float(duration))
+    staged_cut = scratch_space.stage(
+        get_cut_video_path(filename, args, output_ext, output_folder),
+        cut_length * provider.get_bitrate_bps() / 8,
+    )
+    cut_video(filename, args, output_ext, output_folder, comparison_table, staged_cut.path)
+    return staged_cut
+
 
 def create_output_folder_initialise_table(crf_or_preset):
     if args.output_folder:
@@ -57,14 +178,301 @@ def create_output_folder_initialise_table(crf_or_preset):
     # Set the names of the columns
     table.field_names = table_column_names
 
-    output_ext = Path(args.original_video_path).suffix
-    # The M4V container does not support the H.265 codec.
-    if output_ext == ".m4v" and args.video_encoder == "x265":
-        output_ext = ".mp4"
+    # Some containers don't support every codec.
+    output_ext = get_encoder(args.video_encoder).get_output_extension(
+        Path(args.original_video_path).suffix
+    )
 
     return output_folder, comparison_table, output_ext
 
 
+def record_rejected_point(crf, preset, transcode_output_path, comparison_table, status, **fields):
+    """
+    Records a sweep point whose VMAF was not calculated in the machine-readable results.
+    """
+    line()
+    results_record = create_results_record(args, transcode_output_path, crf, preset)
+    results_record["status"] = status
+    results_record.update(fields)
+    ResultsWriter(os.path.dirname(comparison_table), args.results_format).append(results_record)
+
+
+def find_reusable_point(crf, preset):
+    if results_db and args.reuse_results:
+        return results_db.find_reusable_point(
+            args.source_hash, video_encoder, get_settings_key(args, crf, preset)
+        )
+    return None
+
+
+def submit_sweep_points(sweep_points, reference_video_path):
+    """
+    Submits the sweep points that can't be reused to the --distributed-queue, the longest first,
+    so that the workers finish at roughly the same time.
+    """
+    sweep_points = [point for point in sweep_points if not find_reusable_point(*point[:2])]
+    if not sweep_points:
+        return
+
+    reference_provider = VideoInfoProvider(reference_video_path)
+    width, height = reference_provider.get_resolution()
+    estimates = estimate_points(
+        args,
+        [(crf, preset) for crf, preset, *_ in sweep_points],
+        width,
+        height,
+        fps_float,
+        float(reference_provider.get_duration()),
+        CostModel(args.cost_model),
+    )
+
+    # The paths must not depend on the working directory of the workers.
+    task_args = get_task_args(args)
+    for rank, sweep_point in enumerate(order_longest_first(sweep_points, estimates)):
+        crf, preset, crf_or_preset, message, output_folder, transcode_output_path = sweep_point
+        distributed_sweep.submit(
+            transcode_output_path,
+            {
+                "args": task_args,
+                "crf": crf,
+                "preset": preset,
+                "crf_or_preset": crf_or_preset,
+                "message": message,
+                "output_folder": os.path.abspath(output_folder),
+                "transcode_output_path": os.path.abspath(transcode_output_path),
+                "json_file_path": os.path.abspath(f"{output_folder}/Metrics of each frame.json"),
+                "reference_video_path": os.path.abspath(reference_video_path),
+                "fps": fps,
+                "duration": duration,
+            },
+            rank,
+        )
+
+    log.info(f"{len(sweep_points)} transcode(s) have been submitted to {args.distributed_queue}.")
+    line()
+
+
+def run_sweep_point(
+    crf,
+    preset,
+    crf_or_preset,
+    message,
+    output_folder,
+    transcode_output_path,
+    reference_video_path,
+    comparison_table,
+):
+    """
+    Transcodes the video with a single CRF/preset combination, calculates the quality metrics
+    and adds a row to the table. Returns the mean VMAF score, or None if the transcode was rejected.
+    """
+    set_log_context(point=message)
+    os.makedirs(output_folder, exist_ok=True)
+    # Save the output of libvmaf to the following path.
+    json_file_path = f"{output_folder}/Metrics of each frame.json"
+    encode_usage, scoring_usage = None, None
+    reusable_point = find_reusable_point(crf, preset)
+
+    if reusable_point:
+        log.info(
+            f"Reusing the previously calculated results of {message} "
+            f"({reusable_point['video_path']})."
+        )
+        transcode_output_path = reusable_point["video_path"]
+        json_file_path = reusable_point["metrics_json_path"]
+        time_taken = force_decimal_places(
+            reusable_point.get("encode_wall_time_s") or 0, args.decimal_places
+        )
+    elif distributed_sweep:
+        # The transcode is encoded and scored by a worker.
+        result = distributed_sweep.wait(transcode_output_path)
+        if result["status"] != "scored":
+            record_rejected_point(
+                crf,
+                preset,
+                transcode_output_path,
+                comparison_table,
+                result["status"],
+                **result["fields"],
+            )
+            if not args.keep_transcodes and os.path.exists(transcode_output_path):
+                os.remove(transcode_output_path)
+            return None
+
+        time_taken = result["time_taken"]
+        encode_usage = ResourceUsage.from_dict(result["encode_usage"])
+        scoring_usage = ResourceUsage.from_dict(result["scoring_usage"])
+    else:
+        # The transcode is written to the scratch space until its metrics have been captured.
+        reference_provider = VideoInfoProvider(reference_video_path)
+        width, height = reference_provider.get_resolution()
+        pixels = width * height * reference_provider.get_duration() * fps_float
+        staged_transcode = scratch_space.stage(
+            transcode_output_path,
+            CostModel(args.cost_model).estimate_size(video_encoder, crf, pixels),
+        )
+        transcode_output_path = staged_transcode.path
+
+        # Encode the video.
+        try:
+            factory, time_taken, encode_usage = run_with_retries(
+                lambda: encode_video(
+                    reference_video_path,
+                    args,
+                    crf,
+                    preset,
+                    transcode_output_path,
+                    message,
+                    duration,
+                ),
+                f"encode with {message}",
+                args.max_retries,
+                args.retry_backoff,
+            )
+        except FfmpegError as error:
+            # The partial transcode is of no use.
+            scratch_space.finish(staged_transcode, keep=False)
+            record_rejected_point(
+                crf,
+                preset,
+                transcode_output_path,
+                comparison_table,
+                "failed_encode",
+                error=str(error),
+            )
+            return None
+        except EncodeAborted as error:
+            log.info(f"The transcode with {message} was aborted because {error.reason}.")
+            scratch_space.finish(staged_transcode, keep=False)
+            record_rejected_point(
+                crf,
+                preset,
+                transcode_output_path,
+                comparison_table,
+                "rejected_ceiling",
+                projected_bitrate_bps=error.projected_bitrate_bps,
+                projected_size_bytes=error.projected_size_bytes,
+                encode_wall_time_s=error.resource_usage.wall_time,
+            )
+            return None
+
+        if args.prescreen:
+            quick_summaries = run_quick_metrics(
+                transcode_output_path,
+                args,
+                f"{output_folder}/Quick metrics of each frame.json",
+                fps,
+                reference_video_path,
+            )
+            quick_psnr = force_decimal_places(quick_summaries["PSNR"]["mean"], args.decimal_places)
+            quick_ssim = force_decimal_places(quick_summaries["SSIM"]["mean"], 4)
+            log.info(f"Quick PSNR: {quick_psnr} dB, quick SSIM: {quick_ssim}")
+
+            if not passes_prescreen(args, quick_summaries):
+                log.info(f"The transcode with {message} was rejected by the prescreen.")
+                record_rejected_point(
+                    crf,
+                    preset,
+                    transcode_output_path,
+                    comparison_table,
+                    "rejected_prescreen",
+                    quick_psnr_mean=quick_summaries["PSNR"]["mean"],
+                    quick_ssim_mean=quick_summaries["SSIM"]["mean"],
+                    encode_wall_time_s=encode_usage.wall_time,
+                )
+                scratch_space.finish(staged_transcode, keep=args.keep_transcodes)
+                return None
+
+        # Run the libvmaf filter.
+        try:
+            scoring_usage = run_with_retries(
+                lambda: run_libvmaf(
+                    transcode_output_path,
+                    args,
+                    json_file_path,
+                    fps,
+                    reference_video_path,
+                    factory,
+                    duration,
+                    crf_or_preset,
+                ),
+                f"VMAF calculation of {message}",
+                args.max_retries,
+                args.retry_backoff,
+            )
+        except FfmpegError as error:
+            record_rejected_point(
+                crf,
+                preset,
+                transcode_output_path,
+                comparison_table,
+                "failed_scoring",
+                error=str(error),
+            )
+            scratch_space.finish(staged_transcode, keep=args.keep_transcodes)
+            return None
+
+    # The cost model is only calibrated by the transcodes of this machine.
+    if not reusable_point and not distributed_sweep:
+        try:
+            record_costs(
+                crf,
+                preset,
+                reference_video_path,
+                transcode_output_path,
+                encode_usage,
+                scoring_usage,
+            )
+        except (OSError, ValueError) as error:
+            log.warning(f"Unable to update the cost model: {error}")
+
+        # The metrics have been captured, so the transcode is only kept if --keep-transcodes is specified.
+        if args.keep_transcodes:
+            transcode_output_path = scratch_space.finish(staged_transcode, keep=True)
+
+    results_record = create_results_record(args, transcode_output_path, crf, preset)
+    # The transcode of a reused point may have been deleted.
+    if reusable_point and results_record["size_bytes"] is None:
+        results_record["size_bytes"] = reusable_point["size_bytes"]
+        results_record["bitrate_bps"] = reusable_point["bitrate_bps"]
+
+    size_rounded = force_decimal_places(
+        results_record["size_bytes"] / 1_000_000, args.decimal_places
+    )
+    bitrate_mbps = results_record["bitrate_bps"] / 1_000_000
+    transcoded_bitrate = f"{force_decimal_places(bitrate_mbps, args.decimal_places)} Mbps"
+    data_for_current_row = [f"{size_rounded} MB", transcoded_bitrate]
+
+    vmaf_score = get_metrics_save_table(
+        comparison_table,
+        json_file_path,
+        args,
+        args.decimal_places,
+        data_for_current_row,
+        table,
+        output_folder,
+        time_taken,
+        crf_or_preset,
+        encode_usage,
+        scoring_usage,
+        results_record,
+        results_db,
+    )
+
+    if args.rescore_worst_segments:
+        rescore_worst_segments(
+            args, output_folder, transcode_output_path, reference_video_path, fps, crf_or_preset
+        )
+
+    if not reusable_point and not args.keep_transcodes:
+        if distributed_sweep:
+            os.remove(transcode_output_path)
+        else:
+            scratch_space.finish(staged_transcode, keep=False)
+
+    return vmaf_score
+
+
 # Use the VideoInfoProvider class to get the framerate, bitrate and duration.
 provider = VideoInfoProvider(args.original_video_path)
 duration = provider.get_duration()
@@ -88,36 +496,177 @@ if args.video_filters:
     log.info(args.video_filters)
     line()
 
+# Ladder rungs are scored upscaled to the original resolution, so use the model for that viewing resolution.
+if args.ladder and not args.vmaf_models:
+    args.vmaf_models = ["4k"] if provider.get_resolution()[1] > 1080 else ["hd"]
+    if args.phone_model:
+        args.vmaf_models.append("phone")
+
 table = PrettyTable()
 metrics_list = get_metrics_list(args)
-table_column_names = ["Encoding Time (s)", "Size", "Bitrate"] + metrics_list
+table_column_names = (
+    ["Encoding Time (s)", "Encoding CPU Time (s)", "Encoding Peak RSS (MB)", "Size", "Bitrate"]
+    + metrics_list
+    + ["Scoring CPU Time (s)", "Scoring Peak RSS (MB)"]
+)
+
+if args.bitrate_analysis:
+    table_column_names.insert(table_column_names.index("Bitrate") + 1, "Peak Bitrate")
 
 if args.no_transcoding_mode:
-    del table_column_names[0]
+    del table_column_names[0:3]
+
+if args.plan:
+    width, height = provider.get_resolution()
+    planned_duration = get_planned_duration()
+    log.info(
+        f"Estimated cost of transcoding {planned_duration:g} seconds of {filename} "
+        f"({width}x{height}) with {video_encoder}:"
+    )
+    estimates = estimate_points(
+        args,
+        get_sweep_points(),
+        width,
+        height,
+        fps_float,
+        planned_duration,
+        CostModel(args.cost_model),
+    )
+    show_plan(estimates, args.decimal_places)
+    sys.exit(0)
+
+# The scratch space manages the transcodes, the -t cut and the Overview Mode clips, so it isn't created
+# (along with its reservations folder) for runs that have none of them, unless it is configured.
+scratch_space = None
+if (
+    args.scratch_dir
+    or args.ram_disk
+    or args.scratch_budget
+    or not args.no_transcoding_mode
+    or args.interval is not None
+):
+    scratch_space = ScratchSpace(
+        args.scratch_dir,
+        args.ram_disk,
+        args.scratch_budget * 1_000_000 if args.scratch_budget else None,
+    )
+
+staged_cut = None
 
 if args.interval is not None:
     output_folder = f"({filename})"
     clip_length = str(args.clip_length)
+    # The clips are deleted once they have been concatenated.
+    width, height = provider.get_resolution()
+    clip_pixels = width * height * get_planned_duration() * fps_float
+    staged_clips = scratch_space.stage_folder(
+        os.path.join(output_folder, "clips"),
+        (
+            get_planned_duration() * provider.get_bitrate_bps() / 8
+            if args.snap_to_keyframes
+            else clip_pixels * LOSSLESS_BYTES_PER_PIXEL
+        ),
+    )
     result, concatenated_video = create_movie_overview(
-        original_video_path, output_folder, args.interval, clip_length
+        original_video_path,
+        output_folder,
+        args.interval,
+        clip_length,
+        args.snap_to_keyframes,
+        args.overview_strategy,
+        args.overview_clips,
+        staged_clips.path,
     )
+    scratch_space.finish(staged_clips, keep=False)
     if result:
         original_video_path = concatenated_video
     else:
         exit_program("Something went wrong when trying to create the overview video.")
 
+# Extend the cut to the next keyframe so that it only contains complete GOPs.
+if args.encode_length and args.snap_to_keyframes:
+    requested_length = args.encode_length
+    # ffprobe reports the timestamps in microseconds, so 6 decimal places keep the keyframe time exactly.
+    args.encode_length = f"{snap_cut_length(args.original_video_path, args.encode_length):.6f}"
+    log.info(
+        f"-t/--encode-length {requested_length} has been snapped to the next keyframe "
+        f"({args.encode_length} seconds)."
+    )
+
 # The -ntm argument was not specified.
 if not args.no_transcoding_mode:
     vmaf_scores = []
-    if video_encoder == "x264":
-        crf = "23"
-    elif video_encoder == "x265":
-        crf = "28"
-    elif video_encoder == "libaom-av1":
-        crf = "32"
+    crf = get_encoder(video_encoder).default_crf
+
+    # Cross-encoder comparison mode.
+    if args.compare_encoders:
+        log.info("Encoder comparison mode activated.")
+        encoder_crfs = parse_encoder_crfs(args.compare_encoders)
+        preset = args.preset[0] if is_list(args.preset) else args.preset
+        for encoder, crf_values in encoder_crfs:
+            log.info(f"{encoder}: CRF {', '.join(str(crf) for crf in crf_values)}")
+        line()
+
+        prev_output_folder, comparison_table, output_ext = create_output_folder_initialise_table(
+            "Encoder"
+        )
+
+        if args.encode_length:
+            staged_cut = cut_reference_video(output_ext, prev_output_folder, comparison_table)
+            original_video_path = staged_cut.path
+
+        run_encoder_comparison(
+            args,
+            encoder_crfs,
+            preset,
+            original_video_path,
+            prev_output_folder,
+            comparison_table,
+            table,
+            fps,
+            duration,
+            scratch_space,
+            results_db,
+        )
+        output_directory = prev_output_folder
+
+    # Ladder mode.
+    elif args.ladder:
+        log.info("Ladder mode activated.")
+        crf_values = args.crf if is_list(args.crf) else [crf]
+        preset = args.preset[0] if is_list(args.preset) else args.preset
+        log.info(
+            f"Heights {', '.join(f'{height}p' for height in args.ladder)} will be encoded with "
+            f"CRF values {', '.join(str(crf) for crf in crf_values)} and the {preset} preset."
+        )
+        line()
+
+        prev_output_folder, comparison_table, output_ext = create_output_folder_initialise_table(
+            "Rung"
+        )
+
+        if args.encode_length:
+            staged_cut = cut_reference_video(output_ext, prev_output_folder, comparison_table)
+            original_video_path = staged_cut.path
+
+        run_ladder(
+            args,
+            crf_values,
+            preset,
+            original_video_path,
+            prev_output_folder,
+            comparison_table,
+            table,
+            output_ext,
+            fps,
+            duration,
+            scratch_space,
+            results_db,
+        )
+        output_directory = prev_output_folder
 
     # CRF comparison mode.
-    if is_list(args.crf) and len(args.crf) > 1:
+    elif is_list(args.crf) and len(args.crf) > 1:
         log.info("CRF comparison mode activated.")
         crf_values = args.crf
         crf_values_string = ", ".join(str(crf) for crf in crf_values)
@@ -133,76 +682,51 @@ if not args.no_transcoding_mode:
 
         # The user only wants to transcode the first x seconds of the video.
         if args.encode_length:
-            original_video_path = cut_video(
-                filename, args, output_ext, prev_output_folder, comparison_table
-            )
+            staged_cut = cut_reference_video(output_ext, prev_output_folder, comparison_table)
+            original_video_path = staged_cut.path
 
+        sweep_points = []
         for crf in crf_values:
-            log.info(f"| CRF {crf} |")
-            line()
             output_folder = f"{prev_output_folder}/CRF {crf}"
-            os.makedirs(output_folder, exist_ok=True)
             transcode_output_path = os.path.join(output_folder, f"CRF {crf}{output_ext}")
-
-            # Encode the video.
-            factory, time_taken = encode_video(
-                original_video_path,
-                args,
-                crf,
-                preset,
-                transcode_output_path,
-                f"CRF {crf}",
-                duration,
+            sweep_points.append(
+                (crf, preset, crf, f"CRF {crf}", output_folder, transcode_output_path)
             )
 
-            transcode_size = os.path.getsize(transcode_output_path) / 1_000_000
-            transcoded_bitrate = provider.get_bitrate(args.decimal_places, transcode_output_path)
-            size_rounded = force_decimal_places(transcode_size, args.decimal_places)
-            data_for_current_row = [f"{size_rounded} MB", transcoded_bitrate]
+        if distributed_sweep:
+            submit_sweep_points(sweep_points, original_video_path)
 
-            # Save the output of libvmaf to the following path.
-            json_file_path = f"{output_folder}/Metrics of each frame.json"
-            # Run the libvmaf filter.
-            run_libvmaf(
-                transcode_output_path,
-                args,
-                json_file_path,
-                fps,
-                original_video_path,
-                factory,
-                duration,
-                crf,
-            )
+        scored_crf_values = []
+        for sweep_point in sweep_points:
+            crf = sweep_point[0]
+            log.info(f"| CRF {crf} |")
+            line()
 
-            vmaf_scores.append(
-                get_metrics_save_table(
-                    comparison_table,
-                    json_file_path,
-                    args,
-                    args.decimal_places,
-                    data_for_current_row,
-                    table,
-                    output_folder,
-                    time_taken,
-                    crf,
-                )
-            )
+            vmaf_score = run_sweep_point(*sweep_point, original_video_path, comparison_table)
 
+            # The transcode was rejected before its VMAF was calculated.
+            if vmaf_score is None:
+                continue
+
+            scored_crf_values.append(crf)
+            vmaf_scores.append(vmaf_score)
             mean_vmaf = force_decimal_places(np.mean(vmaf_scores), args.decimal_places)
 
             write_table_info(comparison_table, filename, original_bitrate, args, f"Preset {preset}")
 
         # Plot a bar graph showing the average VMAF score of each CRF value.
-        plot_graph(
-            "CRF vs VMAF",
-            "CRF",
-            "VMAF",
-            crf_values,
-            vmaf_scores,
-            mean_vmaf,
-            f"{prev_output_folder}/CRF vs VMAF",
-            bar_graph=True,
-        )
+        if vmaf_scores:
+            plot_graph(
+                "CRF vs VMAF",
+                "CRF",
+                "VMAF",
+                scored_crf_values,
+                vmaf_scores,
+                mean_vmaf,
+                f"{prev_output_folder}/CRF vs VMAF",
+                bar_graph=True,
+            )
+        output_directory = prev_output_folder
 
     # Presets comparison mode.
     elif is_list(args.preset):
@@ -219,61 +743,34 @@ if not args.no_transcoding_mode:
 
         # The -t/--encode-length argument was specified.
         if args.encode_length:
-            original_video_path = cut_video(
-                filename, args, output_ext, prev_output_folder, comparison_table
-            )
+            staged_cut = cut_reference_video(output_ext, prev_output_folder, comparison_table)
+            original_video_path = staged_cut.path
 
+        sweep_points = []
         for preset in chosen_presets:
-            log.info(f"| Preset {preset} |")
-            line()
             output_folder = f"{prev_output_folder}/Preset {preset}"
-            os.makedirs(output_folder, exist_ok=True)
             transcode_output_path = os.path.join(output_folder, f"{preset}{output_ext}")
-
-            # Encode the video.
-            factory, time_taken = encode_video(
-                original_video_path,
-                args,
-                crf,
-                preset,
-                transcode_output_path,
-                f"preset {preset}",
-                duration,
+            sweep_points.append(
+                (crf, preset, preset, f"preset {preset}", output_folder, transcode_output_path)
             )
 
-            transcode_size = os.path.getsize(transcode_output_path) / 1_000_000
-            transcoded_bitrate = provider.get_bitrate(args.decimal_places, transcode_output_path)
-            size_rounded = force_decimal_places(transcode_size, args.decimal_places)
-            data_for_current_row = [f"{size_rounded} MB", transcoded_bitrate]
+        if distributed_sweep:
+            submit_sweep_points(sweep_points, original_video_path)
 
-            # Save the output of libvmaf to the following path.
-            json_file_path = f"{output_folder}/Metrics of each frame.json"
-            # Run the libvmaf filter.
-            run_libvmaf(
-                transcode_output_path,
-                args,
-                json_file_path,
-                fps,
-                original_video_path,
-                factory,
-                duration,
-                preset,
-            )
+        scored_presets = []
+        for sweep_point in sweep_points:
+            preset = sweep_point[1]
+            log.info(f"| Preset {preset} |")
+            line()
 
-            vmaf_scores.append(
-                get_metrics_save_table(
-                    comparison_table,
-                    json_file_path,
-                    args,
-                    args.decimal_places,
-                    data_for_current_row,
-                    table,
-                    output_folder,
-                    time_taken,
-                    preset,
-                )
-            )
+            vmaf_score = run_sweep_point(*sweep_point, original_video_path, comparison_table)
+
+            # The transcode was rejected before its VMAF was calculated.
+            if vmaf_score is None:
+                continue
 
+            scored_presets.append(preset)
+            vmaf_scores.append(vmaf_score)
             mean_vmaf = force_decimal_places(np.mean(vmaf_scores), args.decimal_places)
 
             write_table_info(
@@ -281,16 +778,18 @@ if not args.no_transcoding_mode:
             )
 
         # Plot a bar graph showing the average VMAF score of each preset.
-        plot_graph(
-            "Preset vs VMAF",
-            "Preset",
-            "VMAF",
-            chosen_presets,
-            vmaf_scores,
-            mean_vmaf,
-            f"{prev_output_folder}/Preset vs VMAF",
-            bar_graph=True,
-        )
+        if vmaf_scores:
+            plot_graph(
+                "Preset vs VMAF",
+                "Preset",
+                "VMAF",
+                scored_presets,
+                vmaf_scores,
+                mean_vmaf,
+                f"{prev_output_folder}/Preset vs VMAF",
+                bar_graph=True,
+            )
+        output_directory = prev_output_folder
 
 # -ntm mode.
 else:
@@ -298,6 +797,7 @@ else:
         output_folder = args.output_folder
     else:
         output_folder = f"[VQM] {Path(args.transcoded_video_path).name}"
+    output_directory = output_folder
 
     os.makedirs(output_folder, exist_ok=True)
 
@@ -307,15 +807,23 @@ else:
     json_file_path = f"{output_folder}/Metrics of each frame.json"
 
     factory = FfmpegProcessFactory()
-    run_libvmaf(
-        args.transcoded_video_path,
-        args,
-        json_file_path,
-        fps,
-        original_video_path,
-        factory,
-        duration,
-    )
+    try:
+        scoring_usage = run_with_retries(
+            lambda: run_libvmaf(
+                args.transcoded_video_path,
+                args,
+                json_file_path,
+                fps,
+                original_video_path,
+                factory,
+                duration,
+            ),
+            "VMAF calculation",
+            args.max_retries,
+            args.retry_backoff,
+        )
+    except FfmpegError as error:
+        exit_program(f"Unable to calculate the VMAF: {error}")
 
     transcode_size = os.path.getsize(args.transcoded_video_path) / 1_000_000
     size_rounded = force_decimal_places(transcode_size, args.decimal_places)
@@ -331,11 +839,21 @@ else:
         table,
         output_folder,
         time_taken=None,
+        scoring_usage=scoring_usage,
+        results_record=create_results_record(args, args.transcoded_video_path),
+        results_db=results_db,
     )
 
+    if args.rescore_worst_segments:
+        rescore_worst_segments(
+            args, output_folder, args.transcoded_video_path, original_video_path, fps
+        )
+
     with open(table_path, "a") as f:
         f.write(f"\nOriginal Bitrate: {original_bitrate}")
 
 
-output_directory = output_folder if args.no_transcoding_mode else Path(output_folder).parent
+if staged_cut:
+    scratch_space.finish(staged_cut, keep=args.keep_transcodes)
+
 log.info(f'All done! Check out the contents of the "{output_directory}" directory.')
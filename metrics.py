@@ -1,13 +1,79 @@
 import json
 import os
+import re
 
 import matplotlib.pyplot as plt
 import numpy as np
 
-from utils import force_decimal_places, line, Logger, plot_graph, get_metrics_list
+from frame_sizes import analyse_frame_sizes
+from results_writer import ResultsWriter
+from streaming_stats import StreamingStats
+from utils import (
+    force_decimal_places,
+    line,
+    Logger,
+    plot_graph,
+    get_metric_key_prefix,
+    get_metrics_list,
+    get_vmaf_models,
+    VideoInfoProvider,
+)
+from worst_segments import find_worst_segments, save_worst_segments
 
 log = Logger("save_metrics")
 
+# The number of frames that are read from the libvmaf JSON file (and added to the statistics) at a time.
+FRAME_CHUNK_SIZE = 1000
+READ_SIZE = 1 << 20
+
+
+def read_frames_in_chunks(json_file_path, chunk_size=FRAME_CHUNK_SIZE):
+    """
+    Yields the entries of the "frames" array of a libvmaf JSON file in lists of up to chunk_size frames,
+    without loading the whole file.
+    """
+    decoder = json.JSONDecoder()
+    with open(json_file_path, "r") as f:
+        buffer = ""
+        position = None
+        while position is None:
+            data = f.read(READ_SIZE)
+            buffer += data
+            frames_start = re.search(r'"frames"\s*:\s*\[', buffer)
+            if frames_start:
+                position = frames_start.end()
+            elif not data:
+                return
+
+        chunk = []
+        end_of_file = False
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position < len(buffer) and buffer[position] == "]":
+                break
+
+            try:
+                frame, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The rest of the frame hasn't been read yet.
+                if end_of_file:
+                    raise
+                buffer = buffer[position:]
+                position = 0
+                data = f.read(READ_SIZE)
+                end_of_file = not data
+                buffer += data
+                continue
+
+            chunk.append(frame)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+
+        if chunk:
+            yield chunk
+
 
 def get_metrics_save_table(
     comparison_table,
@@ -19,59 +85,161 @@ def get_metrics_save_table(
     output_folder,
     time_taken,
     crf_or_preset=None,
+    encode_usage=None,
+    scoring_usage=None,
+    results_record=None,
+    results_db=None,
 ):
-    with open(json_file_path, "r") as f:
-        file_contents = json.load(f)
-
-    frames = file_contents["frames"]
-    frame_numbers = [frame["frameNum"] for frame in frames]
+    # The peak bitrate column follows the size and bitrate columns.
+    peak_bitrate_column = len(data_for_current_row)
 
     # Maps the metric type to the corresponding JSON metric key.
     metric_lookup = {
-        "VMAF": "vmaf",
         "PSNR": "psnr_y",
         "SSIM": "float_ssim",
         "MS-SSIM": "float_ms_ssim"
     }
+    for metric_type, model_name, _ in get_vmaf_models(args):
+        metric_lookup[metric_type] = model_name
+    metrics_list = get_metrics_list(args)
+
+    # The statistics are updated a chunk of frames at a time as the JSON file is read. Only the scores
+    # themselves are kept (as arrays), for the graphs, the worst segments and the bitrate analysis.
+    metric_stats = {}
+    score_chunks = {}
+    frame_number_chunks = []
+    reused_chunks = []
+    for frames in read_frames_in_chunks(json_file_path):
+        if not frame_number_chunks:
+            metric_stats = {
+                metric_type: StreamingStats()
+                for metric_type in metrics_list
+                if frames[0]["metrics"][metric_lookup[metric_type]]
+            }
+            score_chunks = {metric_type: [] for metric_type in metric_stats}
+
+        chunk_frame_numbers = [frame["frameNum"] for frame in frames]
+        frame_number_chunks.append(np.asarray(chunk_frame_numbers))
+        if args.bitrate_analysis:
+            reused_chunks.append(np.array(["reused_from" in frame for frame in frames], dtype=bool))
+        for metric_type, stats in metric_stats.items():
+            metric_key = metric_lookup[metric_type]
+            chunk_scores = np.array(
+                [frame["metrics"][metric_key] for frame in frames], dtype=np.float64
+            )
+            stats.update_batch(chunk_scores, chunk_frame_numbers)
+            score_chunks[metric_type].append(chunk_scores)
+
+    frame_numbers = np.concatenate(frame_number_chunks)
 
     # Only used for accessing the VMAF mean score to return at the end of this method.
     collected_scores = {}
+    # The unrounded scores and a summary of the per-frame scores, for the results database.
+    raw_collected_scores = {}
+    frame_summaries = {}
+    worst_segments = {}
+    vmaf_scores = []
+    # The frame rate is only needed for the timestamps of the worst segments.
+    if args.worst_segments:
+        fps = VideoInfoProvider(args.original_video_path).get_framerate_float()
     # Process metrics captured for each requested metric type.
-    metrics_list = get_metrics_list(args)
-    for metric_type in metrics_list:
-        metric_key = metric_lookup[metric_type]
-        if frames[0]["metrics"][metric_key]:
-            # Get the <metric_type> score of each frame from the JSON file created by libvmaf.
-            metric_scores = [frame["metrics"][metric_key] for frame in frames]
-
-            # Calculate the mean, minimum and standard deviation scores across all frames.
-            mean_score = force_decimal_places(np.mean(metric_scores), decimal_places)
-            min_score = force_decimal_places(min(metric_scores), decimal_places)
-            std_score = force_decimal_places(np.std(metric_scores), decimal_places)
-
-            collected_scores[metric_type] = {
-                "min": min_score,
-                "std": std_score,
-                "mean": mean_score
-            }
+    for metric_type, stats in metric_stats.items():
+        # The <metric_type> score of each frame from the JSON file created by libvmaf.
+        metric_scores = np.concatenate(score_chunks.pop(metric_type))
+        frame_summary = stats.summary()
+        raw_scores = {
+            statistic: frame_summary[statistic]
+            for statistic in ["min", "std", "mean", "harmonic_mean", "p1", "p5"]
+        }
+        mean_score = force_decimal_places(raw_scores["mean"], decimal_places)
+        min_score = force_decimal_places(raw_scores["min"], decimal_places)
+        std_score = force_decimal_places(raw_scores["std"], decimal_places)
 
-            log.info(f"Creating {metric_type} graph...")
-            plot_graph(
-                f"{metric_type}\nn_subsample: {args.subsample}",
-                "Frame Number",
-                metric_type,
-                frame_numbers,
-                metric_scores,
-                mean_score,
-                os.path.join(output_folder, metric_type),
+        if metric_type == "VMAF":
+            vmaf_scores = metric_scores
+
+        raw_collected_scores[metric_type] = raw_scores
+        frame_summaries[metric_type] = frame_summary
+        if args.worst_segments:
+            worst_segments[metric_type] = find_worst_segments(
+                metric_scores, frame_numbers, fps, args.segment_length, args.worst_segments
             )
 
-            # Add the <metric_type> values to the table.
-            data_for_current_row.append(f"{min_score} | {std_score} | {mean_score}")
+        if results_record is not None:
+            for statistic, value in raw_scores.items():
+                results_record[f"{get_metric_key_prefix(metric_type)}_{statistic}"] = value
+            if worst_segments.get(metric_type):
+                results_record[f"{get_metric_key_prefix(metric_type)}_worst_segment_mean"] = (
+                    worst_segments[metric_type][0]["mean"]
+                )
+
+        collected_scores[metric_type] = {
+            "min": min_score,
+            "std": std_score,
+            "mean": mean_score
+        }
+
+        log.info(
+            f"{metric_type} 1st percentile: "
+            f"{force_decimal_places(raw_scores['p1'], decimal_places)}, "
+            f"5th percentile: {force_decimal_places(raw_scores['p5'], decimal_places)}, "
+            f"harmonic mean: {force_decimal_places(raw_scores['harmonic_mean'], decimal_places)}"
+        )
+        log.info(f"Creating {metric_type} graph...")
+        plot_graph(
+            f"{metric_type}\nn_subsample: {args.subsample}",
+            "Frame Number",
+            metric_type,
+            frame_numbers,
+            metric_scores,
+            mean_score,
+            os.path.join(output_folder, metric_type),
+        )
+
+        # Add the <metric_type> values to the table.
+        data_for_current_row.append(f"{min_score} | {std_score} | {mean_score}")
+
+    if args.worst_segments:
+        save_worst_segments(output_folder, worst_segments, args.segment_length, decimal_places)
+
+    if args.bitrate_analysis:
+        peak_bitrate = analyse_frame_sizes(
+            args,
+            results_record["video_path"],
+            output_folder,
+            frame_numbers,
+            vmaf_scores,
+            results_record,
+            np.concatenate(reused_chunks),
+        )
+        data_for_current_row.insert(
+            peak_bitrate_column,
+            "N/A"
+            if peak_bitrate is None
+            else f"{force_decimal_places(peak_bitrate / 1_000_000, decimal_places)} Mbps",
+        )
+
+    data_for_current_row += format_resource_usage(scoring_usage, decimal_places)
 
     if not args.no_transcoding_mode:
-        data_for_current_row.insert(0, crf_or_preset)
-        data_for_current_row.insert(1, time_taken)
+        data_for_current_row[0:0] = [crf_or_preset, time_taken] + format_resource_usage(
+            encode_usage, decimal_places
+        )
+
+    save_resource_usage(output_folder, encode_usage, scoring_usage)
+
+    if results_record is not None:
+        results_record["frame_count"] = len(frame_numbers)
+        results_record["metrics_json_path"] = json_file_path
+        for stage, resource_usage in [("encode", encode_usage), ("scoring", scoring_usage)]:
+            for key, value in (resource_usage.to_dict() if resource_usage else {}).items():
+                results_record[f"{stage}_{key}"] = value
+
+        results_writer = ResultsWriter(os.path.dirname(comparison_table), args.results_format)
+        results_writer.append(results_record)
+
+        if results_db is not None:
+            results_db.add_point(results_record, raw_collected_scores, frame_summaries)
 
     table.add_row(data_for_current_row)
 
@@ -88,3 +256,26 @@ def get_metrics_save_table(
     log.info(f"{comparison_table} has been updated.")
     line()
     return float(collected_scores["VMAF"]["mean"])
+
+
+def format_resource_usage(resource_usage, decimal_places):
+    """
+    Returns the [CPU time, peak RSS] table cells for a ResourceUsage object.
+    """
+    if resource_usage is None:
+        return ["N/A", "N/A"]
+
+    return [
+        force_decimal_places(resource_usage.cpu_time, decimal_places),
+        force_decimal_places(resource_usage.max_rss_mb, decimal_places),
+    ]
+
+
+def save_resource_usage(output_folder, encode_usage, scoring_usage):
+    usage = {
+        "encode": encode_usage.to_dict() if encode_usage else None,
+        "scoring": scoring_usage.to_dict() if scoring_usage else None,
+    }
+
+    with open(os.path.join(output_folder, "Resource Usage.json"), "w") as f:
+        json.dump(usage, f, indent=4)
@@ -5,6 +5,8 @@ import shutil
 import subprocess
 import time
 
+from keyframe_index import KeyframeIndex
+from scene_analysis import analyse_complexity, select_representative_clips
 from utils import VideoInfoProvider, line, exit_program, Logger
 
 log = Logger("overview")
@@ -24,15 +26,23 @@ def step_to_movie_timestamp(step_seconds):
     return timestamp
 
 
-def create_clips(video_path, output_folder, interval_seconds, clip_length):
+def create_clips(
+    video_path,
+    output_folder,
+    interval_seconds,
+    clip_length,
+    snap_to_keyframes=False,
+    strategy="interval",
+    clip_count=None,
+    clips_folder=None,
+):
     # The output folder for the clips.
-    output_folder = os.path.join(output_folder, "clips")
+    output_folder = clips_folder or os.path.join(output_folder, "clips")
 
     if not os.path.exists(video_path):
         raise ClipError("The specified video file does not exist.")
 
-    if not os.path.exists(output_folder):
-        os.mkdir(output_folder)
+    os.makedirs(output_folder, exist_ok=True)
 
     provider = VideoInfoProvider(video_path)
     duration = int(float(provider.get_duration()))
@@ -49,18 +59,45 @@ def create_clips(video_path, output_folder, interval_seconds, clip_length):
     open(txt_file_path, "w").close()
 
     log.info("Overview mode activated.")
-    log.info(
-        f"Creating a {clip_length} second clip every {interval_seconds} seconds from {video_path}..."
-    )
+    if strategy == "scene":
+        # By default, use half as many clips as the interval strategy would.
+        if clip_count is None:
+            clip_count = max(1, (number_steps - 1) // 2)
+        analysis = analyse_complexity(video_path)
+        clip_starts = select_representative_clips(analysis, duration, int(clip_length), clip_count)
+        log.info(
+            f"Creating {len(clip_starts)} {clip_length} second clips that represent the complexity "
+            f"of {video_path}..."
+        )
+    else:
+        clip_starts = [step * interval_seconds for step in range(1, number_steps)]
+        log.info(
+            f"Creating a {clip_length} second clip every {interval_seconds} seconds from {video_path}..."
+        )
     line()
 
+    # When snapping to keyframes, each clip starts on a keyframe and can be stream copied without decoding.
+    keyframe_index = KeyframeIndex.for_video(video_path) if snap_to_keyframes else None
+    previous_clip_start = None
+
     try:
-        for step in range(1, number_steps):
+        for step, clip_start in enumerate(clip_starts, start=1):
+            if keyframe_index:
+                clip_start = keyframe_index.previous_keyframe(clip_start)
+                # The GOP is longer than the interval, so this clip would be the same as the previous one.
+                if clip_start == previous_clip_start:
+                    continue
+                previous_clip_start = clip_start
+                clip_offset = f"{clip_start:.6f}"
+                codec_args = ["-c:v", "copy"]
+            else:
+                clip_offset = step_to_movie_timestamp(clip_start)
+                codec_args = ["-c:v", "libx264", "-crf", "0", "-preset", "ultrafast"]
+
             clip_name = f"clip{step}.mkv"
             with open(txt_file_path, "a") as f:
                 f.write(f"file '{clip_name}'\n")
             clip_output_path = os.path.join(output_folder, clip_name)
-            clip_offset = step_to_movie_timestamp(step * interval_seconds)
             log.info(f"Creating clip {step} which starts at {clip_offset}...")
             subprocess_cut_args = [
                 "ffmpeg",
@@ -76,12 +113,7 @@ def create_clips(video_path, output_folder, interval_seconds, clip_length):
                 "0:V",
                 "-t",
                 clip_length,
-                "-c:v",
-                "libx264",
-                "-crf",
-                "0",
-                "-preset",
-                "ultrafast",
+                *codec_args,
                 clip_output_path,
             ]
             subprocess.run(subprocess_cut_args)
@@ -120,18 +152,36 @@ def concatenate_clips(txt_file_path, output_folder, extension, interval_seconds,
     log.info("Concatenating the clips to create the overview video...")
     result = subprocess.run(subprocess_concatenate_args)
     log.info("Done!")
-    shutil.rmtree(os.path.join(output_folder, "clips"))
+    shutil.rmtree(os.path.dirname(txt_file_path))
     log.info("The clips have been deleted as they are no longer needed.")
 
     if result.returncode == 0:
         return concatenated_filepath
 
 
-def create_movie_overview(video_path, output_folder, interval_seconds, clip_length):
+def create_movie_overview(
+    video_path,
+    output_folder,
+    interval_seconds,
+    clip_length,
+    snap_to_keyframes=False,
+    strategy="interval",
+    clip_count=None,
+    clips_folder=None,
+):
     os.makedirs(output_folder, exist_ok=True)
     extension = Path(video_path).suffix
     try:
-        txt_file_path = create_clips(video_path, output_folder, interval_seconds, clip_length)
+        txt_file_path = create_clips(
+            video_path,
+            output_folder,
+            interval_seconds,
+            clip_length,
+            snap_to_keyframes,
+            strategy,
+            clip_count,
+            clips_folder,
+        )
         output_file = concatenate_clips(
             txt_file_path, output_folder, extension, interval_seconds, clip_length
         )
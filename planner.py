@@ -0,0 +1,259 @@
+import json
+import math
+import os
+
+from prettytable import PrettyTable
+
+from encoders import get_encoder
+from utils import force_decimal_places, get_vmaf_models, Logger
+
+log = Logger("planner")
+
+DEFAULT_COST_MODEL_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "video-quality-metrics", "cost_model.json"
+)
+
+# How quickly the calibrated values follow new measurements.
+SMOOTHING = 0.3
+
+# Rough defaults, used until the cost model has been calibrated by a previous run.
+# The encoding defaults of each encoder are declared by its backend in encoders.py.
+DEFAULT_VMAF_CPU_PER_MEGAPIXEL = 0.02
+# Bits per pixel at the quality value of the size model of the encoder (e.g. a CRF of 23).
+DEFAULT_BITS_PER_PIXEL = 0.1
+# The approximate size of each frame in the libvmaf JSON file, per metric.
+JSON_BYTES_PER_FRAME_PER_METRIC = 60
+
+
+def get_encode_key(encoder, preset, speed=None):
+    speed_option = get_encoder(encoder).speed_option
+    if speed_option is not None:
+        return f"{encoder}|{speed_option[0].lstrip('-')}={speed}"
+    return f"{encoder}|{preset}"
+
+
+def get_scoring_key(model_count, n_subsample):
+    return f"libvmaf|models={model_count}|n_subsample={n_subsample}"
+
+
+class CostModel:
+    """
+    Cost estimates learned from previous runs: the CPU and wall time per megapixel of each encoder/preset and of
+    libvmaf, and the bits per pixel of each encoder/CRF. Values are exponentially smoothed as new runs are recorded.
+    """
+
+    def __init__(self, path=None):
+        self._path = path or DEFAULT_COST_MODEL_PATH
+        self._entries = {}
+        if os.path.exists(self._path):
+            with open(self._path, "r") as f:
+                self._entries = json.load(f)
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self._path)), exist_ok=True)
+        temporary_path = f"{self._path}.tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(self._entries, f, indent=4)
+        os.replace(temporary_path, self._path)
+
+    def _update(self, key, values):
+        entry = self._entries.setdefault(key, {"samples": 0})
+        for name, value in values.items():
+            if value is None:
+                continue
+            if name in entry:
+                entry[name] += SMOOTHING * (value - entry[name])
+            else:
+                entry[name] = value
+        entry["samples"] += 1
+
+    def record_encode(self, encode_key, megapixels, resource_usage, threads):
+        if megapixels <= 0 or resource_usage is None or not resource_usage.wall_time:
+            return
+        self._update(
+            encode_key,
+            {
+                "cpu_per_megapixel": resource_usage.cpu_time / megapixels,
+                "wall_per_megapixel": resource_usage.wall_time / megapixels,
+                "threads": threads,
+            },
+        )
+
+    def record_scoring(self, scoring_key, megapixels, resource_usage, threads):
+        self.record_encode(scoring_key, megapixels, resource_usage, threads)
+
+    def record_size(self, encoder, crf, pixels, size_bytes):
+        if pixels <= 0 or not size_bytes:
+            return
+        self._update(f"{encoder}|crf={int(crf)}", {"bits_per_pixel": size_bytes * 8 / pixels})
+
+    def _estimate_time(self, key, default_cpu_per_megapixel, megapixels, threads):
+        entry = self._entries.get(key)
+        if entry and "cpu_per_megapixel" in entry:
+            cpu_time = entry["cpu_per_megapixel"] * megapixels
+            # Fewer threads than when calibrated makes it slower, but more threads may not make it faster.
+            wall_time = (
+                entry["wall_per_megapixel"] * megapixels * max(1, entry["threads"] / threads)
+            )
+            return cpu_time, wall_time, True
+
+        cpu_time = default_cpu_per_megapixel * megapixels
+        # Assume that the threads are used with 70% efficiency.
+        return cpu_time, cpu_time / max(1, threads * 0.7), False
+
+    def estimate_encode(self, encode_key, encoder, preset, megapixels, threads):
+        backend = get_encoder(encoder)
+        default_cpu = backend.default_cpu_per_megapixel * backend.get_preset_cost(preset)
+        return self._estimate_time(encode_key, default_cpu, megapixels, threads)
+
+    def estimate_scoring(self, scoring_key, model_count, megapixels, threads):
+        return self._estimate_time(
+            scoring_key, DEFAULT_VMAF_CPU_PER_MEGAPIXEL * model_count, megapixels, threads
+        )
+
+    def estimate_size(self, encoder, crf, pixels):
+        key = f"{encoder}|crf={int(crf)}"
+        if key in self._entries:
+            return self._entries[key]["bits_per_pixel"] * pixels / 8
+
+        # Use the nearest calibrated CRF, doubling the size every few CRF (6 for x264).
+        reference_crf, halving_crf = get_encoder(encoder).size_model
+        calibrated_crfs = [
+            int(k.split("=")[1]) for k in self._entries if k.startswith(f"{encoder}|crf=")
+        ]
+        if calibrated_crfs:
+            nearest_crf = min(calibrated_crfs, key=lambda c: abs(c - int(crf)))
+            bits_per_pixel = self._entries[f"{encoder}|crf={nearest_crf}"]["bits_per_pixel"]
+            return bits_per_pixel * 2 ** ((nearest_crf - int(crf)) / halving_crf) * pixels / 8
+
+        return DEFAULT_BITS_PER_PIXEL * 2 ** ((reference_crf - int(crf)) / halving_crf) * pixels / 8
+
+
+class PointEstimate:
+    def __init__(
+        self,
+        crf,
+        preset,
+        encode_cpu,
+        encode_wall,
+        scoring_cpu,
+        scoring_wall,
+        scratch_bytes,
+        calibrated,
+    ):
+        self.crf = crf
+        self.preset = preset
+        self.encode_cpu = encode_cpu
+        self.encode_wall = encode_wall
+        self.scoring_cpu = scoring_cpu
+        self.scoring_wall = scoring_wall
+        self.scratch_bytes = scratch_bytes
+        self.calibrated = calibrated
+
+    @property
+    def wall_time(self):
+        return self.encode_wall + self.scoring_wall
+
+    @property
+    def cpu_time(self):
+        return self.encode_cpu + self.scoring_cpu
+
+
+def estimate_points(args, points, width, height, fps, duration, cost_model):
+    """
+    Estimates the cost of each (crf, preset) sweep point of a video with the specified properties.
+    """
+    frame_count = math.ceil(fps * duration)
+    pixels = width * height * frame_count
+    megapixels = pixels / 1_000_000
+    threads = int(args.encoder_threads or 1)
+    vmaf_threads = int(args.n_threads or 1)
+    model_count = len(get_vmaf_models(args))
+    metric_count = model_count + sum(
+        [args.calculate_psnr, args.calculate_ssim, args.calculate_msssim]
+    )
+    json_bytes = frame_count / int(args.subsample) * metric_count * JSON_BYTES_PER_FRAME_PER_METRIC
+
+    estimates = []
+    for crf, preset in points:
+        encode_key = get_encode_key(
+            args.video_encoder, preset, get_encoder(args.video_encoder).get_speed(args)
+        )
+        encode_cpu, encode_wall, encode_calibrated = cost_model.estimate_encode(
+            encode_key, args.video_encoder, preset, megapixels, threads
+        )
+        scoring_cpu, scoring_wall, scoring_calibrated = cost_model.estimate_scoring(
+            get_scoring_key(model_count, args.subsample),
+            model_count,
+            megapixels / int(args.subsample),
+            vmaf_threads,
+        )
+        scratch_bytes = cost_model.estimate_size(args.video_encoder, crf, pixels) + json_bytes
+        estimates.append(
+            PointEstimate(
+                crf,
+                preset,
+                encode_cpu,
+                encode_wall,
+                scoring_cpu,
+                scoring_wall,
+                scratch_bytes,
+                encode_calibrated and scoring_calibrated,
+            )
+        )
+    return estimates
+
+
+def order_longest_first(items, estimates):
+    """
+    Orders items (in the same order as their estimates) so that the longest jobs start first,
+    which shortens the total time when the jobs run in parallel.
+    """
+    order = sorted(range(len(items)), key=lambda i: estimates[i].wall_time, reverse=True)
+    return [items[i] for i in order]
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+def show_plan(estimates, decimal_places):
+    table = PrettyTable()
+    table.field_names = [
+        "CRF",
+        "Preset",
+        "Encode Time",
+        "VMAF Time",
+        "CPU Time",
+        "Scratch Disk (MB)",
+        "Calibrated",
+    ]
+    for estimate in estimates:
+        table.add_row(
+            [
+                estimate.crf,
+                estimate.preset,
+                format_duration(estimate.encode_wall),
+                format_duration(estimate.scoring_wall),
+                format_duration(estimate.cpu_time),
+                force_decimal_places(estimate.scratch_bytes / 1_000_000, decimal_places),
+                "Yes" if estimate.calibrated else "No",
+            ]
+        )
+
+    total_wall = sum(estimate.wall_time for estimate in estimates)
+    total_cpu = sum(estimate.cpu_time for estimate in estimates)
+    total_scratch = sum(estimate.scratch_bytes for estimate in estimates)
+    log.info(table.get_string())
+    log.info(
+        f"Estimated total: {format_duration(total_wall)} wall time, {format_duration(total_cpu)} CPU time, "
+        f"{force_decimal_places(total_scratch / 1_000_000, decimal_places)} MB of scratch disk."
+    )
+    if not all(estimate.calibrated for estimate in estimates):
+        log.info(
+            "Estimates that are not calibrated use rough defaults. "
+            "They become more accurate once this encoder/preset has been used on this machine."
+        )
@@ -0,0 +1,197 @@
+import json
+import subprocess
+
+import numpy as np
+
+from streaming_stats import StreamingStats
+from utils import Logger, VideoInfoProvider
+
+log = Logger("quick_metrics")
+
+# libvmaf caps the PSNR of identical 8-bit frames at 60 dB.
+MAX_PSNR = 60.0
+SSIM_WINDOW_SIZE = 8
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+
+
+class RawLumaReader:
+    """
+    Decodes a video with FFmpeg and reads downscaled 8-bit luma frames from a rawvideo pipe
+    straight into a caller-provided NumPy buffer.
+    """
+
+    def __init__(self, video_path, width, height, fps, video_filters=None, frame_count=None):
+        filters = ["setpts=PTS-STARTPTS"]
+        if video_filters:
+            filters.append(video_filters)
+        filters += [f"scale={width}:{height}:flags=area", "format=gray"]
+
+        self.frame_size = width * height
+        self._process = subprocess.Popen(
+            [
+                "ffmpeg",
+                "-loglevel",
+                "error",
+                "-r",
+                fps,
+                "-i",
+                video_path,
+                "-map",
+                "0:V",
+                "-vf",
+                ",".join(filters),
+                *(["-frames:v", str(frame_count)] if frame_count else []),
+                "-f",
+                "rawvideo",
+                "-pix_fmt",
+                "gray",
+                "-",
+            ],
+            stdout=subprocess.PIPE,
+        )
+
+    def read_into(self, buffer):
+        """
+        Fills the (frames, height, width) uint8 buffer and returns the number of complete frames read.
+        """
+        view = memoryview(buffer).cast("B")
+        total_bytes_read = 0
+        while total_bytes_read < len(view):
+            bytes_read = self._process.stdout.readinto(view[total_bytes_read:])
+            if not bytes_read:
+                break
+            total_bytes_read += bytes_read
+        return total_bytes_read // self.frame_size
+
+    def close(self):
+        self._process.stdout.close()
+        return self._process.wait()
+
+
+def _box_mean(batch, size):
+    # The mean of every size x size window of each frame (valid region only), using summed-area tables.
+    summed_area = np.zeros((batch.shape[0], batch.shape[1] + 1, batch.shape[2] + 1))
+    np.cumsum(np.cumsum(batch, axis=1), axis=2, out=summed_area[:, 1:, 1:])
+    window_sums = (
+        summed_area[:, size:, size:]
+        - summed_area[:, :-size, size:]
+        - summed_area[:, size:, :-size]
+        + summed_area[:, :-size, :-size]
+    )
+    return window_sums / (size * size)
+
+
+def calculate_psnr(distorted, reference):
+    """
+    The PSNR of each frame in a batch of 8-bit frames.
+    """
+    difference = distorted.astype(np.float32) - reference
+    mse = np.square(difference, out=difference).mean(axis=(1, 2))
+    with np.errstate(divide="ignore"):
+        psnr = 10 * np.log10((255.0**2) / mse)
+    return np.minimum(psnr, MAX_PSNR)
+
+
+def calculate_ssim(distorted, reference):
+    """
+    The SSIM (with an 8x8 uniform window) of each frame in a batch of 8-bit frames.
+    """
+    x = distorted.astype(np.float64)
+    y = reference.astype(np.float64)
+    mu_x = _box_mean(x, SSIM_WINDOW_SIZE)
+    mu_y = _box_mean(y, SSIM_WINDOW_SIZE)
+    sigma_xx = _box_mean(x * x, SSIM_WINDOW_SIZE) - mu_x * mu_x
+    sigma_yy = _box_mean(y * y, SSIM_WINDOW_SIZE) - mu_y * mu_y
+    sigma_xy = _box_mean(x * y, SSIM_WINDOW_SIZE) - mu_x * mu_y
+
+    ssim_map = ((2 * mu_x * mu_y + SSIM_C1) * (2 * sigma_xy + SSIM_C2)) / (
+        (mu_x * mu_x + mu_y * mu_y + SSIM_C1) * (sigma_xx + sigma_yy + SSIM_C2)
+    )
+    return ssim_map.mean(axis=(1, 2))
+
+
+def get_quick_metrics_resolution(video_path, target_height):
+    width, height = VideoInfoProvider(video_path).get_resolution()
+    if height <= target_height:
+        return width - width % 2, height - height % 2
+    scaled_width = round(width * target_height / height / 2) * 2
+    return scaled_width, target_height
+
+
+def run_quick_metrics(
+    transcode_output_path, args, json_file_path, fps, original_video_path, batch_size=32
+):
+    """
+    A fast PSNR/SSIM of the downscaled luma of the transcode, for pre-screening sweep points before
+    the full libvmaf pass. The per-frame scores are saved in the same JSON format as libvmaf's,
+    and a StreamingStats summary of each metric is returned.
+    """
+    width, height = get_quick_metrics_resolution(original_video_path, args.prescreen_height)
+    distorted_reader = RawLumaReader(transcode_output_path, width, height, fps)
+    reference_reader = RawLumaReader(
+        original_video_path, width, height, fps, args.video_filters
+    )
+
+    # These buffers are reused for every batch.
+    distorted_frames = np.empty((batch_size, height, width), dtype=np.uint8)
+    reference_frames = np.empty((batch_size, height, width), dtype=np.uint8)
+
+    stats = {"PSNR": StreamingStats(), "SSIM": StreamingStats()}
+    frames = []
+    frame_number = 0
+
+    log.info(f"Calculating the quick PSNR and SSIM at {width}x{height}...")
+    try:
+        while True:
+            distorted_count = distorted_reader.read_into(distorted_frames)
+            reference_count = reference_reader.read_into(reference_frames)
+            count = min(distorted_count, reference_count)
+            if count == 0:
+                break
+
+            psnr = calculate_psnr(distorted_frames[:count], reference_frames[:count])
+            ssim = calculate_ssim(distorted_frames[:count], reference_frames[:count])
+            frame_numbers = list(range(frame_number, frame_number + count))
+            stats["PSNR"].update_batch(psnr, frame_numbers)
+            stats["SSIM"].update_batch(ssim, frame_numbers)
+
+            for i in range(count):
+                frames.append(
+                    {
+                        "frameNum": frame_number + i,
+                        "metrics": {"psnr_y": float(psnr[i]), "float_ssim": float(ssim[i])},
+                    }
+                )
+            frame_number += count
+
+            if count < batch_size:
+                break
+    finally:
+        distorted_reader.close()
+        reference_reader.close()
+
+    summaries = {metric_type: metric_stats.summary() for metric_type, metric_stats in stats.items()}
+
+    with open(json_file_path, "w") as f:
+        json.dump(
+            {
+                "frames": frames,
+                "pooled_metrics": {
+                    "psnr_y": summaries["PSNR"],
+                    "float_ssim": summaries["SSIM"],
+                },
+            },
+            f,
+        )
+
+    log.info("Done!")
+    return summaries
+
+
+def passes_prescreen(args, summaries):
+    if args.prescreen_min_psnr is not None and summaries["PSNR"]["mean"] < args.prescreen_min_psnr:
+        return False
+    if args.prescreen_min_ssim is not None and summaries["SSIM"]["mean"] < args.prescreen_min_ssim:
+        return False
+    return True
@@ -0,0 +1,95 @@
+import os
+import sys
+
+
+class ResourceUsage:
+    """
+    The CPU time, peak memory and I/O used by a single FFmpeg child process.
+    """
+
+    def __init__(self, user_cpu=0.0, sys_cpu=0.0, max_rss_bytes=0, read_bytes=0, write_bytes=0):
+        # Set by FfmpegProcess once the process has been reaped.
+        self.wall_time = None
+        self.user_cpu = user_cpu
+        self.sys_cpu = sys_cpu
+        self.max_rss_bytes = max_rss_bytes
+        self.read_bytes = read_bytes
+        self.write_bytes = write_bytes
+
+    @property
+    def cpu_time(self):
+        return self.user_cpu + self.sys_cpu
+
+    @property
+    def max_rss_mb(self):
+        return self.max_rss_bytes / 1_000_000
+
+    def to_dict(self):
+        return {
+            "wall_time_s": self.wall_time,
+            "user_cpu_s": self.user_cpu,
+            "sys_cpu_s": self.sys_cpu,
+            "cpu_time_s": self.cpu_time,
+            "max_rss_bytes": self.max_rss_bytes,
+            "read_bytes": self.read_bytes,
+            "write_bytes": self.write_bytes,
+        }
+
+    @classmethod
+    def from_dict(cls, usage):
+        resource_usage = cls(
+            usage["user_cpu_s"],
+            usage["sys_cpu_s"],
+            usage["max_rss_bytes"],
+            usage["read_bytes"],
+            usage["write_bytes"],
+        )
+        resource_usage.wall_time = usage["wall_time_s"]
+        return resource_usage
+
+
+def read_proc_io(pid):
+    """
+    Returns the (read_bytes, write_bytes) of a process from /proc/<pid>/io,
+    or None if /proc is not available (e.g. macOS and Windows) or the process has gone.
+    """
+    counters = {}
+    try:
+        with open(f"/proc/{pid}/io", "r") as f:
+            for row in f:
+                key, _, value = row.partition(":")
+                counters[key] = int(value)
+    except (OSError, ValueError):
+        return None
+
+    return counters.get("read_bytes", 0), counters.get("write_bytes", 0)
+
+
+def _exit_code(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def wait_and_collect_usage(process, io_counters=None):
+    """
+    Reaps a finished subprocess.Popen object and returns a ResourceUsage object for it.
+    os.wait4 gives us the rusage of this specific child, unlike resource.getrusage(RUSAGE_CHILDREN).
+    io_counters is the last (read_bytes, write_bytes) sample taken from /proc while the process was running.
+    """
+    read_bytes, write_bytes = io_counters if io_counters else (0, 0)
+
+    if not hasattr(os, "wait4") or process.returncode is not None:
+        process.wait()
+        return ResourceUsage(read_bytes=read_bytes, write_bytes=write_bytes)
+
+    _, status, rusage = os.wait4(process.pid, 0)
+    # Let the Popen object know that the process has already been reaped.
+    process.returncode = _exit_code(status)
+
+    # ru_maxrss is in bytes on macOS and in kilobytes everywhere else.
+    max_rss_bytes = rusage.ru_maxrss if sys.platform == "darwin" else rusage.ru_maxrss * 1024
+
+    return ResourceUsage(
+        rusage.ru_utime, rusage.ru_stime, max_rss_bytes, read_bytes, write_bytes
+    )
@@ -0,0 +1,262 @@
+"""
+An optional SQLite index of the results of every run, so that results can be queried across titles and runs.
+
+Example queries:
+    python results_db.py results.db runs
+    python results_db.py results.db best --min-vmaf 95
+    python results_db.py results.db best --min-vmaf 95 --encoder x264
+"""
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+import hashlib
+import json
+import os
+import sqlite3
+
+from encoders import get_encoder
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started_at TEXT NOT NULL,
+    source_path TEXT NOT NULL,
+    source_hash TEXT NOT NULL,
+    encoder TEXT,
+    arguments TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS points (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER REFERENCES runs(id),
+    source_hash TEXT NOT NULL,
+    source_path TEXT NOT NULL,
+    encoder TEXT,
+    crf INTEGER,
+    preset TEXT,
+    settings_key TEXT NOT NULL,
+    video_path TEXT NOT NULL,
+    metrics_json_path TEXT,
+    size_bytes INTEGER,
+    bitrate_bps INTEGER,
+    record TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    point_id INTEGER REFERENCES points(id),
+    metric TEXT NOT NULL,
+    min REAL,
+    std REAL,
+    mean REAL,
+    PRIMARY KEY (point_id, metric)
+);
+CREATE TABLE IF NOT EXISTS frame_summaries (
+    point_id INTEGER REFERENCES points(id),
+    metric TEXT NOT NULL,
+    frame_count INTEGER,
+    worst_frame INTEGER,
+    summary TEXT,
+    PRIMARY KEY (point_id, metric)
+);
+CREATE INDEX IF NOT EXISTS points_source_hash ON points(source_hash);
+CREATE INDEX IF NOT EXISTS points_encoder ON points(encoder);
+CREATE INDEX IF NOT EXISTS points_settings ON points(source_hash, encoder, settings_key);
+CREATE INDEX IF NOT EXISTS metrics_metric_mean ON metrics(metric, mean);
+"""
+
+
+def compute_source_hash(video_path, sample_size=1024 * 1024):
+    """
+    A fast fingerprint of a (potentially huge) source file: its size plus the first and last MiB.
+    """
+    file_size = os.path.getsize(video_path)
+    sha256 = hashlib.sha256(str(file_size).encode("utf-8"))
+    with open(video_path, "rb") as f:
+        sha256.update(f.read(sample_size))
+        if file_size > sample_size:
+            f.seek(max(sample_size, file_size - sample_size))
+            sha256.update(f.read(sample_size))
+    return sha256.hexdigest()
+
+
+def get_settings_key(args, crf, preset, ladder_height=None):
+    """
+    Everything apart from the source that affects the result of a sweep point.
+    """
+    settings = {
+        "crf": None if crf is None else int(crf),
+        "preset": preset,
+        # The speed argument of encoders that don't use presets, e.g. libaom-av1's cpu-used.
+        "speed": get_encoder(args.video_encoder).get_speed(args),
+        "video_filters": args.video_filters,
+        "n_subsample": str(args.subsample),
+        "phone_model": args.phone_model,
+        "vmaf_models": args.vmaf_models,
+        "vmaf_scaler": None if args.implicit_conversions else args.vmaf_scaler,
+        "implicit_conversions": args.implicit_conversions,
+        # A point is only reused if it has the scores of every metric that is calculated.
+        "calculate_psnr": args.calculate_psnr,
+        "calculate_ssim": args.calculate_ssim,
+        "calculate_msssim": args.calculate_msssim,
+        "encode_length": args.encode_length,
+        "snap_to_keyframes": args.snap_to_keyframes if args.encode_length else None,
+        "interval": args.interval,
+        "clip_length": args.clip_length if args.interval else None,
+        "overview_strategy": args.overview_strategy if args.interval else None,
+        "overview_clips": args.overview_clips if args.interval else None,
+        "align": args.align,
+        "max_frame_offset": args.max_frame_offset if args.align else None,
+    }
+    # Only added for bitrate ladder rungs, so that the keys of the other points are unchanged.
+    if ladder_height is not None:
+        settings["ladder_height"] = ladder_height
+    return json.dumps(settings, sort_keys=True)
+
+
+class ResultsDatabase:
+    def __init__(self, db_path):
+        self._connection = sqlite3.connect(db_path, timeout=30)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.executescript(SCHEMA)
+
+    def close(self):
+        self._connection.close()
+
+    def start_run(self, args, source_hash):
+        with self._connection:
+            cursor = self._connection.execute(
+                "INSERT INTO runs (started_at, source_path, source_hash, encoder, arguments) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    datetime.now(timezone.utc).isoformat(),
+                    args.original_video_path,
+                    source_hash,
+                    None if args.no_transcoding_mode else args.video_encoder,
+                    json.dumps(vars(args), default=str),
+                ),
+            )
+        return cursor.lastrowid
+
+    def add_point(self, record, metric_scores, frame_summaries):
+        """
+        record is the dictionary appended to Results.jsonl. metric_scores maps each metric type to its
+        raw min/std/mean, and frame_summaries maps each metric type to a summary of its per-frame scores.
+        """
+        with self._connection:
+            cursor = self._connection.execute(
+                "INSERT INTO points (run_id, source_hash, source_path, encoder, crf, preset, settings_key, "
+                "video_path, metrics_json_path, size_bytes, bitrate_bps, record) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    record.get("run_id"),
+                    record.get("source_hash"),
+                    record["original_video_path"],
+                    record["encoder"],
+                    record["crf"],
+                    record["preset"],
+                    record.get("settings_key", ""),
+                    record["video_path"],
+                    record.get("metrics_json_path"),
+                    record["size_bytes"],
+                    record["bitrate_bps"],
+                    json.dumps(record),
+                ),
+            )
+            point_id = cursor.lastrowid
+            self._connection.executemany(
+                "INSERT INTO metrics (point_id, metric, min, std, mean) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (point_id, metric, scores["min"], scores["std"], scores["mean"])
+                    for metric, scores in metric_scores.items()
+                ],
+            )
+            self._connection.executemany(
+                "INSERT INTO frame_summaries (point_id, metric, frame_count, worst_frame, summary) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        point_id,
+                        metric,
+                        summary["frame_count"],
+                        summary["worst_frame"],
+                        json.dumps(summary),
+                    )
+                    for metric, summary in frame_summaries.items()
+                ],
+            )
+        return point_id
+
+    def find_reusable_point(self, source_hash, encoder, settings_key):
+        """
+        Returns the record of the most recent point with the same source and settings,
+        if its libvmaf JSON file still exists (and its transcode, unless its size was recorded).
+        """
+        rows = self._connection.execute(
+            "SELECT record FROM points WHERE source_hash = ? AND encoder IS ? AND settings_key = ? "
+            "ORDER BY id DESC",
+            (source_hash, encoder, settings_key),
+        )
+        for row in rows:
+            record = json.loads(row["record"])
+            transcode_available = os.path.exists(record["video_path"]) or (
+                record.get("size_bytes") is not None and record.get("bitrate_bps") is not None
+            )
+            if transcode_available and os.path.exists(record.get("metrics_json_path") or ""):
+                return record
+        return None
+
+    def list_runs(self):
+        return self._connection.execute(
+            "SELECT runs.*, COUNT(points.id) AS point_count FROM runs "
+            "LEFT JOIN points ON points.run_id = runs.id GROUP BY runs.id ORDER BY runs.id"
+        ).fetchall()
+
+    def best_points(self, min_vmaf, encoder=None):
+        """
+        For each source, the point with the lowest bitrate whose mean VMAF is at least min_vmaf.
+        """
+        query = (
+            "SELECT points.source_path, points.encoder, points.crf, points.preset, points.bitrate_bps, "
+            "points.size_bytes, metrics.mean AS vmaf_mean, MIN(points.bitrate_bps) "
+            "FROM points JOIN metrics ON metrics.point_id = points.id "
+            "WHERE metrics.metric = 'VMAF' AND metrics.mean >= ?"
+        )
+        parameters = [min_vmaf]
+        if encoder:
+            query += " AND points.encoder = ?"
+            parameters.append(encoder)
+        query += " GROUP BY points.source_hash ORDER BY points.source_path"
+        return self._connection.execute(query, parameters).fetchall()
+
+
+def main():
+    parser = ArgumentParser(description="Query the VQM results database.")
+    parser.add_argument("db_path", help="The path of the database created with --results-db")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("runs", help="List the runs in the database")
+    best_parser = subparsers.add_parser(
+        "best", help="Show the lowest-bitrate point of each title that reaches a mean VMAF"
+    )
+    best_parser.add_argument("--min-vmaf", type=float, required=True)
+    best_parser.add_argument("--encoder", type=str, default=None)
+    query_args = parser.parse_args()
+
+    if not os.path.exists(query_args.db_path):
+        parser.error(f"Unable to find {query_args.db_path}")
+
+    database = ResultsDatabase(query_args.db_path)
+    if query_args.command == "runs":
+        for run in database.list_runs():
+            print(
+                f"{run['id']}\t{run['started_at']}\t{run['encoder']}\t"
+                f"{run['point_count']} point(s)\t{run['source_path']}"
+            )
+    else:
+        for point in database.best_points(query_args.min_vmaf, query_args.encoder):
+            print(
+                f"{point['source_path']}\t{point['encoder']}\tCRF {point['crf']}\t"
+                f"preset {point['preset']}\t{point['bitrate_bps'] / 1_000_000:.2f} Mbps\t"
+                f"VMAF {point['vmaf_mean']:.2f}"
+            )
+    database.close()
+
+
+if __name__ == "__main__":
+    main()
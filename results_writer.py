@@ -0,0 +1,130 @@
+import csv
+import io
+import json
+import os
+from datetime import datetime, timezone
+
+from results_db import get_settings_key
+from utils import Logger, VideoInfoProvider
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+log = Logger("results_writer")
+
+RESULTS_FORMATS = ["jsonl", "csv", "parquet"]
+
+
+def create_results_record(args, video_path, crf=None, preset=None):
+    """
+    Creates the machine-readable record for a sweep point. The metric and resource usage fields
+    are added by get_metrics_save_table.
+    """
+    return {
+        "run_id": getattr(args, "run_id", None),
+        "source_hash": getattr(args, "source_hash", None),
+        "settings_key": get_settings_key(args, crf, preset),
+        "status": "scored",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "original_video_path": args.original_video_path,
+        "video_path": video_path,
+        "encoder": None if args.no_transcoding_mode else args.video_encoder,
+        "crf": None if crf is None else int(crf),
+        "preset": preset,
+        "video_filters": args.video_filters,
+        "n_subsample": int(args.subsample),
+        # The transcode does not exist if its encode was aborted.
+        "size_bytes": os.path.getsize(video_path) if os.path.exists(video_path) else None,
+        "bitrate_bps": (
+            VideoInfoProvider(video_path).get_bitrate_bps() if os.path.exists(video_path) else None
+        ),
+    }
+
+
+def _append(path, data):
+    # A single write() on a file opened with O_APPEND is not interleaved with writes made by other processes.
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, data.encode("utf-8"))
+    finally:
+        os.close(fd)
+
+
+class ResultsWriter:
+    """
+    Appends one typed record per sweep point to Results.jsonl/Results.csv (and optionally Results.parquet),
+    so that results can be read while a run is still in progress.
+    """
+
+    def __init__(self, output_folder, formats=("jsonl", "csv")):
+        self._output_folder = output_folder
+        self._formats = formats
+        self.jsonl_path = os.path.join(output_folder, "Results.jsonl")
+        self.csv_path = os.path.join(output_folder, "Results.csv")
+        self.parquet_path = os.path.join(output_folder, "Results.parquet")
+
+    def append(self, record):
+        os.makedirs(self._output_folder, exist_ok=True)
+
+        # The JSON Lines file is always written, as Results.parquet is rebuilt from it.
+        _append(self.jsonl_path, json.dumps(record) + "\n")
+
+        if "csv" in self._formats:
+            self._append_csv(record)
+
+        if "parquet" in self._formats:
+            self._write_parquet()
+
+    def read_records(self):
+        if not os.path.exists(self.jsonl_path):
+            return []
+        with open(self.jsonl_path, "r") as f:
+            return [json.loads(row) for row in f if row.strip()]
+
+    def _append_csv(self, record):
+        if os.path.exists(self.csv_path) and os.path.getsize(self.csv_path) > 0:
+            with open(self.csv_path, "r", newline="") as f:
+                field_names = next(csv.reader(f))
+            write_header = False
+
+            # E.g. the first record was a transcode that was rejected before its VMAF was calculated.
+            if any(key not in field_names for key in record):
+                self._rewrite_csv()
+                return
+        else:
+            field_names = list(record.keys())
+            write_header = True
+
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=field_names, extrasaction="ignore")
+        if write_header:
+            writer.writeheader()
+        writer.writerow(record)
+        _append(self.csv_path, buffer.getvalue())
+
+    def _rewrite_csv(self):
+        records = self.read_records()
+        field_names = []
+        for record in records:
+            field_names += [key for key in record if key not in field_names]
+
+        temporary_path = f"{self.csv_path}.tmp"
+        with open(temporary_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=field_names)
+            writer.writeheader()
+            writer.writerows(records)
+        os.replace(temporary_path, self.csv_path)
+
+    def _write_parquet(self):
+        if pyarrow is None:
+            log.warning("pyarrow is not installed, so Results.parquet will not be written.")
+            return
+
+        table = pyarrow.Table.from_pylist(self.read_records())
+        temporary_path = f"{self.parquet_path}.tmp"
+        pyarrow.parquet.write_table(table, temporary_path)
+        # Readers never see a partially written Parquet file.
+        os.replace(temporary_path, self.parquet_path)
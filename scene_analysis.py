@@ -0,0 +1,107 @@
+import numpy as np
+
+from quick_metrics import RawLumaReader
+from utils import Logger, VideoInfoProvider
+
+log = Logger("scene_analysis")
+
+ANALYSIS_WIDTH = 160
+# A sample is treated as a scene change if its temporal activity is this many times the median.
+SCENE_CHANGE_FACTOR = 4.0
+SCENE_CHANGE_MINIMUM = 20.0
+
+
+class ComplexityAnalysis:
+    """
+    The spatial and temporal activity of a video, sampled a few times per second from downscaled luma.
+    """
+
+    def __init__(self, sample_times, spatial, temporal):
+        self.sample_times = sample_times
+        self.spatial = spatial
+        self.temporal = temporal
+        threshold = max(SCENE_CHANGE_MINIMUM, SCENE_CHANGE_FACTOR * float(np.median(temporal)))
+        self.scene_changes = temporal > threshold
+
+
+def analyse_complexity(video_path, samples_per_second=4, batch_size=64):
+    provider = VideoInfoProvider(video_path)
+    width, height = provider.get_resolution()
+    analysis_height = max(2, round(ANALYSIS_WIDTH * height / width / 2) * 2)
+
+    reader = RawLumaReader(
+        video_path,
+        ANALYSIS_WIDTH,
+        analysis_height,
+        provider.get_framerate_fraction(),
+        f"fps={samples_per_second}",
+    )
+    frames = np.empty((batch_size, analysis_height, ANALYSIS_WIDTH), dtype=np.uint8)
+    spatial, temporal = [], []
+    previous_frame = None
+
+    log.info(f"Analysing the scene changes and complexity of {video_path}...")
+    try:
+        while True:
+            count = reader.read_into(frames)
+            if count == 0:
+                break
+
+            batch = frames[:count].astype(np.int16)
+            # Spatial activity: the mean absolute horizontal and vertical gradient of each frame.
+            spatial.append(
+                np.abs(np.diff(batch, axis=2)).mean(axis=(1, 2))
+                + np.abs(np.diff(batch, axis=1)).mean(axis=(1, 2))
+            )
+            # Temporal activity: the mean absolute difference from the previous sample.
+            previous_frames = np.concatenate(
+                [batch[:1] if previous_frame is None else previous_frame[None], batch[:-1]]
+            )
+            temporal.append(np.abs(batch - previous_frames).mean(axis=(1, 2)))
+            previous_frame = batch[-1]
+
+            if count < batch_size:
+                break
+    finally:
+        reader.close()
+
+    spatial = np.concatenate(spatial) if spatial else np.empty(0)
+    temporal = np.concatenate(temporal) if temporal else np.empty(0)
+    sample_times = np.arange(len(spatial)) / samples_per_second
+    log.info("Done!")
+    return ComplexityAnalysis(sample_times, spatial, temporal)
+
+
+def select_representative_clips(analysis, duration, clip_length, clip_count):
+    """
+    Splits the video into clip_length windows, sorts them by complexity and divides them into clip_count strata
+    with the same number of windows. The most typical window of each stratum is chosen, so every clip represents
+    the same share of the video and the chosen clips cover the whole complexity distribution.
+    Windows that contain a scene change are avoided where possible.
+    """
+    window_count = int(duration // clip_length)
+    if window_count == 0 or len(analysis.sample_times) == 0:
+        return [0.0]
+
+    window_indices = np.minimum(
+        (analysis.sample_times // clip_length).astype(np.int64), window_count - 1
+    )
+    samples_per_window = np.maximum(np.bincount(window_indices, minlength=window_count), 1)
+    spatial = np.bincount(window_indices, analysis.spatial, window_count) / samples_per_window
+    temporal = np.bincount(window_indices, analysis.temporal, window_count) / samples_per_window
+    scene_changes = np.bincount(window_indices, analysis.scene_changes, window_count) > 0
+
+    # Like SI x TI, this tracks how hard a window is to encode.
+    complexity = spatial * (temporal + 1)
+
+    clip_count = max(1, min(clip_count, window_count))
+    order = np.argsort(complexity, kind="mergesort")
+    clip_starts = []
+    for stratum in np.array_split(order, clip_count):
+        median_complexity = np.median(complexity[stratum])
+        distance = np.abs(complexity[stratum] - median_complexity)
+        # Prefer windows without a scene change.
+        distance = distance + scene_changes[stratum] * (distance.max() + 1)
+        clip_starts.append(float(stratum[int(np.argmin(distance))] * clip_length))
+
+    return sorted(clip_starts)
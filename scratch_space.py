@@ -0,0 +1,183 @@
+import atexit
+import os
+import shutil
+import socket
+import tempfile
+import time
+
+from utils import Logger
+
+log = Logger("scratch_space")
+
+# Files are only staged on the RAM disk if it has this much more free space than their estimated size.
+RAM_DISK_MARGIN = 1.25
+POLL_INTERVAL = 5
+
+
+def _pid_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class StagedFile:
+    def __init__(self, path, final_path, reservation_path, is_folder=False):
+        self.path = path
+        self.final_path = final_path
+        self.is_folder = is_folder
+        self._reservation_path = reservation_path
+
+
+class ScratchSpace:
+    """
+    Decides where short-lived intermediates (transcodes, cut references and overview clips) are written.
+    Intermediates are staged on the RAM disk when their estimated size fits, and every intermediate reserves
+    its estimated size from the byte budget until it is deleted or moved to the output folder. The reservations
+    are files, so runs that share a scratch folder share the budget. A run waits for space if its reservation
+    would exceed the budget.
+    """
+
+    def __init__(self, scratch_folder=None, ram_disk=None, budget_bytes=None):
+        self._scratch_folder = scratch_folder
+        self._budget_bytes = budget_bytes
+        self._reservations_folder = os.path.join(
+            scratch_folder or os.path.join(tempfile.gettempdir(), "video-quality-metrics"),
+            ".reservations",
+        )
+        os.makedirs(self._reservations_folder, exist_ok=True)
+        self._reservation_count = 0
+        self._hostname = socket.gethostname()
+        self._staged = []
+
+        self._ram_disk_folder = None
+        if ram_disk:
+            self._ram_disk_folder = os.path.join(ram_disk, f"video-quality-metrics-{os.getpid()}")
+            os.makedirs(self._ram_disk_folder, exist_ok=True)
+
+        self._run_folder = None
+        if scratch_folder:
+            os.makedirs(scratch_folder, exist_ok=True)
+            self._run_folder = tempfile.mkdtemp(prefix="run-", dir=scratch_folder)
+
+        atexit.register(self.cleanup)
+
+    def _read_reservations(self):
+        """
+        Returns the outstanding reservations of every run as (size, on_ram_disk, is_own) tuples.
+        The reservations of processes on this host that no longer exist are removed. The scratch folder may be
+        shared with other hosts, whose processes can't be checked, so their reservations are always counted.
+        """
+        reservations = []
+        for name in os.listdir(self._reservations_folder):
+            path = os.path.join(self._reservations_folder, name)
+            try:
+                # The hostname may contain hyphens, but the PID and the count don't.
+                hostname, pid, _ = name.rsplit("-", 2)
+                pid = int(pid)
+                is_local = hostname == self._hostname
+                if is_local and not _pid_exists(pid):
+                    os.remove(path)
+                    continue
+                with open(path, "r") as f:
+                    size, location = f.read().split()
+                reservations.append((int(size), location == "ram", is_local and pid == os.getpid()))
+            except (OSError, ValueError):
+                continue
+        return reservations
+
+    def _reserve(self, estimated_bytes):
+        waiting = False
+        while True:
+            reservations = self._read_reservations()
+            reserved_bytes = sum(size for size, _, _ in reservations)
+            # Only wait for other runs, as this run's own reservations are not released while it waits.
+            if (
+                self._budget_bytes is None
+                or all(is_own for _, _, is_own in reservations)
+                or reserved_bytes + estimated_bytes <= self._budget_bytes
+            ):
+                break
+            if not waiting:
+                log.info(
+                    f"Waiting for scratch space ({reserved_bytes / 1_000_000:.0f} MB of the "
+                    f"{self._budget_bytes / 1_000_000:.0f} MB budget is in use)..."
+                )
+                waiting = True
+            time.sleep(POLL_INTERVAL)
+
+        use_ram_disk = False
+        if self._ram_disk_folder:
+            reserved_ram_disk_bytes = sum(
+                size for size, on_ram_disk, _ in reservations if on_ram_disk
+            )
+            free_bytes = shutil.disk_usage(self._ram_disk_folder).free - reserved_ram_disk_bytes
+            use_ram_disk = free_bytes >= estimated_bytes * RAM_DISK_MARGIN
+
+        self._reservation_count += 1
+        reservation_path = os.path.join(
+            self._reservations_folder,
+            f"{self._hostname}-{os.getpid()}-{self._reservation_count}",
+        )
+        with open(reservation_path, "w") as f:
+            f.write(f"{int(estimated_bytes)} {'ram' if use_ram_disk else 'disk'}")
+        return reservation_path, use_ram_disk
+
+    def _get_staging_folder(self, final_path, use_ram_disk):
+        if use_ram_disk:
+            return self._ram_disk_folder
+        if self._run_folder:
+            return self._run_folder
+        return os.path.dirname(final_path)
+
+    def stage(self, final_path, estimated_bytes):
+        """
+        Reserves space for a file that will eventually be saved to final_path (or deleted)
+        and returns where it should be written.
+        """
+        reservation_path, use_ram_disk = self._reserve(estimated_bytes)
+        staging_folder = self._get_staging_folder(final_path, use_ram_disk)
+        os.makedirs(staging_folder, exist_ok=True)
+        staged = StagedFile(
+            os.path.join(staging_folder, os.path.basename(final_path)), final_path, reservation_path
+        )
+        self._staged.append(staged)
+        return staged
+
+    def stage_folder(self, final_path, estimated_bytes):
+        staged = self.stage(final_path, estimated_bytes)
+        staged.is_folder = True
+        os.makedirs(staged.path, exist_ok=True)
+        return staged
+
+    def finish(self, staged, keep):
+        """
+        Moves a staged file to its final path if keep is True, otherwise deletes it,
+        and releases its reservation. Returns the final path, or None if the file was deleted.
+        """
+        result = None
+        if keep and os.path.exists(staged.path):
+            if os.path.abspath(staged.path) != os.path.abspath(staged.final_path):
+                os.makedirs(os.path.dirname(os.path.abspath(staged.final_path)), exist_ok=True)
+                shutil.move(staged.path, staged.final_path)
+            result = staged.final_path
+        elif staged.is_folder:
+            shutil.rmtree(staged.path, ignore_errors=True)
+        elif os.path.exists(staged.path):
+            os.remove(staged.path)
+
+        if os.path.exists(staged._reservation_path):
+            os.remove(staged._reservation_path)
+        if staged in self._staged:
+            self._staged.remove(staged)
+        return result
+
+    def cleanup(self):
+        for staged in list(self._staged):
+            self.finish(staged, keep=False)
+        for folder in [self._ram_disk_folder, self._run_folder]:
+            if folder and os.path.exists(folder):
+                shutil.rmtree(folder, ignore_errors=True)
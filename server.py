@@ -0,0 +1,342 @@
+"""
+Runs VQM as a long-running service that accepts jobs over a local HTTP API and/or a spool directory.
+
+The heavy modules are imported once by a fork server and each job runs main.py in a process forked from it,
+so jobs don't pay for importing NumPy/matplotlib. The service probes the original video of each job when it is
+submitted and passes the result to the job, so it isn't probed again. Paths in the arguments of a job are relative
+to the working directory of the service.
+
+    python server.py --port 8765 --workers 2 --spool-dir spool
+
+    POST /jobs                 {"arguments": ["-ovp", "/videos/a.mkv", "-crf", "20", "24"], "priority": 0}
+    GET  /jobs                 All of the jobs and their status.
+    GET  /jobs/<id>            The status of a job, plus its results once it has finished.
+    GET  /jobs/<id>/log?offset=<bytes>
+                               The output of a job from the specified offset, for streaming its progress.
+
+A job can also be submitted by writing the same JSON to a *.json file in the spool directory.
+Lower priorities run first.
+"""
+from argparse import ArgumentParser
+import atexit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import glob
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import runpy
+import sys
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+# Imported here so that the fork server (which imports this module) preloads them for the jobs.
+import matplotlib
+import numpy
+import prettytable
+
+from utils import cached_probe, get_probe_cache, Logger, update_probe_cache
+
+log = Logger("server", filename="server.log")
+
+VQM_FOLDER = os.path.dirname(os.path.abspath(__file__))
+MAIN_PATH = os.path.join(VQM_FOLDER, "main.py")
+
+# The arguments of main.py whose values are paths. The jobs run in VQM_FOLDER, so they are made absolute
+# when a job is submitted.
+PATH_ARGUMENTS = [
+    "-ovp",
+    "--original-video-path",
+    "-o",
+    "--output-folder",
+    "-tvp",
+    "--transcoded-video-path",
+    "--results-db",
+    "--cost-model",
+    "--scratch-dir",
+    "--ram-disk",
+    "--distributed-queue",
+]
+
+
+def _run_job(arguments, log_path, probe_cache):
+    # This runs in the child process.
+    with open(log_path, "ab", buffering=0) as log_file:
+        os.dup2(log_file.fileno(), sys.stdout.fileno())
+        os.dup2(log_file.fileno(), sys.stderr.fileno())
+    update_probe_cache(probe_cache)
+    os.chdir(VQM_FOLDER)
+    sys.argv = [MAIN_PATH, *arguments]
+    try:
+        runpy.run_path(MAIN_PATH, run_name="__main__")
+    finally:
+        # The child process exits with os._exit, which doesn't run the atexit handlers, so they are run
+        # (and unregistered) here: these flush the logs and remove the scratch space of the job.
+        atexit._run_exitfuncs()
+
+
+def _make_paths_absolute(arguments):
+    absolute_arguments = list(arguments)
+    for i, argument in enumerate(absolute_arguments):
+        name, separator, value = argument.partition("=")
+        if name not in PATH_ARGUMENTS:
+            continue
+        if separator:
+            absolute_arguments[i] = f"{name}={os.path.abspath(value)}"
+        elif i + 1 < len(absolute_arguments):
+            absolute_arguments[i + 1] = os.path.abspath(absolute_arguments[i + 1])
+    return absolute_arguments
+
+
+def _get_argument_value(arguments, *names):
+    for i, argument in enumerate(arguments[:-1]):
+        if argument in names:
+            return arguments[i + 1]
+    return None
+
+
+class Job:
+    def __init__(self, job_id, arguments, priority, work_folder):
+        self.id = job_id
+        self.priority = priority
+        self.status = "queued"
+        self.exit_code = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.folder = os.path.join(work_folder, str(job_id))
+        self.log_path = os.path.join(self.folder, "job.log")
+
+        self.arguments = list(arguments)
+        self.output_folder = _get_argument_value(self.arguments, "-o", "--output-folder")
+        if self.output_folder is None:
+            self.output_folder = os.path.join(self.folder, "output")
+            self.arguments += ["-o", self.output_folder]
+
+    def get_results(self):
+        results = []
+        for results_path in glob.glob(
+            os.path.join(glob.escape(self.output_folder), "**", "Results.jsonl"), recursive=True
+        ):
+            with open(results_path, "r") as f:
+                results += [json.loads(row) for row in f if row.strip()]
+        return results
+
+    def to_dict(self, include_results=False):
+        job = {
+            "id": self.id,
+            "status": self.status,
+            "priority": self.priority,
+            "arguments": self.arguments,
+            "exit_code": self.exit_code,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "output_folder": self.output_folder,
+        }
+        if include_results:
+            job["results"] = self.get_results()
+        return job
+
+
+class JobQueue:
+    def __init__(self, work_folder, workers):
+        self._work_folder = work_folder
+        self._workers = workers
+        self._queue = queue.PriorityQueue()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        # Forking this process is unsafe because it runs threads (the HTTP server, the workers and the log
+        # writer), so the jobs are forked from a single-threaded fork server that has imported this module.
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            self._context = multiprocessing.get_context("forkserver")
+            self._context.set_forkserver_preload(["__main__"])
+        else:
+            self._context = multiprocessing.get_context("spawn")
+
+    def submit(self, arguments, priority=0):
+        if not isinstance(arguments, list) or not all(isinstance(a, str) for a in arguments):
+            raise ValueError('"arguments" must be a list of strings.')
+        arguments = _make_paths_absolute(arguments)
+
+        # The available CPUs are split between the jobs that run at the same time.
+        if "--concurrent-jobs" not in arguments:
+            arguments = [*arguments, "--concurrent-jobs", str(self._workers)]
+
+        with self._lock:
+            job = Job(next(self._ids), arguments, int(priority), self._work_folder)
+            self._jobs[job.id] = job
+        os.makedirs(job.folder, exist_ok=True)
+
+        # Warm the probe cache, which is passed to the job.
+        original_video_path = _get_argument_value(arguments, "-ovp", "--original-video-path")
+        if original_video_path and os.path.exists(original_video_path):
+            try:
+                cached_probe(original_video_path)
+            except Exception as error:
+                log.warning(f"Unable to probe {original_video_path}: {error}")
+
+        self._queue.put((job.priority, job.id))
+        log.info(f"Job {job.id} queued with priority {job.priority}.")
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def list(self):
+        return [job.to_dict() for job in self._jobs.values()]
+
+    def start_workers(self):
+        for _ in range(self._workers):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def _work(self):
+        while True:
+            _, job_id = self._queue.get()
+            job = self._jobs[job_id]
+            job.status = "running"
+            job.started_at = time.time()
+            log.info(f"Job {job.id} started.")
+
+            process = self._context.Process(
+                target=_run_job, args=(job.arguments, job.log_path, get_probe_cache())
+            )
+            process.start()
+            process.join()
+
+            job.exit_code = process.exitcode
+            job.finished_at = time.time()
+            job.status = "finished" if process.exitcode == 0 else "failed"
+            log.info(f"Job {job.id} {job.status} (exit code {job.exit_code}).")
+
+
+def watch_spool_folder(spool_folder, job_queue, interval=2):
+    os.makedirs(spool_folder, exist_ok=True)
+    while True:
+        for job_path in sorted(glob.glob(os.path.join(glob.escape(spool_folder), "*.json"))):
+            claimed_path = f"{job_path}.submitted"
+            try:
+                # Renaming the file claims it, so it is only submitted once.
+                os.rename(job_path, claimed_path)
+                with open(claimed_path, "r") as f:
+                    request = json.load(f)
+                job = job_queue.submit(request["arguments"], request.get("priority", 0))
+                with open(f"{job_path}.job", "w") as f:
+                    json.dump({"id": job.id}, f)
+            except (OSError, ValueError, KeyError) as error:
+                log.warning(f"Unable to submit {job_path}: {error}")
+        time.sleep(interval)
+
+
+def create_request_handler(job_queue):
+    class RequestHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _get_job(self, job_id):
+            try:
+                return job_queue.get(int(job_id))
+            except ValueError:
+                return None
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            parts = url.path.strip("/").split("/")
+
+            if parts == ["jobs"]:
+                return self._send_json(200, job_queue.list())
+
+            if len(parts) in (2, 3) and parts[0] == "jobs":
+                job = self._get_job(parts[1])
+                if job is None:
+                    return self._send_json(404, {"error": "Job not found."})
+
+                if len(parts) == 2:
+                    return self._send_json(200, job.to_dict(include_results=True))
+
+                if parts[2] == "log":
+                    offset = int(parse_qs(url.query).get("offset", ["0"])[0])
+                    data = b""
+                    if os.path.exists(job.log_path):
+                        with open(job.log_path, "rb") as f:
+                            f.seek(offset)
+                            data = f.read()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; charset=utf-8")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.send_header("X-Next-Offset", str(offset + len(data)))
+                    self.send_header("X-Job-Status", job.status)
+                    self.end_headers()
+                    self.wfile.write(data)
+                    return
+
+            self._send_json(404, {"error": "Not found."})
+
+        def do_POST(self):
+            if urlparse(self.path).path.strip("/") != "jobs":
+                return self._send_json(404, {"error": "Not found."})
+
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length))
+                job = job_queue.submit(request["arguments"], request.get("priority", 0))
+            except (ValueError, KeyError, TypeError) as error:
+                return self._send_json(400, {"error": str(error)})
+
+            self._send_json(201, job.to_dict())
+
+        def log_message(self, format, *args):
+            log.debug(format % args)
+
+    return RequestHandler
+
+
+def main():
+    parser = ArgumentParser(description="Run VQM as a service.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="The address to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="The port to listen on")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="The number of jobs that can run at the same time"
+    )
+    parser.add_argument(
+        "--work-folder",
+        type=str,
+        default="vqm-jobs",
+        help="Where the logs and (unless -o is specified) the output of each job are saved",
+    )
+    parser.add_argument(
+        "--spool-dir",
+        type=str,
+        default=None,
+        help="Also accept jobs written to *.json files in this folder",
+    )
+    server_args = parser.parse_args()
+
+    job_queue = JobQueue(os.path.abspath(server_args.work_folder), server_args.workers)
+    job_queue.start_workers()
+
+    if server_args.spool_dir:
+        threading.Thread(
+            target=watch_spool_folder, args=(server_args.spool_dir, job_queue), daemon=True
+        ).start()
+
+    server = ThreadingHTTPServer(
+        (server_args.host, server_args.port), create_request_handler(job_queue)
+    )
+    log.info(f"Listening on http://{server_args.host}:{server_args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import math
+
+import numpy as np
+
+
+class TDigest:
+    """
+    A merging t-digest (Dunning & Ertl), used to estimate quantiles such as the 1st percentile
+    without keeping every value in memory. The number of centroids is bounded by roughly the compression.
+    """
+
+    def __init__(self, compression=100, buffer_size=1000):
+        self._compression = compression
+        self._buffer_size = buffer_size
+        self._buffer = []
+        self._means = np.empty(0)
+        self._weights = np.empty(0)
+        self.min = math.inf
+        self.max = -math.inf
+
+    def update(self, value):
+        self._buffer.append(value)
+        if len(self._buffer) >= self._buffer_size:
+            self._merge()
+
+    def update_batch(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        # Added buffer_size values at a time, so that the buffer stays bounded for any batch size.
+        for start in range(0, len(values), self._buffer_size):
+            self._buffer.extend(values[start : start + self._buffer_size].tolist())
+            if len(self._buffer) >= self._buffer_size:
+                self._merge()
+
+    def _k(self, q):
+        q = min(max(q, 0.0), 1.0)
+        return self._compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+    def _merge(self):
+        if not self._buffer:
+            return
+
+        buffer = np.asarray(self._buffer, dtype=np.float64)
+        self._buffer = []
+        self.min = min(self.min, float(buffer.min()))
+        self.max = max(self.max, float(buffer.max()))
+
+        means = np.concatenate([self._means, buffer])
+        weights = np.concatenate([self._weights, np.ones(len(buffer))])
+        order = np.argsort(means, kind="mergesort")
+        means, weights = means[order], weights[order]
+        total_weight = weights.sum()
+
+        merged_means, merged_weights = [], []
+        weight_so_far = 0.0
+        current_mean, current_weight = means[0], weights[0]
+        k_lower = self._k(0.0)
+
+        for mean, weight in zip(means[1:], weights[1:]):
+            q_upper = (weight_so_far + current_weight + weight) / total_weight
+            if self._k(q_upper) - k_lower <= 1:
+                current_weight += weight
+                current_mean += (mean - current_mean) * weight / current_weight
+            else:
+                merged_means.append(current_mean)
+                merged_weights.append(current_weight)
+                weight_so_far += current_weight
+                k_lower = self._k(weight_so_far / total_weight)
+                current_mean, current_weight = mean, weight
+
+        merged_means.append(current_mean)
+        merged_weights.append(current_weight)
+        self._means = np.asarray(merged_means)
+        self._weights = np.asarray(merged_weights)
+
+    def quantile(self, q):
+        self._merge()
+        if len(self._means) == 0:
+            return math.nan
+        if len(self._means) == 1:
+            return float(self._means[0])
+
+        total_weight = self._weights.sum()
+        # The cumulative weight at the centre of each centroid.
+        centres = np.cumsum(self._weights) - self._weights / 2
+        # Interpolate to the minimum/maximum at the tails.
+        positions = np.concatenate([[0.0], centres, [total_weight]])
+        values = np.concatenate([[self.min], self._means, [self.max]])
+        return float(np.interp(q * total_weight, positions, values))
+
+
+class StreamingStats:
+    """
+    Single-pass statistics of a stream of per-frame scores: count, min/max (and the frame where the minimum occurred),
+    mean and variance (Welford), the harmonic mean and approximate quantiles (t-digest).
+    """
+
+    def __init__(self, compression=200):
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.min_frame = None
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._reciprocal_sum = 0.0
+        self._digest = TDigest(compression)
+
+    def update(self, value, frame_number=None):
+        value = float(value)
+        self.count += 1
+        delta = value - self._mean
+        self._mean += delta / self.count
+        self._m2 += delta * (value - self._mean)
+        if value < self.min:
+            self.min = value
+            self.min_frame = frame_number
+        self.max = max(self.max, value)
+        self._reciprocal_sum += 1 / (value + 1)
+        self._digest.update(value)
+
+    def update_batch(self, values, frame_numbers=None):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if len(values) == 0:
+            return
+
+        # Combine the statistics of the batch with the running statistics (Chan et al.).
+        batch_count = len(values)
+        batch_mean = values.mean()
+        batch_m2 = ((values - batch_mean) ** 2).sum()
+        total_count = self.count + batch_count
+        delta = batch_mean - self._mean
+        self._mean += delta * batch_count / total_count
+        self._m2 += batch_m2 + delta**2 * self.count * batch_count / total_count
+        self.count = total_count
+
+        batch_min_index = int(values.argmin())
+        if values[batch_min_index] < self.min:
+            self.min = float(values[batch_min_index])
+            self.min_frame = (
+                frame_numbers[batch_min_index] if frame_numbers is not None else None
+            )
+        self.max = max(self.max, float(values.max()))
+        self._reciprocal_sum += (1 / (values + 1)).sum()
+        self._digest.update_batch(values)
+
+    @property
+    def mean(self):
+        return self._mean if self.count else math.nan
+
+    @property
+    def variance(self):
+        # The population variance, like np.var.
+        return self._m2 / self.count if self.count else math.nan
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    @property
+    def harmonic_mean(self):
+        # Calculated in the same way as libvmaf's pooled harmonic mean, which tolerates scores of 0.
+        return self.count / self._reciprocal_sum - 1 if self.count else math.nan
+
+    def quantile(self, q):
+        return self._digest.quantile(q)
+
+    def summary(self):
+        return {
+            "frame_count": self.count,
+            "worst_frame": self.min_frame,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.mean,
+            "std": self.std,
+            "harmonic_mean": self.harmonic_mean,
+            "p1": self.quantile(0.01),
+            "p5": self.quantile(0.05),
+            "p50": self.quantile(0.5),
+        }
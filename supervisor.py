@@ -0,0 +1,29 @@
+from time import sleep
+
+from ffmpeg_process_factory import FfmpegError
+from utils import Logger
+
+log = Logger("supervisor")
+
+
+def run_with_retries(function, description, max_retries, backoff_seconds):
+    """
+    Calls function, retrying it with exponential backoff if FFmpeg fails or stalls.
+    The FfmpegError of the last attempt is raised if every attempt fails.
+    """
+    attempt = 0
+    while True:
+        try:
+            return function()
+        except FfmpegError as error:
+            if attempt >= max_retries:
+                log.warning(f"The {description} failed after {attempt + 1} attempt(s): {error}")
+                raise
+
+            delay = backoff_seconds * 2**attempt
+            attempt += 1
+            log.warning(
+                f"The {description} failed ({error}). Retrying in {delay} seconds "
+                f"(retry {attempt} of {max_retries})..."
+            )
+            sleep(delay)
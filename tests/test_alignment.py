@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+import alignment
+from alignment import _correlate, find_frame_offset
+
+FRAME_COUNT = 60
+
+
+@pytest.fixture
+def frames():
+    # Random thumbnails, so that every frame is different from the others.
+    return np.random.default_rng(0).integers(0, 256, (FRAME_COUNT + 10, 9, 16), dtype=np.uint8)
+
+
+def use_thumbnails(monkeypatch, distorted, reference):
+    monkeypatch.setattr(alignment, "get_quick_metrics_resolution", lambda *args: (16, 9))
+    monkeypatch.setattr(
+        alignment,
+        "read_thumbnails",
+        lambda video_path, *args: distorted if video_path == "distorted" else reference,
+    )
+
+
+def test_correlate_scores_every_offset(frames):
+    vectors = frames[:20].reshape(20, -1).astype(np.float32)
+    scores = _correlate(vectors[2:], vectors[:-2], max_offset=4)
+    assert len(scores) == 9
+    # Distorted frame i is reference frame i + 2.
+    assert int(np.argmax(scores)) - 4 == 2
+    assert scores[6] == pytest.approx(1)
+
+
+@pytest.mark.parametrize("offset", [0, 1, 3, -2])
+def test_find_frame_offset(monkeypatch, frames, offset):
+    reference = frames[5 : 5 + FRAME_COUNT]
+    distorted = frames[5 + offset : 5 + offset + FRAME_COUNT]
+    use_thumbnails(monkeypatch, distorted, reference)
+    assert find_frame_offset("distorted", "reference", "24") == offset
+
+
+def test_static_frames_are_not_trimmed(monkeypatch, frames):
+    static = np.repeat(frames[:1], FRAME_COUNT, axis=0)
+    use_thumbnails(monkeypatch, static, static)
+    assert find_frame_offset("distorted", "reference", "24") == 0
+
+
+def test_too_few_frames(monkeypatch, frames):
+    use_thumbnails(monkeypatch, frames[:2], frames[:2])
+    assert find_frame_offset("distorted", "reference", "24") == 0
@@ -0,0 +1,145 @@
+import multiprocessing
+import os
+import time
+
+import distributed
+from distributed import DistributedSweep, run_worker, TaskQueue
+
+
+def test_tasks_are_claimed_in_rank_order(tmp_path):
+    queue = TaskQueue(str(tmp_path))
+    queue.submit("b", {"crf": 24}, rank=1)
+    queue.submit("a", {"crf": 20}, rank=0)
+
+    _, first = queue.claim()
+    _, second = queue.claim()
+    assert [first["task_id"], second["task_id"]] == ["a", "b"]
+    assert first["crf"] == 20
+    assert queue.claim() is None
+
+
+def test_complete_saves_the_result_and_releases_the_lease(tmp_path):
+    queue = TaskQueue(str(tmp_path))
+    queue.submit("a", {})
+    lease_path, task = queue.claim()
+    queue.complete(lease_path, task["task_id"], {"status": "ok"})
+
+    assert not os.path.exists(lease_path)
+    assert queue.get_result("a") == {"status": "ok"}
+    # A result is only returned once.
+    assert queue.get_result("a") is None
+
+
+def test_expired_leases_are_requeued(tmp_path):
+    queue = TaskQueue(str(tmp_path))
+    queue.submit("a", {})
+    lease_path, _ = queue.claim()
+
+    queue.requeue_expired(lease_timeout=60)
+    assert queue.claim() is None
+
+    stale = time.time() - 120
+    os.utime(lease_path, (stale, stale))
+    queue.requeue_expired(lease_timeout=60)
+    lease_path, task = queue.claim()
+    assert task["task_id"] == "a"
+
+
+def test_renewed_leases_are_not_requeued(tmp_path):
+    queue = TaskQueue(str(tmp_path))
+    queue.submit("a", {})
+    lease_path, _ = queue.claim()
+
+    stale = time.time() - 120
+    os.utime(lease_path, (stale, stale))
+    queue.renew(lease_path)
+    queue.requeue_expired(lease_timeout=60)
+    assert queue.claim() is None
+
+
+def test_a_requeued_task_gets_a_new_lease(tmp_path):
+    queue = TaskQueue(str(tmp_path))
+    queue.submit("a", {})
+    first_lease_path, _ = queue.claim()
+    stale = time.time() - 120
+    os.utime(first_lease_path, (stale, stale))
+    queue.requeue_expired(lease_timeout=60)
+    second_lease_path, _ = queue.claim()
+
+    assert second_lease_path != first_lease_path
+    # The first worker can neither renew nor release the lease of the second worker.
+    assert not queue.renew(first_lease_path)
+    assert not queue.complete(first_lease_path, "a", {"status": "late"})
+    assert os.path.exists(second_lease_path)
+    assert queue.get_result("a") is None
+
+    assert queue.renew(second_lease_path)
+    assert queue.complete(second_lease_path, "a", {"status": "ok"})
+    assert queue.get_result("a") == {"status": "ok"}
+
+
+def test_only_the_first_result_is_saved(tmp_path):
+    queue = TaskQueue(str(tmp_path))
+    queue.submit("a", {})
+    lease_path, _ = queue.claim()
+    assert queue.complete(lease_path, "a", {"status": "ok"})
+    assert queue.get_result("a") == {"status": "ok"}
+
+    # A result from a worker that also ran the task, e.g. one whose lease expired while it finished.
+    queue.submit("a", {})
+    lease_path, _ = queue.claim()
+    assert not queue.complete(lease_path, "a", {"status": "late"})
+    assert queue.get_result("a") is None
+
+
+def test_a_sweep_point_fails_if_no_worker_claims_it(tmp_path, monkeypatch):
+    monkeypatch.setattr(distributed, "POLL_INTERVAL", 0.01)
+    sweep = DistributedSweep(str(tmp_path), lease_timeout=0.01)
+    sweep.submit("first", {"crf": 20})
+    sweep.submit("second", {"crf": 24})
+
+    assert sweep.wait("first")["status"] == "failed_no_worker"
+    assert sweep.wait("second")["status"] == "failed_no_worker"
+    # The sweep point has been removed, so a worker that starts later doesn't run it.
+    assert TaskQueue(str(tmp_path)).claim() is None
+
+
+def _run_stub_worker(queue_folder, executions_path):
+    def execute_task(task, concurrent_jobs, cpu_set, cancel_event=None):
+        with open(executions_path, "a") as f:
+            f.write(f"{task['task_id']}\n")
+        time.sleep(0.05)
+        return {"status": "scored", "crf": task["crf"]}
+
+    distributed.execute_task = execute_task
+    run_worker(queue_folder, exit_when_idle=True)
+
+
+def test_several_workers_share_a_queue(tmp_path, monkeypatch):
+    # The workers log to logs.log in the working directory.
+    monkeypatch.chdir(tmp_path)
+    queue_folder = str(tmp_path / "queue")
+    executions_path = str(tmp_path / "executions.txt")
+    sweep = DistributedSweep(queue_folder, lease_timeout=60)
+    crfs = [18, 20, 22, 24, 26, 28]
+    for rank, crf in enumerate(crfs):
+        sweep.submit(crf, {"args": {}, "message": f"CRF {crf}", "crf": crf}, rank)
+
+    context = multiprocessing.get_context("fork")
+    workers = [
+        context.Process(target=_run_stub_worker, args=(queue_folder, executions_path))
+        for _ in range(2)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=30)
+        assert worker.exitcode == 0
+
+    results = [sweep.wait(crf) for crf in crfs]
+    assert [result["crf"] for result in results] == crfs
+    with open(executions_path, "r") as f:
+        executed_task_ids = f.read().split()
+    # Each task was run exactly once.
+    assert sorted(executed_task_ids) == sorted(set(executed_task_ids))
+    assert len(executed_task_ids) == len(crfs)
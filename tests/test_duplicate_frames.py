@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from duplicate_frames import can_stack_frames, expand_frame_metrics, get_plane_sizes
+
+
+def write_log(path, scores):
+    frames = [{"frameNum": i, "metrics": {"vmaf": score}} for i, score in enumerate(scores)]
+    path.write_text(json.dumps({"version": "3.0.0", "frames": frames, "pooled_metrics": {}}))
+
+
+def test_expand_frame_metrics(tmp_path):
+    json_file_path = tmp_path / "vmaf.json"
+    # Frames 1-4 and 6-8 are runs of identical pairs, of which only the first two were scored.
+    write_log(json_file_path, [90, 80, 70, 60, 50, 40])
+    scored_frame_indexes = [0, 1, 2, 2, 2, 3, 4, 5, 5]
+
+    assert expand_frame_metrics(json_file_path, scored_frame_indexes) == (9, 3)
+
+    log = json.loads(json_file_path.read_text())
+    assert [frame["frameNum"] for frame in log["frames"]] == list(range(9))
+    assert [frame["metrics"]["vmaf"] for frame in log["frames"]] == [
+        90,
+        80,
+        70,
+        70,
+        70,
+        60,
+        50,
+        40,
+        40,
+    ]
+    reused_from = [frame.get("reused_from") for frame in log["frames"]]
+    assert reused_from == [None, None, None, 2, 2, None, None, None, 7]
+    assert log["reused_frames"] == 3
+    assert log["pooled_metrics"]["vmaf"]["mean"] == pytest.approx(570 / 9)
+    assert log["pooled_metrics"]["vmaf"]["min"] == 40
+    assert log["pooled_metrics"]["vmaf"]["max"] == 90
+
+
+def test_expand_frame_metrics_stops_at_the_shorter_input(tmp_path):
+    json_file_path = tmp_path / "vmaf.json"
+    write_log(json_file_path, [90, 80])
+    assert expand_frame_metrics(json_file_path, [0, 1, 1, 2, 3]) == (3, 1)
+
+
+def test_plane_sizes():
+    assert get_plane_sizes(1920, 1080, "yuv420p") == [1920 * 1080, 960 * 540, 960 * 540]
+    assert get_plane_sizes(1919, 1079, "yuv420p10le") == [1919 * 1079 * 2] + [960 * 540 * 2] * 2
+    assert can_stack_frames(1080, "yuv420p")
+    assert not can_stack_frames(1079, "yuv420p")
+    assert can_stack_frames(1079, "yuv444p")
@@ -0,0 +1,47 @@
+import pytest
+
+from encoder_comparison import calculate_bd_rate, calculate_bd_vmaf, parse_encoder_crfs
+
+BITRATES = [1_000_000, 2_000_000, 4_000_000, 8_000_000]
+VMAF = [80.0, 88.0, 93.0, 96.0]
+
+
+def test_identical_curves():
+    assert calculate_bd_rate(BITRATES, VMAF, BITRATES, VMAF) == pytest.approx(0)
+    assert calculate_bd_vmaf(BITRATES, VMAF, BITRATES, VMAF) == pytest.approx(0)
+
+
+def test_lower_bitrate_for_the_same_vmaf():
+    test_bitrates = [bitrate * 0.8 for bitrate in BITRATES]
+    assert calculate_bd_rate(BITRATES, VMAF, test_bitrates, VMAF) == pytest.approx(-20)
+
+
+def test_higher_vmaf_for_the_same_bitrate():
+    test_vmaf = [vmaf + 2 for vmaf in VMAF]
+    assert calculate_bd_vmaf(BITRATES, VMAF, BITRATES, test_vmaf) == pytest.approx(2)
+
+
+def test_two_points_per_curve():
+    test_bitrates = [bitrate * 1.5 for bitrate in BITRATES[:2]]
+    assert calculate_bd_rate(BITRATES[:2], VMAF[:2], test_bitrates, VMAF[:2]) == pytest.approx(50)
+
+
+def test_curves_that_do_not_overlap():
+    assert calculate_bd_rate(BITRATES[:2], VMAF[:2], BITRATES[2:], VMAF[2:]) is None
+    assert calculate_bd_vmaf(BITRATES[:2], VMAF[:2], BITRATES[2:], VMAF[2:]) is None
+
+
+def test_parse_encoder_crfs():
+    assert parse_encoder_crfs(["x264:18,22", "x265:22,26,30"]) == [
+        ("x264", [18, 22]),
+        ("x265", [22, 26, 30]),
+    ]
+
+
+@pytest.mark.parametrize(
+    "values",
+    [["x264"], ["unknown:18,22"], ["x264:18"], ["x264:18,99"], ["x264:18,22", "x264:24,28"]],
+)
+def test_parse_encoder_crfs_rejects_invalid_values(values):
+    with pytest.raises(ValueError):
+        parse_encoder_crfs(values)
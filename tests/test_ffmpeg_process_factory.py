@@ -0,0 +1,58 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import ffmpeg_process_factory
+from ffmpeg_process_factory import (
+    FfmpegCancelled,
+    FfmpegError,
+    FfmpegProcess,
+    LibVmafArguments,
+    MultipleLibVmafArguments,
+)
+
+
+def test_multiple_libvmaf_arguments_filter_each_branch():
+    scaled = LibVmafArguments("24", "a.mkv", "original.mkv", "log_path=a.json")
+    scaled.scale_distorted(1920, 1080, "lanczos")
+    scaled.pixel_formats("yuv420p", None)
+    trimmed = LibVmafArguments("24", "b.mkv", "original.mkv", "log_path=b.json")
+    trimmed.trim_start(0, 2)
+
+    arguments = MultipleLibVmafArguments("24", [scaled, trimmed], "original.mkv")
+    arguments.video_filters("crop=1920:800")
+    filter_graph = arguments.get_arguments()[arguments.get_arguments().index("-lavfi") + 1]
+
+    assert filter_graph.split(";") == [
+        "[2:V:0]setpts=PTS-STARTPTS,crop=1920:800,split=2[ref0][ref1]",
+        "[0:V:0]scale=1920:1080:flags=lanczos,format=yuv420p,setpts=PTS-STARTPTS[dist0]",
+        "[ref0]setpts=PTS-STARTPTS[branchref0]",
+        "[dist0][branchref0]libvmaf=log_path=a.json[vmaf0]",
+        "[1:V:0]setpts=PTS-STARTPTS[dist1]",
+        "[ref1]trim=start_frame=2,setpts=PTS-STARTPTS[branchref1]",
+        "[dist1][branchref1]libvmaf=log_path=b.json:shortest=1[vmaf1]",
+    ]
+
+
+def test_a_cancelled_process_is_killed_and_not_retried(monkeypatch):
+    monkeypatch.setattr(
+        ffmpeg_process_factory,
+        "VideoInfoProvider",
+        lambda path: SimpleNamespace(get_framerate_float=lambda: 24.0),
+    )
+    cancel_event = threading.Event()
+    cancel_event.set()
+    args = SimpleNamespace(show_commands=False, stall_timeout=0, cancel_event=cancel_event)
+
+    with pytest.raises(FfmpegCancelled):
+        FfmpegProcess(["ffmpeg"], args).run("transcode.mkv", 10)
+    assert not issubclass(FfmpegCancelled, FfmpegError)
+
+
+def test_the_command_is_pinned_with_taskset(monkeypatch):
+    monkeypatch.setattr(ffmpeg_process_factory.shutil, "which", lambda name: f"/usr/bin/{name}")
+    args = SimpleNamespace(show_commands=False, cpu_set=[0, 1, 2, 3, 8])
+    process = FfmpegProcess(["ffmpeg", "-i", "a.mkv"], args)
+
+    assert process._get_command() == ["taskset", "-c", "0-3,8", "ffmpeg", "-i", "a.mkv"]
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from frame_sizes import FrameSizes, get_size_vmaf_correlation
+
+
+def create_frame_sizes(sizes):
+    return FrameSizes(np.arange(len(sizes)) / 24, sizes, ["P"] * len(sizes))
+
+
+def test_correlation_with_subsampled_frames():
+    sizes = np.tile([1000, 4000], 10)
+    # libvmaf's frame numbers are the indexes of the scored frames (every 3rd frame with -subsample 3).
+    frame_numbers = np.arange(0, 20, 3)
+    vmaf_scores = sizes[frame_numbers] / 100
+    correlation = get_size_vmaf_correlation(create_frame_sizes(sizes), frame_numbers, vmaf_scores)
+    assert correlation == pytest.approx(1)
+
+
+def test_correlation_leaves_out_reused_frames():
+    sizes = np.array([5000, 100, 4000, 3000, 100, 100, 2000])
+    vmaf_scores = np.array([95, 95, 90, 85, 85, 85, 80])
+    reused = np.array([False, True, False, False, True, True, False])
+    correlation = get_size_vmaf_correlation(
+        create_frame_sizes(sizes), np.arange(len(sizes)), vmaf_scores, reused
+    )
+    assert correlation == pytest.approx(1)
+
+
+def test_correlation_is_undefined_for_constant_scores():
+    sizes = np.array([1000, 2000, 3000])
+    assert get_size_vmaf_correlation(create_frame_sizes(sizes), np.arange(3), [90, 90, 90]) is None
@@ -0,0 +1,27 @@
+import json
+
+import pytest
+
+import metrics
+from metrics import read_frames_in_chunks
+
+
+@pytest.mark.parametrize("indent", [None, 4])
+def test_read_frames_in_chunks(tmp_path, monkeypatch, indent):
+    # A small read size, so that frames are split between reads.
+    monkeypatch.setattr(metrics, "READ_SIZE", 100)
+    frames = [{"frameNum": i, "metrics": {"vmaf": i / 2}} for i in range(25)]
+    json_file_path = tmp_path / "vmaf.json"
+    json_file_path.write_text(
+        json.dumps({"version": "3.0.0", "frames": frames, "pooled_metrics": {}}, indent=indent)
+    )
+
+    chunks = list(read_frames_in_chunks(json_file_path, chunk_size=10))
+    assert [len(chunk) for chunk in chunks] == [10, 10, 5]
+    assert [frame for chunk in chunks for frame in chunk] == frames
+
+
+def test_read_frames_in_chunks_without_frames(tmp_path):
+    json_file_path = tmp_path / "vmaf.json"
+    json_file_path.write_text(json.dumps({"frames": []}))
+    assert list(read_frames_in_chunks(json_file_path)) == []
@@ -0,0 +1,72 @@
+import math
+
+import numpy as np
+import pytest
+
+from streaming_stats import StreamingStats, TDigest
+
+
+@pytest.fixture
+def scores():
+    return np.random.default_rng(0).uniform(60, 100, 10_000)
+
+
+def test_update_matches_numpy(scores):
+    stats = StreamingStats()
+    for frame_number, score in enumerate(scores):
+        stats.update(score, frame_number)
+
+    assert stats.count == len(scores)
+    assert stats.mean == pytest.approx(scores.mean())
+    assert stats.std == pytest.approx(scores.std())
+    assert stats.min == scores.min()
+    assert stats.max == scores.max()
+    assert stats.min_frame == int(scores.argmin())
+    assert stats.harmonic_mean == pytest.approx(1 / np.mean(1 / (scores + 1)) - 1)
+
+
+def test_update_batch_in_chunks_matches_update(scores):
+    frame_numbers = list(range(len(scores)))
+    chunked = StreamingStats()
+    for start in range(0, len(scores), 1000):
+        chunked.update_batch(scores[start : start + 1000], frame_numbers[start : start + 1000])
+
+    single = StreamingStats()
+    for frame_number, score in enumerate(scores):
+        single.update(score, frame_number)
+
+    for statistic in ["frame_count", "worst_frame", "min", "max"]:
+        assert chunked.summary()[statistic] == single.summary()[statistic]
+    for statistic in ["mean", "std", "harmonic_mean"]:
+        assert chunked.summary()[statistic] == pytest.approx(single.summary()[statistic])
+
+
+def test_empty_stats():
+    stats = StreamingStats()
+    stats.update_batch([])
+    assert stats.count == 0
+    assert math.isnan(stats.mean)
+    assert math.isnan(stats.quantile(0.5))
+
+
+def test_tdigest_quantiles(scores):
+    digest = TDigest(compression=200)
+    digest.update_batch(scores)
+    for q in [0.01, 0.05, 0.5, 0.95]:
+        assert digest.quantile(q) == pytest.approx(np.quantile(scores, q), abs=0.2)
+    assert digest.quantile(0) == scores.min()
+    assert digest.quantile(1) == scores.max()
+
+
+def test_tdigest_is_bounded(scores):
+    digest = TDigest(compression=100, buffer_size=1000)
+    digest.update_batch(np.tile(scores, 5))
+    assert len(digest._buffer) < 1000
+    digest.quantile(0.5)
+    assert len(digest._means) <= 200
+
+
+def test_tdigest_single_value():
+    digest = TDigest()
+    digest.update(42.0)
+    assert digest.quantile(0.01) == 42.0
@@ -0,0 +1,15 @@
+from utils import flush_logs, Logger
+
+
+def test_records_logged_after_flush_logs_are_written(tmp_path):
+    log_path = tmp_path / "test.log"
+    log = Logger("test_utils", filename=str(log_path), print_to_terminal=False)
+
+    log.info("first")
+    flush_logs()
+    log.info("second")
+    flush_logs()
+    # Stopping a stopped writer again (as the atexit handler does) is a no-op.
+    flush_logs()
+
+    assert log_path.read_text().splitlines() == ["[test_utils] first", "[test_utils] second"]
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from worst_segments import find_worst_segments, rolling_mean, rolling_min
+
+
+def naive_rolling(values, window, function):
+    return np.array([function(values[i : i + window]) for i in range(len(values) - window + 1)])
+
+
+@pytest.mark.parametrize("length, window", [(1, 1), (10, 1), (10, 3), (10, 5), (10, 10), (97, 8)])
+def test_rolling_windows_match_naive(length, window):
+    values = np.random.default_rng(length + window).uniform(0, 100, length)
+    np.testing.assert_allclose(rolling_mean(values, window), naive_rolling(values, window, np.mean))
+    np.testing.assert_array_equal(
+        rolling_min(values, window), naive_rolling(values, window, np.min)
+    )
+
+
+def test_find_worst_segments():
+    scores = np.full(100, 95.0)
+    scores[40:50] = 60
+    scores[80:90] = 80
+    segments = find_worst_segments(scores, np.arange(100), 10, 1, 3)
+
+    assert [segment["start_frame"] for segment in segments[:2]] == [40, 80]
+    assert segments[0]["mean"] == 60
+    assert segments[0]["start_time"] == 4
+    assert segments[0]["end_time"] == 5
+    # The segments don't overlap.
+    starts = sorted(segment["start_frame"] for segment in segments)
+    assert all(later - earlier >= 10 for earlier, later in zip(starts, starts[1:]))
+
+
+def test_find_worst_segments_with_subsampled_frames():
+    scores = np.full(50, 95.0)
+    scores[10:15] = 50
+    segments = find_worst_segments(scores, np.arange(0, 100, 2), 10, 1, 1)
+    assert segments == [
+        {
+            "start_frame": 20,
+            "end_frame": 29,
+            "start_time": 2.0,
+            "end_time": 3.0,
+            "mean": 50.0,
+            "min": 50.0,
+        }
+    ]
+
+
+def test_find_worst_segments_disabled():
+    assert find_worst_segments(np.ones(10), np.arange(10), 10, 1, 0) == []
@@ -0,0 +1,144 @@
+import math
+import os
+
+from utils import Logger
+
+log = Logger("thread_budget")
+
+
+def parse_cpu_set(cpu_set):
+    """
+    Parses a CPU list in the same format as taskset -c, e.g. "0-3,8,10-11".
+    """
+    cpus = set()
+    for part in cpu_set.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+
+def format_cpu_set(cpus):
+    """
+    The inverse of parse_cpu_set, e.g. [0, 1, 2, 3, 8] is "0-3,8".
+    """
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(first) if first == last else f"{first}-{last}" for first, last in ranges)
+
+
+def get_allowed_cpus():
+    """
+    The CPUs in the CPU affinity mask of this process.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return set(os.sched_getaffinity(0))
+    return set(range(os.cpu_count() or 1))
+
+
+def get_cgroup_cpu_limit():
+    """
+    Returns the number of CPUs allowed by the cgroup CPU quota, or None if there is no quota.
+    Both cgroup v2 (cpu.max) and cgroup v1 (cpu.cfs_quota_us) are supported.
+    """
+    try:
+        with open("/sys/fs/cgroup/cpu.max", "r") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "r") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us", "r") as f:
+            period = int(f.read())
+        if quota > 0 and period > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+
+    return None
+
+
+def get_available_cpus(cpu_set=None):
+    """
+    The number of CPUs this process can actually use, taking the CPU affinity mask,
+    the cgroup CPU quota and the --cpu-set argument into account.
+    """
+    allowed_cpus = get_allowed_cpus()
+    # The validator makes sure that the --cpu-set is within the CPU affinity mask.
+    if cpu_set:
+        allowed_cpus = set(cpu_set) & allowed_cpus
+
+    available = len(allowed_cpus)
+
+    cgroup_limit = get_cgroup_cpu_limit()
+    if cgroup_limit is not None:
+        available = min(available, max(1, math.floor(cgroup_limit)))
+
+    return max(1, available)
+
+
+class ThreadBudget:
+    """
+    Splits the available CPUs between the jobs that are expected to run at the same time.
+    Within a job, the encode and the libvmaf pass run one after the other, so each of them gets the whole share.
+    """
+
+    def __init__(self, available_cpus, concurrent_jobs=1):
+        self.available_cpus = available_cpus
+        self.concurrent_jobs = max(1, concurrent_jobs)
+        self.threads_per_job = max(1, available_cpus // self.concurrent_jobs)
+
+    @property
+    def encoder_threads(self):
+        return self.threads_per_job
+
+    @property
+    def filter_threads(self):
+        return self.threads_per_job
+
+    @property
+    def vmaf_threads(self):
+        return self.threads_per_job
+
+    def describe(self):
+        return (
+            f"{self.available_cpus} CPU(s) available, {self.concurrent_jobs} concurrent job(s), "
+            f"{self.threads_per_job} thread(s) per job"
+        )
+
+
+def apply_thread_budget(args, concurrent_jobs=None):
+    """
+    Fills in any thread counts that were not specified by the user, so that the encoder,
+    FFmpeg's filtergraphs and libvmaf all use the same budget.
+    """
+    if args.cpu_set and not isinstance(args.cpu_set, list):
+        args.cpu_set = parse_cpu_set(args.cpu_set)
+
+    if concurrent_jobs is None:
+        concurrent_jobs = args.concurrent_jobs
+
+    budget = ThreadBudget(get_available_cpus(args.cpu_set), concurrent_jobs)
+
+    if args.n_threads is None:
+        args.n_threads = str(budget.vmaf_threads)
+    if args.encoder_threads is None:
+        args.encoder_threads = budget.encoder_threads
+    args.filter_threads = budget.filter_threads
+
+    log.info(f"Thread budget: {budget.describe()}")
+    return budget
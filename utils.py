@@ -1,43 +1,144 @@
+import atexit
+from datetime import datetime, timezone
+import json
 import logging
+from logging.handlers import QueueHandler, QueueListener
 import math
 import numpy as np
 import os
 from pathlib import Path
+import queue
+import shutil
+import subprocess
 import sys
 from time import time
+import uuid
 
 from ffmpeg import probe
 import matplotlib.pyplot as plt
 from tqdm import tqdm
 
 
-class Logger:
-    def __init__(self, name, filename="logs.log", print_to_terminal=True):
-        with open(filename, "w"):
-            pass
+class _TextFormatter(logging.Formatter):
+    def format(self, record):
+        level = "" if record.levelno == logging.INFO else f"[{record.levelname}] "
+        return f"[{record.name}] {level}{record.getMessage()}"
 
-        logger = logging.getLogger(name)
-        logger.setLevel(10)
 
-        file_handler = logging.FileHandler(filename)
-        logger.addHandler(file_handler)
-        self._file_handler = file_handler
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(
+            {
+                "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+                "level": record.levelname,
+                "logger": record.name,
+                "run_id": getattr(record, "run_id", None),
+                "point": getattr(record, "point", None),
+                "message": record.getMessage(),
+            }
+        )
+
+
+# The run ID and the sweep point that each log record is tagged with.
+_log_context = {"run_id": uuid.uuid4().hex[:8], "point": None}
+_log_json_lines = False
+# A background writer for each log file, keyed by its filename.
+_log_writers = {}
+
+
+def set_log_context(**fields):
+    _log_context.update(fields)
+
+
+class _LogWriter:
+    """
+    Writes the records of a log file from a background thread, so that logging never waits for the disk.
+    The file is appended to, so that concurrent jobs in the same folder don't clobber each other's logs.
+    """
+
+    def __init__(self, filename):
+        self.pid = os.getpid()
+        self.queue = queue.SimpleQueue()
+        self.file_handler = logging.FileHandler(filename, mode="a", delay=True)
+        self.file_handler.setFormatter(_JsonFormatter() if _log_json_lines else _TextFormatter())
+        self._listener = QueueListener(self.queue, self.file_handler)
+        self._listener.start()
+        self.stopped = False
+        atexit.register(self.stop)
+
+    def stop(self):
+        # Writes the records that are still in the queue. QueueListener.stop fails if it is called twice
+        # (e.g. by flush_logs and then by the atexit handler).
+        if self.pid == os.getpid() and not self.stopped:
+            self.stopped = True
+            self._listener.stop()
+            self.file_handler.close()
+
 
-        if print_to_terminal:
-            logger.addHandler(logging.StreamHandler())
+def _get_log_writer(filename):
+    writer = _log_writers.get(filename)
+    # The thread of the writer does not survive a fork (e.g. the jobs of server.py),
+    # and a stopped writer is replaced so that the records that are logged afterwards are written too.
+    if writer is None or writer.pid != os.getpid() or writer.stopped:
+        writer = _LogWriter(filename)
+        _log_writers[filename] = writer
+    return writer
+
+
+class _BackgroundFileHandler(QueueHandler):
+    def __init__(self, filename):
+        super().__init__(None)
+        self._filename = filename
+
+    def prepare(self, record):
+        record = super().prepare(record)
+        record.run_id = _log_context["run_id"]
+        record.point = _log_context["point"]
+        return record
+
+    def enqueue(self, record):
+        _get_log_writer(self._filename).queue.put_nowait(record)
+
+
+def flush_logs():
+    """
+    Writes the queued log records of this process. Only needed if the process exits without running
+    the atexit handlers (e.g. with os._exit).
+    """
+    for writer in _log_writers.values():
+        writer.stop()
+
+
+def configure_logging(json_lines=False):
+    """
+    Sets the format of the log files. Called once, when the arguments have been parsed.
+    """
+    global _log_json_lines
+    _log_json_lines = json_lines
+    for writer in _log_writers.values():
+        writer.file_handler.setFormatter(_JsonFormatter() if json_lines else _TextFormatter())
+
+
+class Logger:
+    def __init__(self, name, filename="logs.log", print_to_terminal=True):
+        logger = logging.getLogger(name)
+        # The handlers are only added once, however many times the logger is instantiated.
+        if not logger.handlers:
+            logger.setLevel(10)
+            logger.propagate = False
+            logger.addHandler(_BackgroundFileHandler(filename))
+            if print_to_terminal:
+                logger.addHandler(logging.StreamHandler())
 
         self._logger = logger
 
     def info(self, msg):
-        self._file_handler.setFormatter(logging.Formatter("[%(name)s] %(message)s"))
         self._logger.info(msg)
 
     def warning(self, msg):
-        self._file_handler.setFormatter(logging.Formatter("[%(name)s] [WARNING] %(message)s"))
         self._logger.warning(msg)
 
     def debug(self, msg):
-        self._file_handler.setFormatter(logging.Formatter("[%(name)s] [DEBUG] %(message)s"))
         self._logger.debug(msg)
 
 
@@ -51,21 +152,60 @@ class Timer:
         return time_rounded
 
 
+# The ffprobe output of each video, keyed by its path, size and modification time.
+_probe_cache = {}
+
+
+def cached_probe(video_path):
+    stat = os.stat(video_path)
+    key = (os.path.abspath(video_path), stat.st_size, stat.st_mtime_ns)
+    if key not in _probe_cache:
+        _probe_cache[key] = probe(video_path)
+    return _probe_cache[key]
+
+
+def get_probe_cache():
+    return dict(_probe_cache)
+
+
+def update_probe_cache(entries):
+    _probe_cache.update(entries)
+
+
 class VideoInfoProvider:
     def __init__(self, video_path):
         self._video_path = video_path
 
-    def get_bitrate(self, decimal_places, video_path=None):
+    def get_bitrate_bps(self, video_path=None):
         if video_path:
-            bitrate = probe(video_path)["format"]["bit_rate"]
+            bitrate = cached_probe(video_path)["format"]["bit_rate"]
         else:
-            bitrate = probe(self._video_path)["format"]["bit_rate"]
-        return f"{force_decimal_places((int(bitrate) / 1_000_000), decimal_places)} Mbps"
+            bitrate = cached_probe(self._video_path)["format"]["bit_rate"]
+        return int(bitrate)
+
+    def get_bitrate(self, decimal_places, video_path=None):
+        bitrate = self.get_bitrate_bps(video_path)
+        return f"{force_decimal_places((bitrate / 1_000_000), decimal_places)} Mbps"
+
+    def get_resolution(self):
+        video_stream = [
+            stream
+            for stream in cached_probe(self._video_path)["streams"]
+            if stream["codec_type"] == "video"
+        ][0]
+        return int(video_stream["width"]), int(video_stream["height"])
+
+    def get_pixel_format(self):
+        return [
+            stream
+            for stream in cached_probe(self._video_path)["streams"]
+            if stream["codec_type"] == "video"
+        ][0]["pix_fmt"]
 
     def get_framerate_fraction(self):
         r_frame_rate = [
             stream
-            for stream in probe(self._video_path)["streams"]
+            for stream in cached_probe(self._video_path)["streams"]
             if stream["codec_type"] == "video"
         ][0]["r_frame_rate"]
         return r_frame_rate
@@ -75,27 +215,45 @@ class VideoInfoProvider:
         return int(numerator) / int(denominator)
 
     def get_duration(self):
-        return float(probe(self._video_path)["format"]["duration"])
+        return float(cached_probe(self._video_path)["format"]["duration"])
 
 
 log = Logger("utils")
 
 
-def cut_video(filename, args, output_ext, output_folder, comparison_table):
+def get_cut_video_path(filename, args, output_ext, output_folder):
     cut_version_filename = f"{Path(filename).stem} [{args.encode_length}s]{output_ext}"
+    return os.path.join(output_folder, cut_version_filename)
+
+
+def cut_video(filename, args, output_ext, output_folder, comparison_table, output_file_path=None):
     # Output path for the cut video.
-    output_file_path = os.path.join(output_folder, cut_version_filename)
+    if output_file_path is None:
+        output_file_path = get_cut_video_path(filename, args, output_ext, output_folder)
     # The reference file will be the cut version of the video.
     # Create the cut version.
     log.info(f"Cutting the video to a length of {args.encode_length} seconds...")
-    os.system(
-        f"ffmpeg -loglevel warning -y -i {args.original_video_path} -t {args.encode_length} "
-        f'-map 0 -c copy "{output_file_path}"'
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-loglevel",
+            "warning",
+            "-y",
+            "-i",
+            args.original_video_path,
+            "-t",
+            str(args.encode_length),
+            "-map",
+            "0",
+            "-c",
+            "copy",
+            output_file_path,
+        ]
     )
     log.info("Done!")
 
     time_message = (
-        f" for {args.encode_length} seconds" if int(args.encode_length) > 1 else "for 1 second"
+        f" for {args.encode_length} seconds" if float(args.encode_length) != 1 else " for 1 second"
     )
 
     with open(comparison_table, "w") as f:
@@ -108,7 +266,7 @@ def exit_program(message):
     line()
     log.info(f"{message}\nThis program will now exit.")
     line()
-    sys.exit()
+    sys.exit(1)
 
 
 def force_decimal_places(value, decimal_places):
@@ -120,7 +278,8 @@ def is_list(argument_object):
 
 
 def line():
-    width, height = os.get_terminal_size()
+    # Falls back to 80 columns when the output is not a terminal, e.g. when running as a server job.
+    width, height = shutil.get_terminal_size()
     log.info("-" * width)
 
 
@@ -163,7 +322,7 @@ def plot_graph(
     plt.clf()
 
 
-def show_progress_bar(ffmpeg_process, total_frames):
+def show_progress_bar(ffmpeg_process, total_frames, on_progress=None):
     progress_bar = tqdm(
             total=total_frames,
             unit=" frames",
@@ -172,15 +331,26 @@ def show_progress_bar(ffmpeg_process, total_frames):
 
     progress_bar.clear()
     previous_frame_number = 0
+    # The key=value pairs of the current block of -progress output.
+    progress = {}
 
     try:
-        while ffmpeg_process.poll() is None:
-            line = ffmpeg_process.stdout.readline().decode("utf-8")
+        # Read until EOF rather than polling, so that the process is left for the caller to reap.
+        for raw_line in iter(ffmpeg_process.stdout.readline, b""):
+            line = raw_line.decode("utf-8")
+            key, _, value = line.strip().partition("=")
+            progress[key] = value
             if "frame=" in line:
                 frame_number = int(line[6:])
                 frame_number_increase = frame_number - previous_frame_number
                 progress_bar.update(frame_number_increase)
                 previous_frame_number = frame_number
+            # FFmpeg writes a "progress=" line at the end of each block of -progress output.
+            elif line.startswith("progress="):
+                if on_progress:
+                    on_progress(progress)
+                progress = {}
+        progress_bar.close()
     except KeyboardInterrupt:
         progress_bar.close()
         ffmpeg_process.kill()
@@ -199,9 +369,45 @@ def write_table_info(table_path, video_filename, original_bitrate, args, crf_or_
             f"n_subsample: {args.subsample}"
         )
 
+# The VMAF models that can be requested with --vmaf-models.
+VMAF_MODELS = {
+    "hd": {"path": "vmaf_models/vmaf_v0.6.1.json", "enable_transform": False},
+    "4k": {"path": "vmaf_models/vmaf_4k_v0.6.1.json", "enable_transform": False},
+    "phone": {"path": "vmaf_models/vmaf_v0.6.1.json", "enable_transform": True},
+}
+
+
+def get_vmaf_models(args):
+    """
+    Returns a list of (metric type, libvmaf model name, model) tuples. The first model is the primary one;
+    its metric type is always "VMAF" and its scores are used for the comparison graphs.
+    """
+    model_ids = list(args.vmaf_models) if args.vmaf_models else ["hd"]
+    if args.phone_model:
+        if not args.vmaf_models:
+            model_ids = ["phone"]
+        elif "phone" not in model_ids:
+            model_ids.append("phone")
+
+    vmaf_models = []
+    for i, model_id in enumerate(model_ids):
+        if i == 0:
+            vmaf_models.append(("VMAF", "vmaf", VMAF_MODELS[model_id]))
+        else:
+            vmaf_models.append(
+                (f"VMAF-{model_id.upper()}", f"vmaf_{model_id}", VMAF_MODELS[model_id])
+            )
+    return vmaf_models
+
+
+def get_metric_key_prefix(metric_type):
+    # E.g. "MS-SSIM" -> "ms_ssim", for the keys of the machine-readable results.
+    return metric_type.lower().replace("-", "_").replace(" ", "_")
+
+
 def get_metrics_list(args):
     metrics_list = [
-        "VMAF",
+        *[metric_type for metric_type, _, _ in get_vmaf_models(args)],
         "PSNR" if args.calculate_psnr else None,
         "SSIM" if args.calculate_ssim else None,
         "MS-SSIM" if args.calculate_msssim else None
@@ -0,0 +1,193 @@
+from argparse import Namespace
+import json
+import os
+
+import numpy as np
+from prettytable import PrettyTable
+
+from ffmpeg_process_factory import FfmpegError, FfmpegProcessFactory, SegmentArguments
+from libvmaf import run_libvmaf
+from streaming_stats import StreamingStats
+from supervisor import run_with_retries
+from utils import force_decimal_places, get_vmaf_models, line, Logger
+
+log = Logger("worst_segments")
+
+WORST_SEGMENTS_FILENAME = "Worst Segments.json"
+
+
+def rolling_mean(values, window):
+    cumulative = np.concatenate([[0.0], np.cumsum(values, dtype=np.float64)])
+    return (cumulative[window:] - cumulative[:-window]) / window
+
+
+def rolling_min(values, window):
+    """
+    The minimum of every window of values in linear time (van Herk/Gil-Werman). The values are split into
+    blocks of window values, and the minimum of a window is the minimum of the suffix of the block where it starts
+    and the prefix of the block where it ends.
+    """
+    padding = (-len(values)) % window
+    blocks = np.concatenate([values, np.full(padding, np.inf)]).reshape(-1, window)
+    prefix_min = np.minimum.accumulate(blocks, axis=1).ravel()
+    suffix_min = np.minimum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    return np.minimum(suffix_min[: len(values) - window + 1], prefix_min[window - 1 : len(values)])
+
+
+def find_worst_segments(scores, frame_numbers, fps, segment_length, count):
+    """
+    Returns the count non-overlapping segments of segment_length seconds with the lowest mean score,
+    worst first. frame_numbers may be subsampled (n_subsample), in which case the window covers fewer scores.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    frame_numbers = np.asarray(frame_numbers)
+    if count < 1 or len(scores) == 0:
+        return []
+
+    frame_step = int(frame_numbers[1] - frame_numbers[0]) if len(frame_numbers) > 1 else 1
+    window = min(len(scores), max(1, round(segment_length * fps / max(1, frame_step))))
+    window_means = rolling_mean(scores, window)
+    window_mins = rolling_min(scores, window)
+
+    segments = []
+    candidates = window_means.copy()
+    for _ in range(count):
+        start = int(np.argmin(candidates))
+        if not np.isfinite(candidates[start]):
+            break
+        end = start + window - 1
+        segments.append(
+            {
+                "start_frame": int(frame_numbers[start]),
+                "end_frame": int(frame_numbers[end]) + frame_step - 1,
+                "start_time": float(frame_numbers[start] / fps),
+                "end_time": float((frame_numbers[end] + frame_step) / fps),
+                "mean": float(window_means[start]),
+                "min": float(window_mins[start]),
+            }
+        )
+        # The next segment must not overlap with this one.
+        candidates[max(0, start - window + 1) : end + 1] = np.inf
+    return segments
+
+
+def save_worst_segments(output_folder, worst_segments, segment_length, decimal_places):
+    """
+    worst_segments maps each metric type to its worst segments.
+    """
+    with open(os.path.join(output_folder, WORST_SEGMENTS_FILENAME), "w") as f:
+        json.dump({"segment_length": segment_length, "metrics": worst_segments}, f, indent=4)
+
+    for metric_type, segments in worst_segments.items():
+        table = PrettyTable()
+        table.field_names = ["Start", "End", f"Mean {metric_type}", f"Min {metric_type}"]
+        for segment in segments:
+            table.add_row(
+                [
+                    format_timestamp(segment["start_time"]),
+                    format_timestamp(segment["end_time"]),
+                    force_decimal_places(segment["mean"], decimal_places),
+                    force_decimal_places(segment["min"], decimal_places),
+                ]
+            )
+        log.info(f"The worst {segment_length:g}-second segments ({metric_type}):\n{table}")
+
+
+def load_worst_segments(output_folder, metric_type="VMAF"):
+    path = os.path.join(output_folder, WORST_SEGMENTS_FILENAME)
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        return json.load(f)["metrics"].get(metric_type, [])
+
+
+def format_timestamp(seconds):
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(int(minutes), 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:06.3f}"
+
+
+def extract_segment(args, video_path, output_path, segment):
+    """
+    Extracts a segment of a video losslessly (FFV1), so that it can be scored without re-decoding the whole video.
+    """
+    duration = segment["end_time"] - segment["start_time"]
+    arguments = SegmentArguments(video_path, output_path, segment["start_time"], duration)
+    FfmpegProcessFactory().create_process(arguments, args).run(video_path, duration)
+    return output_path
+
+
+def rescore_worst_segments(
+    args, output_folder, transcode_path, reference_path, fps, crf_or_preset=None
+):
+    """
+    Extracts the worst VMAF segments of the transcode and the reference and scores every frame of them
+    (regardless of -subsample). Returns the VMAF of each segment, or an empty list if there are no segments.
+    """
+    segments = load_worst_segments(output_folder)
+    if not segments or not os.path.exists(transcode_path):
+        return []
+
+    segments_folder = os.path.join(output_folder, "Worst Segments")
+    os.makedirs(segments_folder, exist_ok=True)
+    segment_args = Namespace(**vars(args))
+    segment_args.subsample = 1
+    vmaf_model_name = get_vmaf_models(segment_args)[0][1]
+
+    rescored = []
+    for i, segment in enumerate(segments, start=1):
+        line()
+        log.info(
+            f"Re-scoring segment {i} ({format_timestamp(segment['start_time'])} - "
+            f"{format_timestamp(segment['end_time'])})..."
+        )
+        duration = segment["end_time"] - segment["start_time"]
+        json_file_path = os.path.join(segments_folder, f"Segment {i}.json")
+        try:
+            distorted_segment = extract_segment(
+                args, transcode_path, os.path.join(segments_folder, f"Segment {i}.mkv"), segment
+            )
+            reference_segment = extract_segment(
+                args,
+                reference_path,
+                os.path.join(segments_folder, f"Segment {i} (reference).mkv"),
+                segment,
+            )
+            run_with_retries(
+                lambda: run_libvmaf(
+                    distorted_segment,
+                    segment_args,
+                    json_file_path,
+                    fps,
+                    reference_segment,
+                    FfmpegProcessFactory(),
+                    duration,
+                    crf_or_preset,
+                ),
+                f"VMAF calculation of segment {i}",
+                args.max_retries,
+                args.retry_backoff,
+            )
+        except FfmpegError as error:
+            log.info(f"Unable to re-score segment {i}: {error}")
+            continue
+
+        with open(json_file_path, "r") as f:
+            frames = json.load(f)["frames"]
+        stats = StreamingStats()
+        stats.update_batch(
+            [frame["metrics"][vmaf_model_name] for frame in frames],
+            [frame["frameNum"] for frame in frames],
+        )
+        summary = stats.summary()
+        rescored.append(
+            {**segment, "rescored_mean": summary["mean"], "rescored_min": summary["min"]}
+        )
+        log.info(
+            f"Segment {i}: VMAF {force_decimal_places(summary['mean'], args.decimal_places)} "
+            f"(min {force_decimal_places(summary['min'], args.decimal_places)})"
+        )
+
+    with open(os.path.join(segments_folder, "Rescored Segments.json"), "w") as f:
+        json.dump(rescored, f, indent=4)
+    return rescored